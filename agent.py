@@ -0,0 +1,219 @@
+# agent.py
+"""A simple bot that plays Tetris through the same actions as a player.
+
+For the falling shape the agent tries every rotation and every sideways
+shift, drops the result, and scores the board it would leave behind with
+a weighted sum of a few features (lines cleared, total column height,
+holes and bumpiness). It then returns the actions that lead to the best
+placement, e.g. ['Rotate Right', 'Left', 'Left', 'All Down'].
+
+The search works on a copy of the board as one integer bit mask per row,
+so it never touches Blocks or the display. The features of the board are
+computed once per shape, and each placement only recomputes the columns
+and rows it touches (features.py). Agents can share a PlacementCache
+(evalcache.py) so the placements of a shape already evaluated on the
+same board, in this game or another, are not computed again.
+
+Example:
+    agent = GreedyAgent()
+    for action in agent.plan(game.board):
+        game.queue.put_nowait(action)
+"""
+
+import bisect
+
+from features import FEATURES, BoardFeatures
+from kicks import rotate
+
+
+############################################################
+# BOARD AS BIT MASKS
+############################################################
+
+def board_rows(board, skip=()):
+    ''' Parameters: board - type: Board
+                    skip - blocks to leave out, e.g. those of the falling shape
+        Return value: type: list - one int per row, bit x set when column x is taken
+    '''
+    rows = [0]*board.height
+    blank = board.blank_block
+    for x, column in enumerate(board.grid):
+        bit = 1 << x
+        for y, block in enumerate(column):
+            if block is not blank and block not in skip:
+                rows[y] |= bit
+    return rows
+
+def snapshot(board):
+    ''' Return value: type: tuple - (rows, width, cells, center, kind, rotation):
+        the board without its falling shape, and that shape's cells, center
+        block, letter and rotation state
+    '''
+    shape = board.active_shape
+    blocks = shape.get_blocks()
+    cells = [(b.x, b.y) for b in blocks]
+    center = (shape.center_block.x, shape.center_block.y)
+    return board_rows(board, skip=blocks), board.width, cells, center, shape.kind, shape.rotation
+
+def fits(rows, width, cells):
+    ''' Return value: type: bool - whether every (x, y) in cells is on the board and free '''
+    height = len(rows)
+    for x, y in cells:
+        if x < 0 or y < 0 or x >= width or y >= height or rows[y] >> x & 1:
+            return False
+    return True
+
+def columns_of(rows, width):
+    ''' Return value: type: list - per column, the sorted rows where it is taken '''
+    columns = [[] for x in range(width)]
+    for y, row in enumerate(rows):
+        while row:
+            low = row & -row
+            columns[low.bit_length()-1].append(y)
+            row ^= low
+    return columns
+
+def drop(columns, height, cells):
+    ''' Parameters: columns - type: list - from columns_of
+                    height - type: int - rows on the board
+        Return value: type: list - cells moved down as far as they fit
+    '''
+    bottoms = {} # column -> the lowest cell of the shape in it
+    for x, y in cells:
+        if y > bottoms.get(x, -1): bottoms[x] = y
+    d = height
+    for x, y in bottoms.items():
+        column = columns[x]
+        i = bisect.bisect_right(column, y)
+        below = column[i] if i < len(column) else height
+        if below - y - 1 < d: d = below - y - 1
+    return [(x, y+d) for x, y in cells]
+
+def land(rows, width, cells):
+    ''' Locks cells into a copy of rows and removes the complete rows
+        Return value: type: tuple - (new rows, number of cleared rows)
+    '''
+    rows = list(rows)
+    for x, y in cells:
+        rows[y] |= 1 << x
+    full = (1 << width) - 1
+    kept = [row for row in rows if row != full]
+    cleared = len(rows) - len(kept)
+    return [0]*cleared + kept, cleared
+
+
+############################################################
+# PLACEMENTS
+############################################################
+
+# How many Rotate Right steps, and the actions that get there
+ROTATIONS = [(0, []), (1, ['Rotate Right']), (2, ['Rotate Right', 'Rotate Right']),
+             (3, ['Rotate Left'])]
+MAX_DOWN = 2
+
+def placements(rows, width, cells, center, kind=None, rotation=0):
+    ''' Every place the shape can be dropped from, reached by rotating
+        first and then moving sideways, as the actions a player would use.
+        Rotations use the wall kicks of Board.rotate (kicks.py); a shape
+        that still cannot rotate where it is moves down first, up to
+        MAX_DOWN rows.
+        Yields: (actions, cells) - cells are where the shape lands
+    '''
+    for actions, landed, turns, column in landings(rows, width, cells, center, kind, rotation):
+        yield actions, landed
+
+def landings(rows, width, cells, center, kind=None, rotation=0):
+    ''' placements() with where each one ends up
+        Yields: (actions, cells, turns, column) - turns is the number of
+        quarter turns to the right, column the x of the shape's center
+        after its wall kicks and sideways moves
+    '''
+    columns = columns_of(rows, width)
+    height = len(rows)
+    free = lambda cells: fits(rows, width, cells)
+    for turns, rotations in ROTATIONS:
+        turned = None
+        for downs in range(MAX_DOWN+1):
+            start = [(x, y+downs) for x, y in cells]
+            if not free(start): break
+            state = (start, (center[0], center[1]+downs), rotation)
+            for action in rotations:
+                state = rotate(state[0], state[1], kind, state[2], action.split()[1], free)
+                if state is None: break
+            if state is not None:
+                turned, column = state[0], state[1][0]
+                break
+        if turned is None: continue
+        actions = ['Down']*downs + rotations
+        yield actions + ['All Down'], drop(columns, height, turned), turns, column
+        for direction, dx in (('Left', -1), ('Right', 1)):
+            shifted, moves = turned, []
+            while True:
+                shifted = [(x+dx, y) for x, y in shifted]
+                if not fits(rows, width, shifted): break
+                moves.append(direction)
+                yield (actions + moves + ['All Down'], drop(columns, height, shifted),
+                       turns, column + dx*len(moves))
+
+
+############################################################
+# EVALUATION
+############################################################
+
+def evaluations(rows, width, cells, center, kind=None, rotation=0, names=FEATURES):
+    ''' Every placement of the shape with the features of the board it
+        leaves behind; the board is read once and each placement only
+        recomputes the columns and rows it touches
+        Return value: type: list - (actions, features) per placement
+    '''
+    after = BoardFeatures(rows, width, names).after
+    return [(actions, after(landed))
+            for actions, landed in placements(rows, width, cells, center, kind, rotation)]
+
+
+class GreedyAgent():
+    ''' GreedyAgent class:
+        Picks the placement of the current shape that leaves the best board
+        Attributes: weights - type: dictionary - feature name -> weight,
+                    'lines' is the number of rows the placement clears
+                    cache - type: PlacementCache - the placements already
+                    evaluated, may be shared, or None
+    '''
+
+    WEIGHTS = {'lines': 0.76, 'height': -0.51, 'holes': -0.36, 'bumpiness': -0.18}
+
+    def __init__(self, weights=None, cache=None):
+        self.weights = dict(self.WEIGHTS)
+        if weights: self.weights.update(weights)
+        self.cache = cache
+
+    def score(self, values):
+        ''' Parameter: values - type: dictionary - features, see features.py;
+            those without a weight do not count
+        '''
+        score = 0.0
+        for name, weight in self.weights.items():
+            score += weight*values[name]
+        return score
+
+    def plan(self, board):
+        ''' Parameter: board - type: Board - with a falling active_shape
+            Return value: type: list - the actions for the best placement,
+            empty if the shape cannot be placed anywhere
+        '''
+        return self.choose(*snapshot(board))
+
+    def choose(self, rows, width, cells, center, kind=None, rotation=0):
+        ''' plan() on a snapshot(); it only reads its arguments, so it can
+            run on another thread or process while the game goes on
+        '''
+        best, best_score = [], None
+        if self.cache is None:
+            evaluated = evaluations(rows, width, cells, center, kind, rotation, self.weights)
+        else:
+            evaluated = self.cache.evaluations(rows, width, cells, center, kind, rotation, self.weights)
+        for actions, values in evaluated:
+            score = self.score(values)
+            if best_score is None or score > best_score:
+                best, best_score = actions, score
+        return list(best)
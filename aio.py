@@ -0,0 +1,233 @@
+# aio.py
+"""Runs a Tetris game on an asyncio event loop.
+
+Instead of Tk's mainloop and after() polling, every part of the game is
+a task on one asyncio loop:
+
+    gravity   - lets the shape fall (Tetris.fall), then sleeps until the
+                next row or the next shape is due
+    input     - waits on the game's queue and applies actions as soon as
+                they arrive, with no polling interval
+    display   - pumps Tk without blocking (backend.pump), or has the loop
+                watch the terminal (backend.input_fd) so keys arrive as
+                soon as they are typed; every pass is a frame of the
+                overlay (Tetris.end_frame)
+    agent     - when a shape appears, plans its placement in an executor
+                so the loop keeps running while it thinks
+    history   - appends the recorded actions to a file after every shape
+    telemetry - writes a line of game statistics every period
+
+Example:
+    game = Tetris("Tetris", render_mode='ansi', record=True)
+    asyncio.run(AsyncGame(game, agent=GreedyAgent(), history='game.jsonl').run())
+"""
+
+import asyncio
+import json
+import time
+
+from agent import snapshot
+from profiling import profiler
+
+
+############################################################
+# HISTORY FILES
+############################################################
+
+class HistoryWriter():
+    ''' HistoryWriter class:
+        Appends the history of a recorded game to a file, one JSON value
+        per line: first {"seed": seed}, then every action or 'Spawn'
+        Attributes: written - type: int - history entries written so far
+    '''
+
+    def __init__(self, game, filename):
+        if game.history is None:
+            raise ValueError("The game does not record its history")
+        self.game = game
+        self.file = open(filename, 'w')
+        self.file.write(json.dumps({'seed': game.seed}) + '\n')
+        self.file.flush()
+        self.written = 0
+
+    def write_new(self):
+        ''' Writes the entries recorded since the last call '''
+        history = self.game.history
+        end = len(history)
+        if end == self.written or self.file.closed: return
+        self.file.write(''.join(json.dumps(item) + '\n' for item in history[self.written:end]))
+        self.file.flush()
+        self.written = end
+
+    def close(self):
+        self.write_new()
+        self.file.close()
+
+def read_history(filename):
+    ''' Return value: type: tuple - (seed, history) of a file written by
+        HistoryWriter, to pass to Tetris(seed=seed).replay(history)
+    '''
+    with open(filename) as f:
+        seed = json.loads(f.readline())['seed']
+        return seed, [json.loads(line) for line in f if line.strip()]
+
+
+############################################################
+# ASYNC GAME
+############################################################
+
+class AsyncGame():
+    ''' AsyncGame class:
+        Runs one game as a set of asyncio tasks until its display is closed,
+        the player quits (Tetris.quit calls stop()) or, without a display
+        to keep showing, until the game is over
+        Attributes: game - type: Tetris - the game being run
+                    agent - an object with choose(), e.g. GreedyAgent, or None
+                    executor - where the agent thinks, None for the loop's default
+                    history - type: HistoryWriter - or None
+                    telemetry - type: string - file for statistics lines, or None
+                    linger - type: bool - keep showing a finished game until
+                    its window is closed
+    '''
+
+    MIN_SLEEP = 0.001 # seconds, so the fastest levels do not spin the loop
+    MAX_SLEEP = 0.05  # seconds, so a level up shows in the next sleep soon enough
+    FRAME = 1/60      # seconds between the frames of a backend with nothing to pump
+
+    def __init__(self, game, agent=None, executor=None, history=None, telemetry=None,
+                 telemetry_period=1.0, linger=True):
+        self.game = game
+        self.agent = agent
+        self.executor = executor
+        self.history = HistoryWriter(game, history) if history else None
+        self.telemetry = telemetry
+        self.telemetry_period = telemetry_period
+        self.linger = linger
+        self.pieces = 0
+
+    async def run(self):
+        game = self.game
+        self.loop = asyncio.get_running_loop()
+        self.over = asyncio.Event()     # the game has ended
+        self.finished = asyncio.Event() # run() can return
+        self.spawned = asyncio.Event()  # a new shape for the agent
+        self.spawned.set() # the first shape is already on the board
+        self.history_due = asyncio.Event()
+        self.history_write = None # the write_new running on the executor
+        game.on_spawn.append(self._on_spawn)
+        game.runner = self
+
+        tasks = [self.gravity(), self.input(), self.display()]
+        if self.agent: tasks.append(self.play())
+        if self.history: tasks.append(self.write_history())
+        if self.telemetry: tasks.append(self.write_telemetry())
+        tasks = [asyncio.ensure_future(task) for task in tasks]
+        try:
+            await self.finished.wait()
+        finally:
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            game.on_spawn.remove(self._on_spawn)
+            game.runner = None
+            if self.history:
+                # Cancelling write_history does not stop its worker thread
+                if self.history_write:
+                    await asyncio.gather(self.history_write, return_exceptions=True)
+                self.history.close()
+
+    def stop(self):
+        ''' Ends the game early, e.g. when the player quits; run() returns
+            once its tasks are done and the history is written
+        '''
+        self.over.set()
+        self.finished.set()
+
+    def _on_spawn(self, game):
+        self.pieces += 1
+        self.spawned.set()
+        self.history_due.set()
+
+    def _closed(self):
+        return self.game.board.backend.is_closed()
+
+    async def gravity(self):
+        game = self.game
+        while not self.over.is_set() and not self._closed():
+            wait = game.fall()
+            if game.board.game_over:
+                self.over.set()
+                break
+            await asyncio.sleep(min(max(wait, self.MIN_SLEEP), self.MAX_SLEEP))
+
+    async def input(self):
+        game = self.game
+        while True:
+            item = await game.queue.get()
+            if self.over.is_set() or self._closed(): return
+            game.handle(item)
+            game.update() # and whatever else arrived meanwhile
+
+    async def display(self):
+        game = self.game
+        backend = game.board.backend
+        fd = backend.input_fd()
+        if fd is not None:
+            self.loop.add_reader(fd, backend.read_keys)
+        try:
+            while not self._closed():
+                start = time.perf_counter()
+                delay = backend.pump()
+                game.end_frame(start)
+                # With nothing to pump there is nothing to keep showing either
+                if self.over.is_set() and (delay is None or not self.linger): break
+                await asyncio.sleep(self.FRAME if delay is None else delay)
+        finally:
+            if fd is not None: self.loop.remove_reader(fd)
+            self.finished.set()
+
+    async def play(self):
+        ''' Lets the agent plan every shape off the loop thread, then
+            queues its actions like key presses
+        '''
+        game = self.game
+        while True:
+            await self.spawned.wait()
+            self.spawned.clear()
+            if self.over.is_set(): return
+            if game.board.cant_move: continue
+            piece = self.pieces
+            actions = await self.loop.run_in_executor(self.executor, self.agent.choose,
+                                                      *snapshot(game.board))
+            if piece != self.pieces: continue # the shape landed while the agent was thinking
+            for action in actions:
+                game.input(action)
+
+    async def write_history(self):
+        ''' Writes the new history entries after every shape, off the loop thread '''
+        while True:
+            await self.history_due.wait()
+            self.history_due.clear()
+            self.history_write = self.loop.run_in_executor(None, self.history.write_new)
+            # Shielded so that cancelling this task leaves the write for run() to wait on
+            await asyncio.shield(self.history_write)
+
+    def statistics(self):
+        ''' Return value: type: dictionary - one telemetry record '''
+        game = self.game
+        record = {'time': time.time()}
+        record.update(game.board.stats.as_dict())
+        record.update(queue=game.queue.qsize(), canvas_items=game.board.backend.item_count())
+        if profiler.enabled:
+            record['p95_us'] = {phase: round(h.percentile(95)*1e6, 1)
+                                for phase, h in profiler.phases.items()}
+        return record
+
+    async def write_telemetry(self):
+        with open(self.telemetry, 'a') as f:
+            def write(line):
+                f.write(line)
+                f.flush()
+            while True:
+                line = json.dumps(self.statistics()) + '\n'
+                await self.loop.run_in_executor(None, write, line)
+                await asyncio.sleep(self.telemetry_period)
@@ -0,0 +1,510 @@
+# bench.py
+"""Benchmark suite for the Tetris engine and the graphics layer.
+
+Micro benchmarks time single operations (moving, rotating, clearing
+rows, copying and adding shapes, drawing/moving/undrawing canvas items);
+the end-to-end benchmarks play a whole headless game from a fixed seed
+and replay its recorded history. Every benchmark runs several rounds and
+reports operations per second with the spread between rounds.
+
+Results can be written as JSON and compared against a stored baseline;
+any benchmark that got slower than the threshold is flagged and the
+exit status is 1, so the suite can gate a release.
+
+Usage:
+    python bench.py [--quick] [--filter TEXT] [--json results.json]
+                    [--baseline bench_baseline.json] [--threshold 0.10]
+                    [--save-baseline]
+"""
+
+import argparse
+import atexit
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from graphics import GraphWin, Point, Rectangle
+from agent import GreedyAgent, board_rows, placements, snapshot
+from evalcache import PlacementCache
+from features import BoardFeatures
+import perft
+from render import NullBackend
+from scores import ScoreStore
+from tetris import Block, Board, Tetris, I_shape, T_shape
+import tuner
+
+DEFAULT_BASELINE = 'bench_baseline.json'
+COLORS = ['blue', 'orange', 'cyan', 'red', 'green', 'yellow', 'magenta']
+
+BENCHMARKS = [] # (name, ops per round, function returning (setup, op))
+
+
+class Skip(Exception):
+    ''' Raised by a benchmark that cannot run here, e.g. without a display '''
+
+
+def benchmark(name, number):
+    ''' Registers a benchmark. The decorated function returns (setup, op):
+        op() is timed number times per round, or, when setup is not None,
+        op(setup()) with only the op part timed.
+    '''
+    def register(make):
+        BENCHMARKS.append((name, number, make))
+        return make
+    return register
+
+
+############################################################
+# FIXTURES
+############################################################
+
+def board_with_shape(shape_class=T_shape, width=None, height=None):
+    ''' Return value: type: Board - an empty headless board with a shape
+        in the middle, clear of the walls
+    '''
+    board = Board(NullBackend(), width, height)
+    board.add_shape(shape_class(Point(board.width//2, board.height//2)))
+    return board
+
+def board_with_stack(full_rows, partial_rows, seed=0, width=None, height=None):
+    ''' Return value: type: Board - a headless board with full_rows complete
+        rows at the bottom and partial_rows rows with one hole above them
+    '''
+    rng = random.Random(seed)
+    board = Board(NullBackend(), width, height)
+    y = board.height-1
+    for row in range(full_rows + partial_rows):
+        hole = rng.randrange(board.width) if row >= full_rows else None
+        for x in range(board.width):
+            if x != hole:
+                board.put_block(Block(Point(x, y), rng.choice(COLORS)))
+        y -= 1
+    return board
+
+def scripted_game(seed, max_ticks=5000):
+    ''' Plays a headless game with seeded random inputs
+        Return value: type: Tetris - the finished game, with its history
+    '''
+    rng = random.Random(seed)
+    game = Tetris("bench", render_mode='null', seed=seed, record=True)
+    actions = ['Left', 'Right', 'Rotate Right', 'Rotate Left', 'Down', 'All Down']
+    for tick in range(max_ticks):
+        if game.board.game_over: break
+        for i in range(rng.randrange(3)):
+            game.queue.put_nowait(rng.choice(actions))
+        game.update()
+        game.animate()
+        game.update()
+    return game
+
+def cells(board):
+    return [[None if b is board.blank_block else b.color for b in column] for column in board.grid]
+
+
+############################################################
+# ENGINE BENCHMARKS
+############################################################
+
+@benchmark('Board.move_on_board', 2000)
+def bench_move_on_board():
+    board = board_with_shape()
+    points = [Tetris.DIRECTION['Left'], Tetris.DIRECTION['Right']]
+    turn = itertools.count()
+    return None, lambda: board.move_on_board(points[next(turn) & 1])
+
+@benchmark('Board.rotate', 2000)
+def bench_rotate():
+    board = board_with_shape()
+    return None, lambda: board.rotate('Right')
+
+@benchmark('Board.rotate[kicked]', 1000)
+def bench_rotate_kicked():
+    def setup():
+        # An upright I against the left wall, which only turns by a kick
+        board = Board(NullBackend())
+        board.add_shape(I_shape(Point(2, board.height//2)))
+        board.rotate('Right')
+        board.move_on_board(Tetris.DIRECTION['Left'])
+        board.move_on_board(Tetris.DIRECTION['Left'])
+        return board
+    return setup, lambda board: board.rotate('Right')
+
+def _clean_rows(full_rows, partial_rows):
+    def make():
+        return (lambda: board_with_stack(full_rows, partial_rows)), (lambda board: board.clean_rows())
+    return make
+
+benchmark('Board.clean_rows[no clear]', 200)(_clean_rows(0, 10))
+benchmark('Board.clean_rows[single]', 200)(_clean_rows(1, 9))
+benchmark('Board.clean_rows[tetris]', 200)(_clean_rows(4, 6))
+
+@benchmark('Shape.deepcopy', 2000)
+def bench_deepcopy():
+    shape = T_shape(Point(5, 5))
+    return None, shape.deepcopy
+
+@benchmark('Shape.acquire+release', 2000)
+def bench_shape_pool():
+    def cycle():
+        shape = T_shape.acquire(Point(5, 5))
+        for block in shape.get_blocks(): Block.release(block)
+        shape.release()
+    return None, cycle
+
+@benchmark('Board.add_shape', 500)
+def bench_add_shape():
+    setup = lambda: (Board(NullBackend()), I_shape(Point(Tetris.BB_WIDTH//2, 0)))
+    return setup, lambda state: state[0].add_shape(state[1])
+
+
+############################################################
+# BOARD SIZE SCALING
+############################################################
+
+# The cost of a tick should follow the size of the piece, not of the board
+SIZES = [(10, 20), (50, 100), (200, 1000)]
+
+def _land_on_stack(width, height):
+    ''' A piece is added just above a stack filling the lower half of the
+        board, cannot move down and is taken off again. Adding it looks for
+        complete rows, as every spawn does.
+    '''
+    def make():
+        board = board_with_stack(0, height//2, width=width, height=height)
+        top = board.height - height//2 - 1
+        def land():
+            board.cant_move = False
+            board.add_shape(I_shape(Point(width//2, top)))
+            board.move_on_board()
+            board.remove_shape(board.active_shape)
+        return None, land
+    return make
+
+def _move_on(width, height):
+    def make():
+        board = board_with_shape(T_shape, width, height)
+        points = [Tetris.DIRECTION['Left'], Tetris.DIRECTION['Right']]
+        turn = itertools.count()
+        return None, lambda: board.move_on_board(points[next(turn) & 1])
+    return make
+
+
+def _features_after(width, height):
+    ''' The features of the placements of a T on a stack filling the lower half '''
+    def make():
+        board = board_with_stack(0, height//2, width=width, height=height)
+        shape = T_shape(Point(width//2, 0))
+        rows = board_rows(board)
+        cells = [(b.x, b.y) for b in shape.get_blocks()]
+        center = (shape.center_block.x, shape.center_block.y)
+        base = BoardFeatures(rows, width)
+        # Only those that clear no rows, a clear is computed in full
+        landings = itertools.cycle([landed for actions, landed in placements(rows, width, cells, center, shape.kind)
+                                    if not base.after(landed)['lines']])
+        return None, lambda: base.after(next(landings))
+    return make
+
+for width, height in SIZES:
+    size = '{}x{}'.format(width, height)
+    benchmark('scaling.move_on_board[{}]'.format(size), 2000)(_move_on(width, height))
+    benchmark('scaling.land[{}]'.format(size), 1000)(_land_on_stack(width, height))
+    benchmark('scaling.features_after[{}]'.format(size), 2000)(_features_after(width, height))
+
+
+############################################################
+# SCORE STORE
+############################################################
+
+# Opening a store and reading the top 10 should not depend on how many games it holds
+STORED_GAMES = 100000
+
+def score_store(games=0):
+    ''' Return value: type: string - a new store directory holding games records '''
+    directory = tempfile.mkdtemp(prefix='bench_scores_')
+    atexit.register(shutil.rmtree, directory, True)
+    rng = random.Random(0)
+    store = ScoreStore(directory)
+    for i in range(games):
+        store.append(i, rng.randrange(10**6), rng.randrange(200), 60.0,
+                     rng.choice(['human', 'greedy']), 'bench')
+    store.close()
+    return directory
+
+@benchmark('ScoreStore.append', 2000)
+def bench_score_append():
+    store = ScoreStore(score_store())
+    scores = itertools.count()
+    return None, lambda: store.append(0, next(scores), 10, 60.0, 'bench', 'bench')
+
+@benchmark('ScoreStore.open+top10[{}k]'.format(STORED_GAMES//1000), 200)
+def bench_score_top():
+    directory = score_store(STORED_GAMES)
+    def load():
+        store = ScoreStore(directory)
+        store.top(10)
+        store.close()
+    return None, load
+
+
+############################################################
+# GRAPHICS BENCHMARKS
+############################################################
+
+_win = None
+
+def window():
+    ''' Return value: type: GraphWin - a shared window without autoflush,
+        so the graphics benchmarks time the object and canvas calls only
+    '''
+    global _win
+    if _win is None:
+        try:
+            _win = GraphWin("bench", 200, 400, autoflush=False)
+        except Exception as e:
+            raise Skip("no display: {}".format(str(e).splitlines()[0]))
+        _win.setCoords(0, 0, 20, 40)
+    return _win
+
+def rectangle():
+    r = Rectangle(Point(4, 4), Point(6, 6))
+    r.setFill('red')
+    return r
+
+@benchmark('GraphicsObject.draw', 1000)
+def bench_draw():
+    win = window()
+    return rectangle, lambda r: r.draw(win)
+
+@benchmark('GraphicsObject.move', 2000)
+def bench_graphics_move():
+    r = rectangle().draw(window())
+    turn = itertools.count()
+    return None, lambda: r.move(1 if next(turn) & 1 else -1, 0)
+
+@benchmark('GraphicsObject.undraw', 1000)
+def bench_undraw():
+    win = window()
+    return (lambda: rectangle().draw(win)), (lambda r: r.undraw())
+
+
+############################################################
+# END TO END BENCHMARKS
+############################################################
+
+GAME_SEED = 1234
+
+@benchmark('game[seed {}]'.format(GAME_SEED), 3)
+def bench_game():
+    return None, lambda: scripted_game(GAME_SEED)
+
+@benchmark('replay[seed {}]'.format(GAME_SEED), 3)
+def bench_replay():
+    recorded = scripted_game(GAME_SEED)
+    def replay():
+        game = Tetris("bench", render_mode='null', seed=GAME_SEED)
+        game.replay(recorded.history)
+        return game
+    check = replay()
+    counters = lambda game: (game.board.score, game.board.stats.lines, game.board.stats.pieces)
+    if counters(check) != counters(recorded) or cells(check.board) != cells(recorded.board):
+        raise RuntimeError("The replay of seed {} did not end in the recorded state".format(GAME_SEED))
+    return None, replay
+
+@benchmark('perft[seed {}, depth 3]'.format(GAME_SEED), 1)
+def bench_perft():
+    shapes = perft.shape_sequence(3, GAME_SEED)
+    rows = perft.filled_rows(Tetris.BB_WIDTH, Tetris.BB_HEIGHT, 4, GAME_SEED)
+    return None, lambda: perft.run(rows, Tetris.BB_WIDTH, shapes)
+
+
+############################################################
+# AGENT BENCHMARKS
+############################################################
+
+def agent_snapshots(seed, count=100):
+    ''' Return value: type: list - snapshot() of the board before each of
+        the first count shapes of a game played by GreedyAgent
+    '''
+    game = Tetris("bench", render_mode='null', seed=seed)
+    agent = GreedyAgent()
+    snapshots = []
+    while len(snapshots) < count and not game.board.game_over:
+        snapshots.append(snapshot(game.board))
+        for action in agent.choose(*snapshots[-1]):
+            game.queue.put_nowait(action)
+        game.update()
+        game.animate()
+        game.update()
+    return snapshots
+
+def _choose(cache_size, warm):
+    def make():
+        snapshots = itertools.cycle(agent_snapshots(GAME_SEED))
+        agent = GreedyAgent(cache=PlacementCache(cache_size) if cache_size else None)
+        if warm:
+            for i in range(100): agent.choose(*next(snapshots))
+        return None, lambda: agent.choose(*next(snapshots))
+    return make
+
+@benchmark('tuner.play[seed {}, 100 pieces]'.format(GAME_SEED), 3)
+def bench_tuner_play():
+    shapes = perft.shape_sequence(100, GAME_SEED)
+    return None, lambda: tuner.play(GreedyAgent.WEIGHTS, shapes, Tetris.BB_WIDTH, Tetris.BB_HEIGHT)
+
+benchmark('GreedyAgent.choose', 200)(_choose(0, False))
+benchmark('GreedyAgent.choose[cache miss]', 200)(_choose(1, False)) # one entry, every lookup misses
+benchmark('GreedyAgent.choose[cache hit]', 2000)(_choose(4096, True))
+
+
+############################################################
+# ENVIRONMENT BENCHMARKS
+############################################################
+
+def _env(mode):
+    def make():
+        try:
+            from env import TetrisEnv
+        except ImportError as e: # env.py needs numpy
+            raise Skip(str(e))
+        check_env(TetrisEnv(mode=mode, record=True))
+        env = TetrisEnv(mode=mode)
+        env.reset(seed=GAME_SEED)
+        rng = random.Random(GAME_SEED)
+        def step():
+            if env.step(rng.randrange(env.actions))[2]: env.reset()
+        return None, step
+    return make
+
+def check_env(env, steps=2000):
+    ''' Plays env with random actions and replays its history on the engine '''
+    env.reset(seed=GAME_SEED)
+    rng = random.Random(GAME_SEED)
+    for i in range(steps):
+        if env.step(rng.randrange(env.actions))[2]: break
+    game = Tetris("bench", render_mode='null', seed=GAME_SEED, width=env.width, height=env.height)
+    game.replay(env.history)
+    board = game.board
+    same = board.score == env.score and board.game_over == env.done
+    if same and not env.done:
+        falling = board.active_shape.get_blocks()
+        locked = {(x, y) for x, column in enumerate(board.grid) for y, block in enumerate(column)
+                  if block is not board.blank_block and block not in falling}
+        same = locked == {(x, y) for y, x in zip(*env.occupancy.nonzero()) if env.occupancy[y, x] == 1}
+    if not same:
+        raise RuntimeError("The {} environment and the engine disagree on seed {}".format(env.mode, GAME_SEED))
+
+benchmark('env.step[keys]', 20000)(_env('keys'))
+benchmark('env.step[placement]', 2000)(_env('placement'))
+
+
+############################################################
+# RUNNER
+############################################################
+
+def measure(number, setup, op, repeat):
+    ''' Return value: type: list - operations per second of every round '''
+    rates = []
+    for r in range(repeat):
+        if setup is None:
+            t0 = time.perf_counter()
+            for i in range(number): op()
+            total = time.perf_counter() - t0
+        else:
+            total = 0.0
+            for i in range(number):
+                state = setup()
+                t0 = time.perf_counter()
+                op(state)
+                total += time.perf_counter() - t0
+        rates.append(number/total)
+    return rates
+
+def run(names=None, repeat=5, scale=1.0):
+    ''' Runs the registered benchmarks whose name contains one of names
+        Return value: type: dictionary - results by benchmark name
+    '''
+    results = {}
+    for name, number, make in BENCHMARKS:
+        if names and not any(n in name for n in names): continue
+        number = max(1, int(number*scale))
+        try:
+            setup, op = make()
+            measure(max(1, number//10), setup, op, 1) # warm up
+            rates = measure(number, setup, op, repeat)
+        except Skip as e:
+            results[name] = {'skipped': str(e)}
+            continue
+        mean = statistics.mean(rates)
+        stdev = statistics.stdev(rates) if len(rates) > 1 else 0.0
+        results[name] = {'ops_per_sec': mean, 'stdev': stdev,
+                         'cv_percent': 100*stdev/mean, 'min': min(rates), 'max': max(rates),
+                         'rounds': len(rates), 'ops_per_round': number}
+    return results
+
+def compare(results, baseline, threshold):
+    ''' Return value: type: dictionary - benchmark name -> relative change
+        in ops/sec for every benchmark slower than threshold
+    '''
+    slower = {}
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name, {})
+        if 'ops_per_sec' not in result or 'ops_per_sec' not in base: continue
+        change = result['ops_per_sec']/base['ops_per_sec'] - 1
+        result['baseline_change'] = change
+        if change < -threshold: slower[name] = change
+    return slower
+
+def report(results, slower):
+    print("{:<28} {:>14} {:>8} {:>10}".format('benchmark', 'ops/sec', '+-%', 'vs base'))
+    for name, r in results.items():
+        if 'skipped' in r:
+            print("{:<28} {:>14}  ({})".format(name, 'skipped', r['skipped']))
+            continue
+        change = r.get('baseline_change')
+        change = '' if change is None else '{:+.1%}'.format(change)
+        flag = '  SLOWER' if name in slower else ''
+        print("{:<28} {:>14,.1f} {:>8.1f} {:>10}{}".format(name, r['ops_per_sec'],
+              r['cv_percent'], change, flag))
+
+def main():
+    parser = argparse.ArgumentParser(description="Tetris benchmark suite")
+    parser.add_argument('--filter', action='append', help="only run benchmarks containing this text")
+    parser.add_argument('--repeat', type=int, default=5, help="rounds per benchmark")
+    parser.add_argument('--quick', action='store_true', help="a tenth of the operations per round")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help="compare against this results file if it exists")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="flag benchmarks this much slower than the baseline")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = run(args.filter, args.repeat, 0.1 if args.quick else 1.0)
+    slower = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.threshold)
+    report(results, slower)
+
+    output = {'meta': {'python': sys.version.split()[0], 'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat},
+              'results': results}
+    for path in filter(None, [args.json, args.baseline if args.save_baseline else None]):
+        with open(path, 'w') as f:
+            json.dump(output, f, indent=2)
+    if slower:
+        print("{} benchmark(s) slower than the baseline by more than {:.0%}".format(
+              len(slower), args.threshold))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
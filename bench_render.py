@@ -0,0 +1,136 @@
+# bench_render.py
+"""Compares the render backends of the Tetris Board.
+
+For every board size each backend gets the same half-filled stack and
+the same seeded sequence of moves. Each run happens in a fresh process
+so the memory numbers are not polluted by the previous run. Printed per
+backend: mean and worst frame time, the share of the frame spent
+drawing (frame time over the null backend's, which only runs the game
+logic), the number of Tk canvas items and the resident memory growth.
+
+Usage: python bench_render.py [--frames N] [--sizes 10x20,20x40,40x80]
+                              [--modes null,canvas,raster,ansi]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from tetris import Block, Point, Tetris
+
+
+def rss_kb():
+    ''' Return value: type: int - resident memory of this process in kB,
+        or None where it cannot be read
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+
+
+def fill_stack(board, rng):
+    ''' Locks random blocks into the bottom half of the board,
+        leaving one hole per row so no row is complete
+    '''
+    colors = ['blue', 'orange', 'cyan', 'red', 'green', 'yellow', 'magenta']
+    for y in range(board.height//2, board.height):
+        hole = rng.randrange(board.width)
+        for x in range(board.width):
+            if x == hole: continue
+            block = Block(Point(x, y), rng.choice(colors))
+            board.put_block(block)
+            board.backend.draw_block(block)
+    board.backend.flush()
+
+
+def run_one(mode, cols, rows, frames, seed=0):
+    ''' Runs a single mode and size, returns a dictionary of results '''
+    rng = random.Random(seed)
+    rss_before = rss_kb()
+
+    game = Tetris("bench {} {}x{}".format(mode, cols, rows), render_mode=mode, seed=seed,
+                  width=cols, height=rows)
+    win = getattr(game.board.backend, 'win', None)
+    t0 = time.perf_counter()
+    fill_stack(game.board, rng)
+    if win: win.getRoot().update()
+    fill_time = time.perf_counter() - t0
+
+    times = []
+    for i in range(frames):
+        action = rng.choice(['Left', 'Right', 'Down', 'Down', 'Rotate Right'])
+        t0 = time.perf_counter()
+        game.queue.put_nowait(action)
+        game.update()
+        if game.board.cant_move:
+            game.board.cant_move = False
+            if not game.create_new_shape(): break
+        if win: win.getRoot().update()
+        times.append(time.perf_counter() - t0)
+
+    result = {'mode': mode, 'size': '{}x{}'.format(cols, rows),
+              'frames': len(times),
+              'fill_ms': fill_time*1000,
+              'mean_frame_ms': 1000*sum(times)/len(times) if times else None,
+              'worst_frame_ms': 1000*max(times) if times else None,
+              'canvas_items': len(win.find_all()) if win else 0,
+              'rss_kb': rss_kb(),
+              'rss_growth_kb': None}
+    if rss_before is not None and result['rss_kb'] is not None:
+        result['rss_growth_kb'] = result['rss_kb'] - rss_before
+    game.board.backend.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the render backends")
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--sizes', default='10x20,20x40,40x80')
+    parser.add_argument('--modes', default='null,canvas,raster,ansi')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--one', nargs=2, metavar=('MODE', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        mode, size = args.one
+        cols, rows = map(int, size.split('x'))
+        # The ansi backend draws to stdout, which carries the result
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        result = run_one(mode, cols, rows, args.frames, args.seed)
+        sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    print("{:>8} {:>7} {:>7} {:>10} {:>10} {:>7} {:>8} {:>10}".format(
+          'size', 'mode', 'frames', 'mean ms', 'worst ms', 'draw %', 'items', 'rss+ kB'))
+    for size in args.sizes.split(','):
+        logic_ms = None
+        for mode in args.modes.split(','):
+            out = subprocess.run([sys.executable, __file__, '--one', mode, size,
+                                  '--frames', str(args.frames), '--seed', str(args.seed)],
+                                 stdout=subprocess.PIPE)
+            if out.returncode != 0:
+                print("{:>8} {:>7} failed".format(size, mode))
+                continue
+            r = json.loads(out.stdout.decode().strip().splitlines()[-1])
+            mean = r['mean_frame_ms'] or 0
+            if mode == 'null': logic_ms = mean
+            draw = 100*(mean-logic_ms)/mean if logic_ms is not None and mean else 0
+            print("{:>8} {:>7} {:>7} {:>10.3f} {:>10.3f} {:>7.1f} {:>8} {:>10}".format(
+                  r['size'], r['mode'], r['frames'], mean,
+                  r['worst_frame_ms'] or 0, draw, r['canvas_items'], r['rss_growth_kb']))
+
+
+if __name__ == "__main__":
+    main()
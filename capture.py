@@ -0,0 +1,272 @@
+# capture.py
+"""Records a Tetris board as a sequence of frames.
+
+The game loop only takes a cheap snapshot of the board (one palette index
+per cell) into a slot of a fixed ring of reusable buffers. A background
+thread turns the snapshot into RGB pixels and hands them to a sink: an
+image sequence written with graphics.writeRGB, or raw RGB piped into an
+encoder process. When every slot is busy the frame is dropped, so a slow
+disk or encoder never stalls the game.
+
+Example:
+    capture = FrameCapture(board, FrameCapture.sink_for('frames/%06d.png'), fps=30)
+    ... call capture.tick() from the game loop ...
+    capture.close()
+"""
+
+import queue
+import shlex
+import subprocess
+import threading
+import time
+
+from graphics import writeRGB
+
+
+# RGB values of the Tk color names used by the board
+COLOR_RGB = {'blue': (0, 0, 255), 'orange': (255, 165, 0), 'cyan': (0, 255, 255),
+             'red': (255, 0, 0), 'green': (0, 255, 0), 'yellow': (255, 255, 0),
+             'magenta': (255, 0, 255), 'dim gray': (105, 105, 105), 'light gray': (211, 211, 211),
+             'black': (0, 0, 0), 'white': (255, 255, 255)}
+BACKGROUND = 'light gray'
+OUTLINE = 'black'
+
+
+############################################################
+# BOARD TO PIXELS
+############################################################
+
+class PixelRenderer():
+    ''' PixelRenderer class:
+        Turns a snapshot of palette indexes into RGB pixels, drawing cells
+        like the canvas backend does (outlined squares on a gray background)
+        Attributes: width, height - type: int - board size in cells
+                    cell_size - type: int - pixels per cell side
+                    palette - type: list - color name for every palette index
+    '''
+
+    def __init__(self, width, height, cell_size=16):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.palette = [BACKGROUND]
+        self.indexes = {BACKGROUND: 0}
+        self.edge = []   # the top and bottom pixel line of a cell, per palette index
+        self.inner = []  # every other pixel line of a cell, per palette index
+        self._add_lines(BACKGROUND, outlined=False)
+
+    def frame_size(self):
+        ''' Return value: type: tuple - (width, height) of a frame in pixels '''
+        return self.width*self.cell_size, self.height*self.cell_size
+
+    def buffer(self):
+        ''' Return value: type: bytearray - a buffer that holds one frame '''
+        w, h = self.frame_size()
+        return bytearray(3*w*h)
+
+    def _add_lines(self, color, outlined=True):
+        fill = bytes(COLOR_RGB.get(color, (128, 128, 128)))
+        size = self.cell_size
+        if outlined:
+            outline = bytes(COLOR_RGB[OUTLINE])
+            self.edge.append(outline*size)
+            self.inner.append(outline + fill*(size-2) + outline)
+        else:
+            self.edge.append(fill*size)
+            self.inner.append(fill*size)
+
+    def index(self, color):
+        ''' Return value: type: int - the palette index of color, added on first use
+        '''
+        i = self.indexes.get(color)
+        if i is None:
+            i = self.indexes[color] = len(self.palette)
+            self.palette.append(color)
+            self._add_lines(color)
+        return i
+
+    def snapshot(self, board, cells):
+        ''' Parameters: board - type: Board
+                        cells - type: bytearray - width*height palette indexes, row by row
+
+            Copies the colors of the board grid into cells. This is the
+            only part of a capture that runs on the game thread.
+        '''
+        blank = board.blank_block
+        width = self.width
+        index = self.index
+        for x, column in enumerate(board.grid):
+            for y, block in enumerate(column):
+                cells[y*width + x] = 0 if block is blank else index(block.color)
+
+    def render(self, cells, out):
+        ''' Parameters: cells - type: bytearray - a snapshot
+                        out - type: bytearray - a buffer from self.buffer()
+
+            Draws the snapshot into out
+        '''
+        width, size = self.width, self.cell_size
+        stride = 3*width*size
+        edge, inner = self.edge, self.inner
+        pos = 0
+        for y in range(self.height):
+            row = cells[y*width:(y+1)*width]
+            edge_line = b''.join([edge[i] for i in row])
+            inner_line = b''.join([inner[i] for i in row])
+            for line in range(size):
+                out[pos:pos+stride] = edge_line if line == 0 or line == size-1 else inner_line
+                pos += stride
+
+
+############################################################
+# SINKS
+############################################################
+
+class ImageSequence():
+    ''' Writes every frame to its own file. pattern is a filename with a
+        %d style placeholder for the frame number; the extension picks
+        the format (ppm or png), as for graphics.Image.save.
+    '''
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def open(self, width, height, fps):
+        self.width, self.height = width, height
+
+    def write(self, number, data):
+        writeRGB(self.pattern % number, self.width, self.height, data)
+
+    def close(self):
+        pass
+
+
+class PipeSink():
+    ''' Streams raw RGB frames to the stdin of an encoder process.
+        {width}, {height} and {fps} in the command are filled in, e.g.
+        ffmpeg -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i - out.mp4
+    '''
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+
+    def open(self, width, height, fps):
+        command = self.command.format(width=width, height=height, fps=fps)
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE)
+
+    def write(self, number, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        if self.process:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+############################################################
+# FRAME CAPTURE
+############################################################
+
+class FrameCapture():
+    ''' FrameCapture class:
+        Captures a board at a fixed frame rate without blocking the game loop
+        Attributes: fps - type: float - frames per second
+                    captured - type: int - frames handed to the worker
+                    dropped - type: int - frames skipped because the ring was full
+                    written - type: int - frames the sink has written
+                    failed - type: int - frames that could not be written
+                    first_error - type: Exception - why the first of them
+                    failed, None if none did
+    '''
+
+    def __init__(self, board, sink, fps=30, ring_size=8, cell_size=16):
+        self.board = board
+        self.sink = sink
+        self.fps = fps
+        self.period = 1.0/fps
+        self.renderer = PixelRenderer(board.width, board.height, cell_size)
+        self.captured = self.dropped = self.written = 0
+        self.failed = 0
+        self.first_error = None
+
+        # Every slot owns a snapshot and a frame buffer, reused for the whole recording
+        self.slots = [(bytearray(board.width*board.height), self.renderer.buffer())
+                      for i in range(ring_size)]
+        self.free = queue.Queue()
+        for i in range(ring_size): self.free.put(i)
+        self.pending = queue.Queue()
+
+        self.sink.open(*self.renderer.frame_size(), fps)
+        self.next_frame = time.monotonic()
+        self.worker = threading.Thread(target=self._work, name="frame capture", daemon=True)
+        self.worker.start()
+
+    @staticmethod
+    def sink_for(target):
+        ''' Parameter: target - type: string
+            Return value: a sink
+
+            '|command' pipes raw RGB into command, anything else is
+            an image sequence filename pattern such as 'frames/%06d.png'
+        '''
+        if target.startswith('|'):
+            return PipeSink(target[1:])
+        return ImageSequence(target)
+
+    def tick(self, now=None):
+        ''' Captures a frame if one is due. Call it at least fps times per
+            second from the game loop; it never waits for the worker.
+        '''
+        now = time.monotonic() if now is None else now
+        if now < self.next_frame: return
+        # Catch up without a burst of frames if the loop fell behind
+        behind = int((now - self.next_frame)/self.period)
+        self.dropped += behind
+        self.next_frame += (behind+1)*self.period
+        self.capture()
+
+    def capture(self):
+        ''' Snapshots the board into a free slot, or drops the frame '''
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        self.renderer.snapshot(self.board, self.slots[slot][0])
+        self.pending.put((self.captured, slot))
+        self.captured += 1
+
+    def _work(self):
+        while True:
+            item = self.pending.get()
+            if item is None: return
+            number, slot = item
+            cells, pixels = self.slots[slot]
+            try:
+                self.renderer.render(cells, pixels)
+                self.sink.write(number, pixels)
+                self.written += 1
+            except Exception as e:
+                # A sink that keeps failing fails every frame; keep one
+                #   error, without the frames its traceback holds on to
+                if self.first_error is None: self.first_error = e.with_traceback(None)
+                self.failed += 1
+            finally:
+                self.free.put(slot)
+
+    def close(self):
+        ''' Waits for the pending frames and closes the sink '''
+        self.pending.put(None)
+        self.worker.join()
+        self.sink.close()
+
+    def report(self):
+        ''' Return value: type: string - frames written and dropped, and the
+            failed writes with the first of their errors
+        '''
+        text = "Recorded {} frames, dropped {}".format(self.written, self.dropped)
+        if self.failed:
+            text += ", {} failed to write (first: {}: {})".format(
+                    self.failed, type(self.first_error).__name__, self.first_error)
+        return text
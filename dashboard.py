@@ -0,0 +1,221 @@
+# dashboard.py
+"""Many bot games side by side in one window.
+
+Every game gets a panel of a single GraphWin (one Tk canvas, see
+render.PanelBackend). All games run from one scheduler: each frame moves
+every agent along its plan, applies the gravity due since the last frame
+(Tetris.fall) and then redraws the whole window once, so the cost of a frame is
+the game logic plus one canvas update, not one update per block. A game
+that ends is replaced with a new one on the next seed. With --cache the
+agents share one PlacementCache (evalcache.py), so a shape one of them
+evaluated on a board is not evaluated again by the others.
+
+Usage: python dashboard.py [--boards 64] [--fps 30] [--scale 3]
+                           [--delay 200] [--seed 0] [--seconds S]
+                           [--render canvas|null] [--cache ENTRIES]
+"""
+
+import argparse
+import collections
+import math
+import sys
+import time
+
+from agent import GreedyAgent
+from evalcache import PlacementCache
+from graphics import GraphWin
+from render import NullBackend, PanelBackend
+from tetris import Tetris
+
+
+############################################################
+# PANEL
+############################################################
+
+class Panel():
+    ''' Panel class:
+        One seat of the dashboard: a game, the agent playing it and the
+        actions the agent has planned for the falling shape
+        Attributes: game - type: Tetris - the current game
+                    games - type: int - games started in this panel
+                    pieces - type: int - shapes placed over all its games
+    '''
+
+    def __init__(self, dashboard, index, x, y):
+        self.dashboard = dashboard
+        self.index = index
+        self.x, self.y = x, y
+        self.agent = GreedyAgent(cache=dashboard.cache)
+        self.games = 0
+        self.pieces = 0
+        self.game = None
+        self.new_game()
+
+    def new_game(self):
+        dashboard = self.dashboard
+        if self.game: self.game.close()
+        if dashboard.win:
+            backend = PanelBackend(dashboard.win, self.x, self.y, dashboard.scale,
+                                   "board {}".format(self.index))
+        else:
+            backend = NullBackend()
+        seed = dashboard.seed + self.index + self.games*dashboard.boards
+        self.game = Tetris("board {}".format(self.index), delay=dashboard.delay,
+                           seed=seed, width=dashboard.width, height=dashboard.height,
+                           backend=backend)
+        self.games += 1
+        self.plan = None
+
+    def step(self, now):
+        ''' Advances the game by one dashboard frame '''
+        game = self.game
+        board = game.board
+        if board.game_over:
+            self.new_game()
+            return
+        if board.cant_move: # landed, spawn the next shape right away
+            game.spawn(now)
+            self.pieces += 1
+            self.plan = None
+            if board.game_over: return
+        if self.plan is None:
+            self.plan = collections.deque(self.agent.plan(board))
+        for i in range(min(self.dashboard.moves_per_frame, len(self.plan))):
+            game.input(self.plan.popleft())
+        game.fall(now)
+        game.update()
+
+
+############################################################
+# DASHBOARD
+############################################################
+
+class Dashboard():
+    ''' Dashboard class:
+        A grid of panels in one window, driven by one frame scheduler
+        Attributes: win - type: GraphWin - the shared window, None when headless
+                    panels - type: list - one Panel per board
+                    frames - type: int - frames run so far
+                    cache - type: PlacementCache - shared by the agents, or None
+    '''
+
+    MARGIN = 4 # pixels between panels
+
+    def __init__(self, boards=64, columns=None, scale=3, fps=30, delay=200, seed=0,
+                 moves_per_frame=1, width=None, height=None, headless=False, cache_size=0):
+        self.boards = boards
+        self.columns = columns or math.ceil(math.sqrt(boards))
+        self.scale = scale
+        self.fps = fps
+        self.delay = delay
+        self.seed = seed
+        self.moves_per_frame = moves_per_frame
+        self.width = width or Tetris.BB_WIDTH
+        self.height = height or Tetris.BB_HEIGHT
+        self.frames = 0
+        self.frame_times = collections.deque(maxlen=fps)
+        self.cache = PlacementCache(cache_size) if cache_size else None
+
+        panel_width = scale*self.width*2 + self.MARGIN
+        panel_height = scale*self.height*2 + self.MARGIN
+        rows = math.ceil(boards/self.columns)
+        self.win = None
+        if not headless:
+            self.win = GraphWin("Tetris dashboard", self.columns*panel_width,
+                                rows*panel_height, autoflush=False)
+            self.win.setBackground('gray30')
+        self.panels = [Panel(self, i, (i % self.columns)*panel_width, (i // self.columns)*panel_height)
+                       for i in range(boards)]
+
+    def frame(self):
+        ''' Runs one frame of every game and redraws the window once '''
+        start = time.perf_counter()
+        for panel in self.panels:
+            panel.step(start)
+        if self.win:
+            self.win.update_idletasks()
+        self.frames += 1
+        self.frame_times.append(time.perf_counter() - start)
+
+    def fps_now(self):
+        ''' Return value: type: float - the frame rate the frames of the last
+            second could sustain
+        '''
+        if not self.frame_times: return 0.0
+        return len(self.frame_times)/sum(self.frame_times)
+
+    def run(self, seconds=None):
+        ''' Runs frames at self.fps until the window is closed, or for seconds '''
+        period = 1/self.fps
+        self.started = time.perf_counter()
+        end = self.started + seconds if seconds else None
+
+        def tick():
+            if self.win and self.win.isClosed(): return False
+            self.frame()
+            if self.win and self.frames % self.fps == 0:
+                self.win.master.title("Tetris dashboard - {} boards, {:.0f} fps possible".format(
+                                      self.boards, self.fps_now()))
+            return end is None or time.perf_counter() < end
+
+        if self.win:
+            root = self.win.getRoot()
+            def scheduled():
+                next_frame = time.perf_counter() + period
+                if not tick():
+                    root.quit()
+                    return
+                root.after(max(1, int(1000*(next_frame - time.perf_counter()))), scheduled)
+            root.after(0, scheduled)
+            root.mainloop()
+        else:
+            next_frame = time.perf_counter()
+            while tick():
+                next_frame += period
+                time.sleep(max(0.0, next_frame - time.perf_counter()))
+
+    def close(self):
+        for panel in self.panels:
+            panel.game.close()
+        if self.win: self.win.close()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        pieces = sum(p.pieces for p in self.panels)
+        games = sum(p.games for p in self.panels)
+        report = ("{} boards, {} frames in {:.1f} s ({:.1f} fps, logic alone could run {:.1f} fps), "
+                  "{} pieces placed, {} games".format(self.boards, self.frames, elapsed,
+                  self.frames/elapsed, self.fps_now(), pieces, games))
+        if self.cache: report += "\n" + self.cache.report()
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch many bot games at once")
+    parser.add_argument('--boards', type=int, default=64)
+    parser.add_argument('--columns', type=int, help="panels per row, square by default")
+    parser.add_argument('--scale', type=int, default=3, help="pixels per board unit (a block is two units)")
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--delay', type=int, default=200, help="gravity delay in ms")
+    parser.add_argument('--moves', type=int, default=1, help="agent actions per board per frame")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--seconds', type=float, help="stop after this long")
+    parser.add_argument('--render', choices=['canvas', 'null'], default='canvas',
+                        help="null runs the same schedule without a window")
+    parser.add_argument('--cache', type=int, default=0, metavar='ENTRIES',
+                        help="evaluated shapes the agents share and remember, 0 for none")
+    args = parser.parse_args()
+
+    dashboard = Dashboard(args.boards, args.columns, args.scale, args.fps, args.delay,
+                          args.seed, args.moves, headless=args.render == 'null',
+                          cache_size=args.cache)
+    try:
+        dashboard.run(args.seconds)
+    except KeyboardInterrupt:
+        pass
+    print(dashboard.report(), file=sys.stderr)
+    dashboard.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# diagnostics.py
+"""Object churn and leak accounting for the game.
+
+While enabled, every GraphicsObject (Block, Point, Rectangle, Text, ...)
+that is created or freed is counted per class, by wrapping
+GraphicsObject.__init__ and adding a __del__. Nothing is patched while
+diagnostics are off, so normal play pays nothing.
+
+Diagnostics.tick() samples the live counts, the allocations since the
+previous tick and the backend's canvas item count; summary() turns the
+samples into allocation rates. The soak test plays headless games back
+to back, samples the live counts after a full collection between games
+and flags any class whose count keeps growing.
+
+Usage: python diagnostics.py [--games N] [--seed S] [--threshold OBJECTS]
+"""
+
+import argparse
+import collections
+import gc
+import json
+import random
+import sys
+import time
+
+from graphics import GraphicsObject
+
+
+############################################################
+# DIAGNOSTICS
+############################################################
+
+class Diagnostics():
+    ''' Diagnostics class:
+        Counts live and allocated GraphicsObjects per class, per game tick
+        Attributes: created - type: Counter - objects created per class name
+                    freed - type: Counter - objects freed per class name
+                    first, last - type: dictionary - the first and the latest sample
+                    ticks - type: int - samples taken
+                    allocated - type: int - objects allocated over all ticks
+    '''
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.created = collections.Counter()
+        self.freed = collections.Counter()
+        self.baseline = collections.Counter()
+        self.first = self.last = None
+        self.ticks = 0
+        self.allocated = 0
+        self.enabled = False
+        self._last_created = collections.Counter()
+        self._original_init = None
+
+    def enable(self):
+        ''' Starts counting. Objects that already exist are counted once
+            with a scan of the garbage collector's objects.
+        '''
+        if self.enabled: return
+        self.baseline = collections.Counter(type(o).__name__ for o in gc.get_objects()
+                                            if isinstance(o, GraphicsObject))
+        created, freed = self.created, self.freed
+        original_init = self._original_init = GraphicsObject.__init__
+
+        def counting_init(obj, *args, **kws):
+            created[type(obj).__name__] += 1
+            original_init(obj, *args, **kws)
+
+        def counting_del(obj):
+            freed[type(obj).__name__] += 1
+
+        GraphicsObject.__init__ = counting_init
+        GraphicsObject.__del__ = counting_del
+        self.enabled = True
+        self.start = time.perf_counter()
+
+    def disable(self):
+        if not self.enabled: return
+        GraphicsObject.__init__ = self._original_init
+        del GraphicsObject.__del__
+        self.enabled = False
+
+    def live(self):
+        ''' Return value: type: dictionary - live objects per class name,
+            plus 'GraphicsObject' for all of them
+        '''
+        names = set(self.baseline) | set(self.created)
+        live = {name: self.baseline[name] + self.created[name] - self.freed[name] for name in names}
+        live['GraphicsObject'] = sum(live.values())
+        return live
+
+    def tick(self):
+        ''' Records a sample, call it once per game tick '''
+        allocated = self.created - self._last_created
+        self._last_created = collections.Counter(self.created)
+        items = self.backend.item_count() if self.backend else None
+        # Only running totals are kept, so a long session costs no memory
+        self.last = {'time': time.perf_counter() - self.start,
+                     'live': self.live(),
+                     'canvas_items': items}
+        if self.first is None: self.first = self.last
+        self.ticks += 1
+        self.allocated += sum(allocated.values())
+
+    def summary(self):
+        ''' Return value: type: dictionary - allocation rates and the live
+            counts at the first and last sample
+        '''
+        if not self.ticks: return {}
+        first, last, ticks, allocated = self.first, self.last, self.ticks, self.allocated
+        seconds = max(last['time'] - first['time'], 1e-9)
+        return {'ticks': ticks,
+                'allocated_per_tick': allocated/ticks,
+                'allocated_per_second': allocated/seconds,
+                'created': dict(self.created),
+                'freed': dict(self.freed),
+                'live_first': first['live'],
+                'live_last': last['live'],
+                'canvas_items_first': first['canvas_items'],
+                'canvas_items_last': last['canvas_items']}
+
+    def format(self):
+        s = self.summary()
+        if not s: return "No diagnostics samples"
+        lines = ["{} ticks, {:.1f} objects allocated per tick, {:.0f} per second".format(
+                 s['ticks'], s['allocated_per_tick'], s['allocated_per_second']),
+                 "{:<16} {:>10} {:>10} {:>10} {:>10}".format('class', 'created', 'freed',
+                                                            'live then', 'live now')]
+        for name in sorted(s['live_last']):
+            lines.append("{:<16} {:>10} {:>10} {:>10} {:>10}".format(
+                         name, s['created'].get(name, '') if name != 'GraphicsObject' else sum(s['created'].values()),
+                         s['freed'].get(name, '') if name != 'GraphicsObject' else sum(s['freed'].values()),
+                         s['live_first'].get(name, 0), s['live_last'][name]))
+        if s['canvas_items_last'] is not None:
+            lines.append("canvas items: {} then, {} now".format(s['canvas_items_first'],
+                                                                s['canvas_items_last']))
+        return "\n".join(lines)
+
+
+############################################################
+# SOAK TEST
+############################################################
+
+def growth(counts):
+    ''' Parameter: counts - type: list - a live count per game
+        Return value: type: float - the least squares slope, objects per game
+    '''
+    n = len(counts)
+    if n < 2: return 0.0
+    mean_x, mean_y = (n-1)/2, sum(counts)/n
+    num = sum((x-mean_x)*(y-mean_y) for x, y in enumerate(counts))
+    den = sum((x-mean_x)**2 for x in range(n))
+    return num/den
+
+def soak(games=50, seed=0, threshold=1.0, max_ticks=5000):
+    ''' Plays games back to back with seeded random inputs. After every game
+        the garbage is collected and the live counts are sampled; a class
+        is flagged when its count grows by more than threshold objects
+        per game over the second half of the run (the first half warms up
+        caches such as the interned block styles).
+        Return value: type: tuple - (diagnostics, per game live counts, flagged classes)
+    '''
+    from tetris import Tetris # imported here so diagnostics can be imported by tetris
+
+    diagnostics = Diagnostics()
+    diagnostics.enable()
+    per_game = []
+    rng = random.Random(seed)
+    actions = ['Left', 'Right', 'Rotate Right', 'Rotate Left', 'Down', 'All Down']
+    try:
+        for number in range(games):
+            game = Tetris("soak", render_mode='null', seed=seed+number)
+            diagnostics.backend = game.board.backend
+            for tick in range(max_ticks):
+                if game.board.game_over: break
+                for i in range(rng.randrange(3)):
+                    game.queue.put_nowait(rng.choice(actions))
+                game.update()
+                game.animate()
+                diagnostics.tick()
+            game.close()
+            del game
+            gc.collect()
+            per_game.append(diagnostics.live())
+    finally:
+        diagnostics.disable()
+
+    half = per_game[len(per_game)//2:]
+    flagged = {}
+    for name in per_game[-1]:
+        slope = growth([live.get(name, 0) for live in half])
+        if slope > threshold: flagged[name] = slope
+    return diagnostics, per_game, flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test for object leaks")
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=1.0,
+                        help="flag classes growing by more than this many objects per game")
+    parser.add_argument('--json', help="write the summary and per game counts to this file")
+    args = parser.parse_args()
+
+    diagnostics, per_game, flagged = soak(args.games, args.seed, args.threshold)
+    print(diagnostics.format())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': diagnostics.summary(), 'per_game': per_game,
+                       'flagged': flagged}, f, indent=2)
+    if flagged:
+        for name, slope in sorted(flagged.items()):
+            print("GROWING: {} +{:.1f} per game".format(name, slope))
+        sys.exit(1)
+    print("Live objects are flat over {} games".format(len(per_game)))
+
+
+if __name__ == "__main__":
+    main()
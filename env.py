@@ -0,0 +1,498 @@
+# env.py
+"""A reinforcement learning environment over the headless Tetris engine.
+
+TetrisEnv follows the Gym interface: reset(seed) and step(action), with
+step returning (observation, reward, terminated, truncated, info). The
+rules are the engine's: the same shapes spawned at the same place from
+the same random sequence, rotation about the center block with the wall
+kicks of kicks.py, a shape that is pushed into a block locks where it is, and the
+reward is the score the engine gives for clearing rows (10*rows**3).
+env.history replayed with Tetris.replay on a game with the same seed
+ends on the same board (bench.py checks this).
+
+It does not step Tetris itself: like agent.py it keeps the board as one
+bit mask per row, so a step costs a few integer operations instead of
+copying Blocks. The observation is a dictionary of NumPy arrays that are
+allocated once and updated in place, only in the cells that changed;
+every step returns the same dictionary, so keep a copy of anything that
+has to outlive the next step. In placement mode the rotations a new
+shape can reach, and how far each can move, are worked out from the
+few rows at the top that the search reads, and cached for those rows;
+only the placement taken is dropped.
+
+    occupancy - uint8 (height, width) - 1 for a locked block, 2 for the falling shape
+    heights   - int32 (width,) - the height of every column of locked blocks
+    pieces    - int8 (2,) - the current and the next shape, indexes into Tetris.SHAPES
+    legal     - bool (4*width,) - placement mode only, which actions are possible
+
+Actions:
+    mode='keys'      - an index into KEY_ACTIONS, the actions of Tetris.update.
+                       Every gravity steps the shape also falls one row; a
+                       shape that cannot fall any more locks and the next
+                       one appears in the same step.
+    mode='placement' - turns*width + column: rotate the shape turns times to
+                       the right, move its center block to column and drop
+                       it. An action that is not legal drops the shape
+                       where it is. env.placement(action) gives the engine
+                       actions and the cells of a legal one.
+
+VecEnv steps N environments whose buffers are rows of one batch array
+each, so the batched observation is never copied together.
+
+Example:
+    env = TetrisEnv(mode='keys')
+    observation, info = env.reset(seed=0)
+    observation, reward, terminated, truncated, info = env.step(KEY_ACTIONS.index('Left'))
+"""
+
+import random
+
+import numpy as np
+
+from agent import MAX_DOWN, ROTATIONS, fits
+from kicks import TURN, kicks, rotate
+from graphics import Point
+from tetris import Tetris
+
+
+KEY_ACTIONS = ['Left', 'Right', 'Rotate Right', 'Rotate Left', 'Down', 'All Down']
+LEFT, RIGHT, ROTATE_RIGHT, ROTATE_LEFT, DOWN, ALL_DOWN = range(len(KEY_ACTIONS))
+TURNS = 4 # rotations a placement can ask for
+
+def _shape_table():
+    ''' Return value: type: list - per shape in Tetris.SHAPES, its cells and
+        center block relative to the spawn point, and its letter
+    '''
+    table = []
+    for shape_class in Tetris.SHAPES:
+        shape = shape_class(Point(0, 0))
+        cells = [(block.x, block.y) for block in shape.get_blocks()]
+        center = (shape.center_block.x, shape.center_block.y)
+        table.append((cells, center, shape_class.kind))
+    return table
+
+SHAPE_TABLE = _shape_table()
+
+def _mask(cells, width):
+    ''' Return value: type: int - the cells as bits of the rows from the top, bit y*width + x '''
+    mask = 0
+    for x, y in cells: mask |= 1 << y*width + x
+    return mask
+
+def _landing(cells, center, width):
+    ''' Return value: type: tuple - (mask, cells, center column, leftmost x, rightmost x) '''
+    xs = [x for x, y in cells]
+    return _mask(cells, width), cells, center[0], min(xs), max(xs)
+
+def _kick_tree(cells, center, kind, rotation, directions, width, height):
+    ''' The cells rotate() tries for the first of directions, in order, and
+        after each the tries of the next direction
+        Return value: type: tuple - (tries, the lowest row they reach); a try
+        is (landing, tries of the next direction or None after the last)
+    '''
+    tried = []
+    rotate(cells, center, kind, rotation, directions[0], tried.append) # fits nothing, tries every kick
+    tries, deepest = [], 0
+    for moved, (dx, dy) in zip(tried, kicks(kind, rotation, directions[0])):
+        if not all(0 <= x < width and 0 <= y < height for x, y in moved): continue # never fits
+        moved_center = (center[0]+dx, center[1]+dy)
+        deepest = max([deepest] + [y for x, y in moved])
+        after = None
+        if len(directions) > 1:
+            after, below = _kick_tree(moved, moved_center, kind, (rotation + TURN[directions[0]]) % 4,
+                                      directions[1:], width, height)
+            deepest = max(deepest, below)
+        tries.append((_landing(moved, moved_center, width), after))
+    return tries, deepest
+
+def _turned(tries, top):
+    ''' Return value: type: tuple - the landing of the first try that fits
+        the rows of top at every turn, as rotate() called turn by turn picks
+        it, or None
+    '''
+    for landing, after in tries:
+        if not landing[0] & top:
+            return landing if after is None else _turned(after, top)
+    return None
+
+PROGRAMS = {} # (shape, width, height) -> _program()
+
+def _program(shape, width, height):
+    ''' The search for the rotations of a new shape worked out once per shape
+        and board size: for every entry of agent.ROTATIONS, the rows it may
+        move down first and the wall kicks rotate() tries, as bit masks
+        Return value: type: tuple - (rows, searches): the rows from the top
+        it reads, and per entry (turns, rotations, starts), a start being
+        (downs, landing, kick tries or None when it does not turn)
+    '''
+    program = PROGRAMS.get((shape, width, height))
+    if program is not None: return program
+    offsets, (c_x, c_y), kind = SHAPE_TABLE[shape]
+    x0 = width//2
+    rows, searches = 0, []
+    for turns, rotations in ROTATIONS:
+        starts = []
+        for downs in range(MAX_DOWN+1):
+            cells = [(x0+x, y+downs) for x, y in offsets]
+            if not all(0 <= x < width and 0 <= y < height for x, y in cells): break
+            center = (x0+c_x, c_y+downs)
+            rows = max([rows] + [y+1 for x, y in cells])
+            tries = None
+            if rotations:
+                tries, deepest = _kick_tree(cells, center, kind, 0,
+                                            [action.split()[1] for action in rotations], width, height)
+                rows = max(rows, deepest+1)
+            starts.append((downs, _landing(cells, center, width), tries))
+        searches.append((turns, rotations, starts))
+    PROGRAMS[(shape, width, height)] = program = (rows, searches)
+    return program
+
+REACH_CACHE_SIZE = 4096
+REACH_CACHE = {} # (width, height, shape, top rows) -> TetrisEnv._reach(), shared by every env
+
+
+def buffers(width, height, mode, count=None):
+    ''' Return value: type: dictionary - zeroed observation arrays, with a
+        first axis of count environments if count is not None
+    '''
+    batch = () if count is None else (count,)
+    arrays = {'occupancy': np.zeros(batch + (height, width), np.uint8),
+              'heights': np.zeros(batch + (width,), np.int32),
+              'pieces': np.zeros(batch + (2,), np.int8)}
+    if mode == 'placement':
+        arrays['legal'] = np.zeros(batch + (TURNS*width,), np.bool_)
+    return arrays
+
+
+class TetrisEnv():
+    ''' TetrisEnv class:
+        Attributes: width, height - type: int - the board size in blocks
+                    mode - type: string - 'keys' or 'placement'
+                    gravity - type: int - in keys mode, the steps per row the
+                    shape falls by itself, 0 for none
+                    actions - type: int - how many actions there are
+                    observation - type: dictionary - the arrays step returns
+                    history - type: list - the engine actions taken and 'Spawn',
+                    when recording
+                    seed - type: int - the seed of the current game
+                    score, lines, pieces - type: int
+    '''
+
+    def __init__(self, width=None, height=None, mode='keys', gravity=1, max_steps=None,
+                 record=False, arrays=None):
+        if mode not in ('keys', 'placement'):
+            raise ValueError("Unknown mode '{}', use keys or placement".format(mode))
+        self.width = width or Tetris.BB_WIDTH
+        self.height = height or Tetris.BB_HEIGHT
+        self.mode = mode
+        self.gravity = gravity
+        self.max_steps = max_steps
+        self.record = record
+        self.actions = len(KEY_ACTIONS) if mode == 'keys' else TURNS*self.width
+        # arrays lets VecEnv hand in views of its batch arrays
+        self.observation = arrays if arrays is not None else buffers(self.width, self.height, mode)
+        self.occupancy = self.observation['occupancy']
+        self.heights = self.observation['heights']
+        self.pieces = self.observation['pieces']
+        self.legal = self.observation.get('legal')
+        self.info = {}
+        self.full = (1 << self.width) - 1
+        self.seeds = random.Random() # draws the seed of a reset without one
+        self.reset()
+
+    def reset(self, seed=None, options=None):
+        ''' Starts a new game; seed fixes the shape sequence as Tetris(seed=seed) does.
+            Without a seed, the game's seed is drawn from the seed given to the
+            last seeded reset, so a run seeded once is reproducible.
+            Return value: type: tuple - (observation, info)
+        '''
+        if seed is None:
+            seed = self.seeds.randrange(2**32)
+        else:
+            self.seeds = random.Random(seed)
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.rows = [0]*self.height   # locked blocks only
+        self.column_heights = [0]*self.width
+        self.occupancy.fill(0)
+        self.heights.fill(0)
+        self.score = self.lines = self.pieces_played = 0
+        self.steps = 0
+        self.ticks = 0
+        self.done = False
+        self.history = [] if self.record else None
+        self.next_shape = self.rng.randrange(0, len(Tetris.SHAPES))
+        self._spawn(first=True)
+        return self.observation, self._info()
+
+    def _info(self):
+        info = self.info
+        info['score'] = self.score
+        info['lines'] = self.lines
+        info['pieces'] = self.pieces_played
+        return info
+
+    ############################################################
+    # STEPPING
+
+    def step(self, action):
+        ''' Return value: type: tuple - (observation, reward, terminated, truncated, info) '''
+        if self.done:
+            raise RuntimeError("step() on a finished game, call reset() first")
+        score = self.score
+        if self.mode == 'keys':
+            self._key(action)
+            if not self.landed and self.gravity:
+                self.ticks += 1
+                if self.ticks >= self.gravity:
+                    self.ticks = 0
+                    if self.history is not None: self.history.append('Down')
+                    self._move(0, 1)
+        else:
+            self._place(action)
+        if self.landed:
+            self._lock()
+            self._spawn()
+        self.steps += 1
+        truncated = self.max_steps is not None and self.steps >= self.max_steps and not self.done
+        return self.observation, self.score - score, self.done, truncated, self._info()
+
+    def _key(self, action):
+        if self.history is not None: self.history.append(KEY_ACTIONS[action])
+        if action == LEFT: self._move(-1, 0)
+        elif action == RIGHT: self._move(1, 0)
+        elif action == DOWN: self._move(0, 1)
+        elif action == ALL_DOWN:
+            while self._move(0, 1): pass
+        elif action == ROTATE_RIGHT: self._rotate('Right')
+        elif action == ROTATE_LEFT: self._rotate('Left')
+        else:
+            raise ValueError("Unknown action {}".format(action))
+
+    def _move(self, dx, dy):
+        ''' Moves the falling shape the way Board.move_on_board does
+            Return value: type: bool - whether it moved
+        '''
+        rows, width, height = self.rows, self.width, self.height
+        moved = []
+        for x, y in self.cells:
+            x += dx
+            y += dy
+            if x < 0 or x >= width or y >= height:
+                if y >= height: self.landed = True
+                return False
+            if rows[y] >> x & 1: # pushed into a block, even sideways
+                self.landed = True
+                return False
+            moved.append((x, y))
+        self._show(moved)
+        self.center = (self.center[0]+dx, self.center[1]+dy)
+        return True
+
+    def _rotate(self, direction):
+        ''' Rotates the falling shape the way Board.rotate does '''
+        if self.landed: return
+        rows, width = self.rows, self.width
+        turned = rotate(self.cells, self.center, self.kind, self.rotation, direction,
+                        lambda cells: fits(rows, width, cells))
+        if turned is None: return
+        cells, self.center, self.rotation = turned
+        self._show(cells)
+
+    def _show(self, cells):
+        occupancy = self.occupancy
+        for x, y in self.cells: occupancy[y, x] = 0
+        for x, y in cells: occupancy[y, x] = 2
+        self.cells = cells
+
+    def _place(self, action):
+        if not (0 <= action < self.actions and self.legal[action]):
+            action = self.reach[0][2] # no turns, straight down
+        if self.history is not None:
+            actions, cells = self.placement(action)
+            self.history.extend(actions)
+        else:
+            cells = self._landed(action)
+        self._show(cells)
+        self.landed = True
+
+    def _landed(self, action):
+        ''' Return value: type: list - where a legal placement action lands the shape '''
+        turns, column = divmod(action, self.width)
+        actions, cells, center, first, last = self.reach[turns]
+        shift = column - center
+        return self._drop([(x+shift, y) for x, y in cells])
+
+    def _drop(self, cells):
+        ''' Return value: type: list - cells moved down as far as they fit '''
+        height, column_heights = self.height, self.column_heights
+        # Cells above the tops of their columns fall until one rests on its column
+        d = min(height - column_heights[x] - 1 - y for x, y in cells)
+        if d < 0: # under an overhang, fall row by row
+            rows = self.rows
+            d = 0
+            while all(y+d+1 < height and not rows[y+d+1] >> x & 1 for x, y in cells): d += 1
+        return [(x, y+d) for x, y in cells]
+
+    def _lock(self):
+        ''' Locks the falling shape into the board and removes the complete rows '''
+        rows, occupancy, heights, column_heights = self.rows, self.occupancy, self.heights, self.column_heights
+        height = self.height
+        for x, y in self.cells:
+            rows[y] |= 1 << x
+            occupancy[y, x] = 1
+            if height - y > column_heights[x]:
+                column_heights[x] = heights[x] = height - y
+        complete = sorted({y for x, y in self.cells if rows[y] == self.full})
+        if not complete: return
+        for y in complete: # top first, so the lower indexes stay valid
+            occupancy[1:y+1] = occupancy[0:y]
+            occupancy[0] = 0
+        kept = [row for row in rows if row != self.full]
+        self.rows = rows = [0]*len(complete) + kept
+        self.score += 10*(len(complete)**3)
+        self.lines += len(complete)
+        # The tops of the columns are at or above the cleared rows
+        column_heights[:] = [0]*self.width
+        covered = 0
+        for y, row in enumerate(rows):
+            new = row & ~covered
+            while new:
+                low = new & -new
+                column_heights[low.bit_length()-1] = height - y
+                new ^= low
+            covered |= row
+            if covered == self.full: break
+        heights[:] = column_heights
+
+    def _spawn(self, first=False):
+        ''' Puts the next shape at the top as Tetris.create_new_shape does '''
+        if not first and self.history is not None: self.history.append('Spawn')
+        self.shape = self.next_shape
+        self.next_shape = self.rng.randrange(0, len(Tetris.SHAPES))
+        self.pieces[0] = self.shape
+        self.pieces[1] = self.next_shape
+        offsets, (c_x, c_y), self.kind = SHAPE_TABLE[self.shape]
+        self.rotation = 0
+        x0 = self.width//2
+        cells = [(x0+x, y) for x, y in offsets]
+        self.cells = []
+        self.center = (x0+c_x, c_y)
+        self.landed = False
+        self.ticks = 0
+        rows = self.rows
+        for x, y in cells:
+            if rows[y] >> x & 1:
+                self.done = True # topped out, like Board.add_shape
+                return
+        self._show(cells)
+        self.pieces_played += 1
+        if self.mode == 'placement': self._find_placements()
+
+    def _find_placements(self):
+        ''' Fills self.reach and legal. The rotations of a new shape and how
+            far each can move depend only on the top rows its search reads,
+            which rarely change, so they are cached for the shape and those
+            rows; a placement is dropped only when it is taken.
+        '''
+        width, rows = self.width, self.rows
+        reads, searches = _program(self.shape, width, self.height)
+        top = 0 # the rows the search reads as one mask, like _mask
+        for y in range(reads): top |= rows[y] << y*width
+        key = (width, self.height, self.shape, top)
+        found = REACH_CACHE.get(key)
+        if found is None:
+            found = self._reach(searches, top)
+            if len(REACH_CACHE) >= REACH_CACHE_SIZE: REACH_CACHE.clear()
+            REACH_CACHE[key] = found
+        self.reach, legal = found
+        self.legal[:] = legal
+
+    def _reach(self, searches, top):
+        ''' Return value: type: tuple - (turns -> (engine actions, cells,
+            center column, leftmost column, rightmost column), legal actions)
+        '''
+        width = self.width
+        reach = {}
+        legal = np.zeros(TURNS*width, np.bool_)
+        for turns, rotations, starts in searches:
+            turned = None
+            for downs, landing, tries in starts:
+                if landing[0] & top: break
+                turned = landing if tries is None else _turned(tries, top)
+                if turned is not None: break
+            if turned is None: continue
+            mask, cells, column, low, high = turned
+            left = 0
+            while left < low and not mask >> left+1 & top: left += 1
+            right = 0
+            while high + right + 1 < width and not mask << right+1 & top: right += 1
+            # A center kicked off the board has no action
+            first, last = max(column - left, 0), min(column + right, width - 1)
+            if first > last: continue
+            reach[turns] = (['Down']*downs + rotations, cells, column, first, last)
+            legal[turns*width + first:turns*width + last + 1] = True
+        return reach, legal
+
+    def placement(self, action):
+        ''' Return value: type: tuple - (engine actions, landed cells) of a
+            legal placement action
+        '''
+        turns, column = divmod(action, self.width)
+        actions, cells, center, first, last = self.reach[turns]
+        shift = column - center
+        moves = ['Left']*-shift if shift < 0 else ['Right']*shift
+        return actions + moves + ['All Down'], self._landed(action)
+
+
+class VecEnv():
+    ''' VecEnv class:
+        Steps count TetrisEnvs together. A finished game is reset in the
+        same step; its final score, lines and pieces are in its info under
+        'final'.
+        Attributes: envs - type: list - the TetrisEnvs
+                    observation - type: dictionary - batch arrays, one row per env
+                    rewards - type: numpy array - float32, the rewards of the last step
+                    terminated, truncated - type: numpy array - bool, per env
+    '''
+
+    def __init__(self, count, width=None, height=None, mode='keys', **options):
+        width = width or Tetris.BB_WIDTH
+        height = height or Tetris.BB_HEIGHT
+        self.observation = buffers(width, height, mode, count)
+        self.envs = [TetrisEnv(width, height, mode,
+                               arrays={name: array[i] for name, array in self.observation.items()},
+                               **options)
+                     for i in range(count)]
+        self.actions = self.envs[0].actions
+        self.rewards = np.zeros(count, np.float32)
+        self.terminated = np.zeros(count, np.bool_)
+        self.truncated = np.zeros(count, np.bool_)
+        self.infos = [env.info for env in self.envs]
+
+    def reset(self, seed=None):
+        ''' Environment i gets seed+i, or a random seed if seed is None; the
+            games it resets to later follow from that seed
+            Return value: type: tuple - (observation, infos)
+        '''
+        for i, env in enumerate(self.envs):
+            env.reset(None if seed is None else seed + i)
+        return self.observation, self.infos
+
+    def step(self, actions):
+        ''' Parameter: actions - one action per environment
+            Return value: type: tuple - (observation, rewards, terminated, truncated, infos)
+        '''
+        rewards, terminated, truncated = self.rewards, self.terminated, self.truncated
+        for i, (env, action) in enumerate(zip(self.envs, np.asarray(actions).tolist())):
+            observation, reward, done, cut, info = env.step(action)
+            rewards[i] = reward
+            terminated[i] = done
+            truncated[i] = cut
+            if done or cut:
+                final = dict(info)
+                env.reset()
+                info['final'] = final
+            else:
+                info.pop('final', None)
+        return self.observation, rewards, terminated, truncated, self.infos
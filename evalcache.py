@@ -0,0 +1,112 @@
+# evalcache.py
+"""A shared, size-bounded cache of placement evaluations.
+
+Bots score the same placements over and over: every game starts on the
+same empty board, the boards of games on nearby seeds look alike for a
+while, and a search that looks further ahead reaches the same board
+through different orders of placements. PlacementCache remembers, for a
+shape on a board, every placement with the features (features.py) of
+the board it leaves behind, as agent.evaluations returns them. The key
+is the board, the shape's letter, its rotation state and its cells, and
+the features asked for. A hit skips both the placement search and the
+features.
+
+The board is packed into one integer, its bit mask rows side by side,
+so a key is exact rather than a hash that could collide, and small. The
+cache evicts the least recently used entries beyond maxsize and counts
+hits, misses and evictions. Every access holds a lock, so one cache can
+be shared by the agents of many games, on any thread of the process.
+
+Example:
+    cache = PlacementCache(4096)
+    agents = [GreedyAgent(cache=cache) for i in range(64)]
+    ...
+    print(cache.report())
+"""
+
+import threading
+from collections import OrderedDict
+
+from agent import evaluations
+
+
+def board_key(rows, width):
+    ''' Return value: type: int - the bit mask rows as one integer, row 0
+        highest; with a leading 1 so the empty rows on top count too
+    '''
+    key = 1
+    for row in rows:
+        key = key << width | row
+    return key
+
+
+class PlacementCache():
+    ''' PlacementCache class:
+        Attributes: maxsize - type: int - entries kept, the least recently
+                    used go first; an entry holds every placement of a
+                    shape, some 10 kB on a 10 wide board
+                    hits, misses, evictions - type: int - counts since the
+                    cache was made or cleared
+    '''
+
+    def __init__(self, maxsize=4096):
+        if maxsize < 1: raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        ''' Return value: the value stored for key, None if there is none '''
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            entries = self.entries
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def evaluations(self, rows, width, cells, center, kind, rotation, names):
+        ''' agent.evaluations(), from the cache when this shape was already
+            evaluated on this board for the same features
+            Return value: type: tuple - (actions, features) per placement,
+            shared with other callers, so only read
+        '''
+        key = (board_key(rows, width), width, kind, rotation, tuple(cells), frozenset(names))
+        evaluated = self.get(key)
+        if evaluated is None:
+            evaluated = tuple(evaluations(rows, width, cells, center, kind, rotation, names))
+            self.put(key, evaluated)
+        return evaluated
+
+    def stats(self):
+        ''' Return value: type: dictionary - size, maxsize, hits, misses,
+            evictions and hit_rate
+        '''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits/lookups if lookups else 0.0}
+
+    def report(self):
+        return ("placement cache: {size}/{maxsize} entries, {hits} hits, {misses} misses "
+                "({hit_rate:.1%} hit), {evictions} evictions".format(**self.stats()))
@@ -0,0 +1,184 @@
+# features.py
+"""Board features for placement evaluators, computed incrementally.
+
+BoardFeatures reads a board once (as bit mask rows, see agent.board_rows)
+and keeps the value of every feature per column and per row. after(cells)
+then gives the features of the board with a shape locked at cells by
+recomputing only what the shape touches: its columns for the height,
+holes and column transitions, those and their neighbours for bumpiness
+and wells, and its rows for the row transitions. Every column is also
+kept as a bit mask (bit y for row y), so a column's values are a few
+integer operations rather than a walk down the column.
+
+A placement that clears rows moves every row above them, so for those
+the features of the resulting board are computed in full.
+
+Features, as in the literature on Tetris evaluators:
+    lines              - rows the placement completes
+    height             - the sum of the column heights
+    holes              - empty cells with a block somewhere above them
+    bumpiness          - the sum of the height differences of neighbouring columns
+    row_transitions    - filled/empty changes along every row, the walls count as filled
+    column_transitions - filled/empty changes down every column, the floor counts as filled
+    wells              - per run of cells that are empty with both neighbours
+                         filled (walls count), 1+2+...+depth
+
+Example:
+    rows, width, cells, center, kind, rotation = snapshot(board)
+    base = BoardFeatures(rows, width, ['lines', 'holes', 'wells'])
+    for actions, landed in placements(rows, width, cells, center, kind, rotation):
+        values = base.after(landed)
+"""
+
+
+FEATURES = ('lines', 'height', 'holes', 'bumpiness', 'row_transitions', 'column_transitions', 'wells')
+
+if hasattr(int, 'bit_count'): # Python 3.10
+    popcount = int.bit_count
+else:
+    def popcount(bits):
+        return bin(bits).count('1')
+
+
+class BoardFeatures():
+    ''' BoardFeatures class:
+        Attributes: rows - type: list - one int per row, bit x for column x
+                    columns - type: list - one int per column, bit y for row y
+                    width, height - type: int
+                    names - type: set - the features computed, FEATURES by default
+                    heights, holes, column_transitions, wells - type: list - per column
+                    row_transitions - type: list - per row
+                    totals - type: dictionary - the features of the board itself
+    '''
+
+    def __init__(self, rows, width, names=FEATURES):
+        self.rows = rows
+        self.width = width
+        self.height = height = len(rows)
+        self.names = names = set(names)
+        self.full_row = (1 << width) - 1
+        self.full_column = (1 << height) - 1
+        self.floor = 1 << height
+        self.complete_rows = rows.count(self.full_row) # removed with the next placement
+        columns = [0]*width
+        for y, row in enumerate(rows):
+            while row:
+                low = row & -row
+                columns[low.bit_length()-1] |= 1 << y
+                row ^= low
+        self.columns = columns
+        self.heights = heights = [self.column_height(c) for c in columns]
+        totals = self.totals = {'lines': 0}
+        if 'height' in names:
+            totals['height'] = sum(heights)
+        if 'holes' in names:
+            self.holes = [h - popcount(c) for c, h in zip(columns, heights)]
+            totals['holes'] = sum(self.holes)
+        if 'bumpiness' in names:
+            totals['bumpiness'] = sum(abs(a-b) for a, b in zip(heights, heights[1:]))
+        if 'row_transitions' in names:
+            self.row_transitions = [self.row_changes(row) for row in rows]
+            totals['row_transitions'] = sum(self.row_transitions)
+        if 'column_transitions' in names:
+            self.column_transitions = [self.column_changes(c) for c in columns]
+            totals['column_transitions'] = sum(self.column_transitions)
+        if 'wells' in names:
+            self.wells = [self.well_sum(x) for x in range(width)]
+            totals['wells'] = sum(self.wells)
+
+    ############################################################
+    # ONE COLUMN OR ROW
+
+    def column_height(self, column):
+        if not column: return 0
+        return self.height - ((column & -column).bit_length() - 1)
+
+    def column_changes(self, column):
+        below = (column | self.floor) >> 1 # bit y is the cell under row y
+        return popcount((column ^ below) & self.full_column)
+
+    def row_changes(self, row):
+        walled = (row << 1) | 1 | (1 << (self.width+1))
+        return popcount((walled ^ (walled >> 1)) & ((1 << (self.width+1)) - 1))
+
+    def well_sum(self, x, changed=None):
+        ''' Parameter: changed - type: dictionary - column -> its bits where
+            they differ from self.columns, only read; None if none do
+        '''
+        if changed is None: changed = {}
+        columns = self.columns
+        left = changed.get(x-1, columns[x-1]) if x > 0 else self.full_column
+        right = changed.get(x+1, columns[x+1]) if x+1 < self.width else self.full_column
+        cells = ~changed.get(x, columns[x]) & left & right & self.full_column
+        total = 0
+        while cells:
+            start = (cells & -cells).bit_length() - 1
+            run = cells >> start
+            depth = ((run + 1) & ~run).bit_length() - 1 # the number of low bits set
+            total += depth*(depth+1)//2
+            cells &= ~(((1 << depth) - 1) << start)
+        return total
+
+    ############################################################
+    # PLACEMENTS
+
+    def after(self, cells):
+        ''' Parameter: cells - type: list - (x, y) of a shape locked into the board
+            Return value: type: dictionary - the features of the resulting board
+        '''
+        rows, full_row = self.rows, self.full_row
+        added_columns = {}
+        added_rows = {}
+        for x, y in cells:
+            added_columns[x] = added_columns.get(x, 0) | (1 << y)
+            added_rows[y] = added_rows.get(y, 0) | (1 << x)
+        for y, bits in added_rows.items():
+            if rows[y] | bits == full_row or self.complete_rows:
+                return self._cleared(cells)
+
+        names = self.names
+        values = dict(self.totals)
+        columns, heights = self.columns, self.heights
+        new_columns = {}
+        new_heights = {}
+        for x, bits in added_columns.items():
+            column = new_columns[x] = columns[x] | bits
+            new_heights[x] = self.column_height(column)
+        if 'height' in names:
+            for x, h in new_heights.items():
+                values['height'] += h - heights[x]
+        if 'holes' in names:
+            holes = self.holes
+            for x, column in new_columns.items():
+                values['holes'] += new_heights[x] - popcount(column) - holes[x]
+        if 'column_transitions' in names:
+            transitions = self.column_transitions
+            for x, column in new_columns.items():
+                values['column_transitions'] += self.column_changes(column) - transitions[x]
+        if 'bumpiness' in names:
+            last = self.width-1
+            for x in {x+d for x in new_heights for d in (-1, 0)}: # the pairs x, x+1 that changed
+                if 0 <= x < last:
+                    values['bumpiness'] += (abs(new_heights.get(x, heights[x]) - new_heights.get(x+1, heights[x+1]))
+                                            - abs(heights[x] - heights[x+1]))
+        if 'wells' in names:
+            wells = self.wells
+            for x in {x+d for x in new_columns for d in (-1, 0, 1)}:
+                if 0 <= x < self.width:
+                    values['wells'] += self.well_sum(x, new_columns) - wells[x]
+        if 'row_transitions' in names:
+            transitions = self.row_transitions
+            for y, bits in added_rows.items():
+                values['row_transitions'] += self.row_changes(rows[y] | bits) - transitions[y]
+        return values
+
+    def _cleared(self, cells):
+        ''' after() for a placement that completes rows, computed in full '''
+        rows = list(self.rows)
+        for x, y in cells:
+            rows[y] |= 1 << x
+        kept = [row for row in rows if row != self.full_row]
+        lines = len(rows) - len(kept)
+        values = BoardFeatures([0]*lines + kept, self.width, self.names).totals
+        values['lines'] = lines
+        return values
@@ -160,7 +160,7 @@ __version__ = "5.0"
 #     Added ability to set text atttributes.
 #     Added Entry boxes.
 
-import time, os, sys
+import time, os, sys, struct, zlib
 
   # import as appropriate for 2.x vs. 3.x
 try:
@@ -183,8 +183,20 @@ BAD_OPTION = "Illegal option value"
 ##########################################################################
 # global variables and funtions
 
-_root = tk.Tk()
-_root.withdraw()
+# The Tk root is only created when the first window or image needs it, so
+#   the module can be imported (and Point, Transform, color_rgb used)
+#   without a display.
+_root = None
+
+def _tkRoot():
+    """Returns the shared Tk root, creating it on first use"""
+    global _root
+    if _root is None:
+        _root = tk.Tk()
+        _root.withdraw()
+        # MacOS fix 1
+        _root.update()
+    return _root
 
 _update_lasttime = time.time()
 
@@ -199,7 +211,7 @@ def update(rate=None):
         else:
             _update_lasttime = now
 
-    _root.update()
+    _tkRoot().update()
 
 ############################################################################
 # Graphics classes start here
@@ -212,7 +224,7 @@ class GraphWin(tk.Canvas):
                  width=200, height=200, autoflush=True):
         assert type(title) == type(""), "Title must be a string"
         
-        master = tk.Toplevel(_root)
+        master = tk.Toplevel(_tkRoot())
         master.protocol("WM_DELETE_WINDOW", self.close)
         tk.Canvas.__init__(self, master, width=width, height=height,
                            highlightthickness=0, bd=0)
@@ -220,7 +232,7 @@ class GraphWin(tk.Canvas):
         self.pack()
         master.resizable(0,0)
         self.foreground = "black"
-        self.items = []
+        self.items = {} # drawn objects, a dictionary so undraw is O(1) with many items
         self.mouseX = None
         self.mouseY = None
         self.bind("<Button-1>", self._onClick)
@@ -274,7 +286,7 @@ class GraphWin(tk.Canvas):
         self.__autoflush()
 
     def getRoot(self):
-        return _root
+        return _tkRoot()
 
     def isClosed(self):
         return self.closed
@@ -389,19 +401,85 @@ class GraphWin(tk.Canvas):
         if self._mouseCallback:
             self._mouseCallback(Point(e.x, e.y))
 
+    def configTag(self, tag, **options):
+        """Changes options of every item carrying tag (or matching a tag
+        expression such as "a&&b") with a single itemconfig call"""
+        self.__checkOpen()
+        self.itemconfig(tag, options)
+        self.__autoflush()
+
     def addItem(self, item):
-        self.items.append(item)
+        self.items[item] = None
 
     def delItem(self, item):
-        self.items.remove(item)
+        del self.items[item]
 
     def redraw(self):
-        for item in self.items[:]:
+        for item in list(self.items):
             item.undraw()
             item.draw(self)
         self.update()
         
 
+class Viewport:
+
+    """A Viewport is a rectangular region of a GraphWin with its own
+    coordinate system. Objects are drawn into it like into a GraphWin,
+    so several independent drawings can share one window (and one
+    canvas). The viewport never flushes by itself; call update() on
+    the window once all viewports have been drawn."""
+
+    def __init__(self, win, x, y, width, height):
+        self.win = win
+        self.x = int(x)
+        self.y = int(y)
+        self.width = int(width)
+        self.height = int(height)
+        self.items = {}
+        self.trans = None
+        self.autoflush = False
+
+    def __getattr__(self, name):
+        # Canvas methods (create_rectangle, move, delete, itemconfig, ...)
+        #   go to the window
+        return getattr(self.win, name)
+
+    def __repr__(self):
+        return "Viewport({}, {}, {}, {}, {})".format(self.win, self.x, self.y,
+                                                     self.width, self.height)
+
+    def setCoords(self, x1, y1, x2, y2):
+        """Set coordinates of the viewport to run from (x1,y1) in the
+        lower-left corner to (x2,y2) in the upper-right corner."""
+        self.trans = Transform(self.width, self.height, x1, y1, x2, y2)
+
+    def isClosed(self):
+        return self.win.isClosed()
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+    def toScreen(self, x, y):
+        if self.trans:
+            x, y = self.trans.screen(x, y)
+        return x+self.x, y+self.y
+
+    def toWorld(self, x, y):
+        x, y = x-self.x, y-self.y
+        if self.trans:
+            return self.trans.world(x, y)
+        return x, y
+
+    def addItem(self, item):
+        self.items[item] = None
+
+    def delItem(self, item):
+        del self.items[item]
+
+
 
 class Transform:
 
@@ -532,10 +610,10 @@ class GraphicsObject:
         #    dictionary for this object
         if option not in self.config:
             raise GraphicsError(UNSUPPORTED_METHOD)
-        options = self.config
-        options[option] = setting
+        self.config[option] = setting
         if self.canvas and not self.canvas.isClosed():
-            self.canvas.itemconfig(self.id, options)
+            # Only the changed option goes to Tk, not the whole dictionary
+            self.canvas.itemconfig(self.id, {option: setting})
             if self.canvas.autoflush:
                 _root.update()
 
@@ -791,7 +869,7 @@ class Entry(GraphicsObject):
         self.anchor = p.clone()
         #print self.anchor
         self.width = width
-        self.text = tk.StringVar(_root)
+        self.text = tk.StringVar(_tkRoot())
         self.text.set("")
         self.fill = "gray"
         self.color = "black"
@@ -886,10 +964,10 @@ class Image(GraphicsObject):
         self.imageId = Image.idCount
         Image.idCount = Image.idCount + 1
         if len(pixmap) == 1: # file name provided
-            self.img = tk.PhotoImage(file=pixmap[0], master=_root)
+            self.img = tk.PhotoImage(file=pixmap[0], master=_tkRoot())
         else: # width and height provided
             width, height = pixmap
-            self.img = tk.PhotoImage(master=_root, width=width, height=height)
+            self.img = tk.PhotoImage(master=_tkRoot(), width=width, height=height)
 
     def __repr__(self):
         return "Image({}, {}, {})".format(self.anchor, self.getWidth(), self.getHeight())
@@ -947,7 +1025,21 @@ class Image(GraphicsObject):
         
         """
         self.img.put("{" + color +"}", (x, y))
-        
+
+    def fillRect(self, x1, y1, x2, y2, color):
+        """Sets every pixel from (x1,y1) up to but not including
+        (x2,y2) to the given color
+
+        """
+        self.img.put("{{" + color + "}}", to=(x1, y1, x2, y2))
+
+    def paste(self, other, x, y):
+        """Copies the pixels of Image other into this image with the
+        top-left corner of other at pixel (x,y)
+
+        """
+        self.img.tk.call(self.img, 'copy', other.img, '-to', x, y)
+
 
     def save(self, filename):
         """Saves the pixmap image to filename.
@@ -955,9 +1047,40 @@ class Image(GraphicsObject):
 
         """
         
-        path, name = os.path.split(filename)
-        ext = name.split(".")[-1]
-        self.img.write( filename, format=ext)
+        self.img.write( filename, format=_imageFormat(filename))
+
+
+def _imageFormat(filename):
+    # The image format is the filename extension, as for Image.save
+    path, name = os.path.split(filename)
+    return name.split(".")[-1]
+
+def writeRGB(filename, width, height, data):
+    """Saves raw 8 bit RGB pixel data (rows top to bottom) to filename
+    without going through Tk, so it can be called from any thread.
+    The format is determined from the filename extension like
+    Image.save; ppm and png are supported.
+
+    """
+    ext = _imageFormat(filename).lower()
+    if ext == "ppm":
+        with open(filename, "wb") as f:
+            f.write(b"P6 %d %d 255\n" % (width, height))
+            f.write(data)
+    elif ext == "png":
+        def chunk(kind, body):
+            return (struct.pack(">I", len(body)) + kind + body +
+                    struct.pack(">I", zlib.crc32(kind + body) & 0xffffffff))
+        stride = 3*width
+        view = memoryview(data)
+        raw = b"".join(b"\x00" + view[y*stride:(y+1)*stride] for y in range(height))
+        with open(filename, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+            f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+            f.write(chunk(b"IDAT", zlib.compress(raw, 1)))
+            f.write(chunk(b"IEND", b""))
+    else:
+        raise GraphicsError(BAD_OPTION)
 
         
 def color_rgb(r,g,b):
@@ -1016,8 +1139,5 @@ def test():
 #MacOS fix 2
 #tk.Toplevel(_root).destroy()
 
-# MacOS fix 1
-update()
-
 if __name__ == "__main__":
     test()
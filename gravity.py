@@ -0,0 +1,79 @@
+# gravity.py
+"""How fast shapes fall at every level.
+
+The time a shape takes to fall one row follows the curve of the Tetris
+guideline, (0.8 - (level-1)*0.007)**(level-1) seconds, scaled so that
+level 1 takes the game's delay: 800 ms, then about 630, 490, 380 ...
+down to under a millisecond at level 19. From INSTANT_LEVEL on a new
+shape drops to the bottom at once.
+
+Gravity does not rely on a timer firing at the right moment. It reads a
+monotonic clock whenever it is asked and adds the elapsed time as a
+fraction of a row, so a frame that comes late drops two rows instead of
+one and the fraction left over is kept for the next frame. The rate
+stays exact at high levels even with Tk's timer resolution and a frame
+rate far below the row rate.
+
+Example:
+    gravity = Gravity(800)
+    rows = gravity.rows_due(level)   # every frame
+"""
+
+import time
+
+
+class Gravity():
+    ''' Gravity class:
+        Turns elapsed time into rows to fall
+        Attributes: delay - type: float - seconds per row at level 1
+                    rows - type: float - the fraction of a row accumulated so far
+                    last - type: float - when rows was last brought up to date
+    '''
+
+    INSTANT_LEVEL = 20
+    LOCK_DELAY = 0.5 # the least time a landed shape stays before the next appears, seconds
+
+    def __init__(self, delay_ms=800, clock=time.perf_counter):
+        self.delay = delay_ms/1000
+        self.clock = clock
+        self.rows = 0.0
+        self.last = clock()
+        self.dropped = False # the shape fell at an instant level
+
+    def seconds_per_row(self, level):
+        ''' Return value: type: float - 0 from INSTANT_LEVEL on '''
+        if level >= self.INSTANT_LEVEL: return 0.0
+        level = max(1, level)
+        return self.delay*(0.8 - (level-1)*0.007)**(level-1)
+
+    def lock_delay(self, level):
+        ''' Return value: type: float - seconds between a shape landing and the next one '''
+        return max(self.seconds_per_row(level), self.LOCK_DELAY)
+
+    def restart(self, now=None):
+        ''' Starts counting from now with no fraction of a row, e.g. for a new shape '''
+        self.rows = 0.0
+        self.last = self.clock() if now is None else now
+        self.dropped = False
+
+    def rows_due(self, level, limit, now=None):
+        ''' Parameter: limit - type: int - the most rows that can be used, the board height
+            Return value: type: int - whole rows to fall since the last call
+        '''
+        now = self.clock() if now is None else now
+        per_row = self.seconds_per_row(level)
+        if per_row == 0.0: # all the way down, once per shape
+            self.last = now
+            if self.dropped: return 0
+            self.dropped = True
+            return limit
+        self.rows = min(self.rows + (now - self.last)/per_row, limit)
+        self.last = now
+        whole = int(self.rows)
+        self.rows -= whole
+        return whole
+
+    def until_next_row(self, level):
+        ''' Return value: type: float - seconds until the next row is due '''
+        per_row = self.seconds_per_row(level)
+        return max(0.0, (1 - self.rows)*per_row - (self.clock() - self.last))
@@ -0,0 +1,108 @@
+# kicks.py
+"""Wall kicks: where a shape may go when its rotated cells do not fit.
+
+A shape turns about its center block. If the turned cells leave the
+board or overlap the stack, the offsets of KICKS are tried in order and
+the shape moves by the first one that fits, so it can turn against a
+wall, the floor or the stack. The O does not turn, its table is empty.
+
+The offsets come from the Super Rotation System tables, one per
+transition between the four rotation states. SRS turns a shape about the
+center of its bounding box and spawns it in its own orientation; here J,
+L and T spawn upside down (SRS state 2), and I, L, S and Z turn about a
+block away from the SRS center. So KICKS is derived per kind: a shape's
+rotation counts turns from its spawn (0 at spawn, 1 after one turn to
+the right), and every offset includes the shift between turning about
+the center block and turning about the SRS center, so that each try
+lands on exactly the cells SRS gives. y is flipped because row 0 is the
+top of the board here.
+
+Board.rotate, the agent's search, env.py and perft.py all turn shapes
+with these tables, so what a search finds is what the game does.
+
+Example:
+    for dx, dy in kicks('T', rotation, 'Right'):
+        ...
+"""
+
+
+# (from, to) -> offsets, as published: x to the right, y up
+_JLSTZ = {(0, 1): [(0, 0), (-1, 0), (-1, 1), (0, -2), (-1, -2)],
+          (1, 0): [(0, 0), (1, 0), (1, -1), (0, 2), (1, 2)],
+          (1, 2): [(0, 0), (1, 0), (1, -1), (0, 2), (1, 2)],
+          (2, 1): [(0, 0), (-1, 0), (-1, 1), (0, -2), (-1, -2)],
+          (2, 3): [(0, 0), (1, 0), (1, 1), (0, -2), (1, -2)],
+          (3, 2): [(0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2)],
+          (3, 0): [(0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2)],
+          (0, 3): [(0, 0), (1, 0), (1, 1), (0, -2), (1, -2)]}
+_I = {(0, 1): [(0, 0), (-2, 0), (1, 0), (-2, -1), (1, 2)],
+      (1, 0): [(0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)],
+      (1, 2): [(0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)],
+      (2, 1): [(0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)],
+      (2, 3): [(0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)],
+      (3, 2): [(0, 0), (-2, 0), (1, 0), (-2, -1), (1, 2)],
+      (3, 0): [(0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)],
+      (0, 3): [(0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)]}
+
+# kind -> (the SRS state the shape spawns in, the SRS center relative to
+#          the shape's center block at spawn, x to the right and y down)
+SPAWN = {'I': (0, (-0.5, 0.5)), 'J': (2, (0, 0)), 'L': (2, (1, 0)),
+         'S': (0, (0, 1)), 'T': (2, (0, 0)), 'Z': (0, (0, 1))}
+
+TURN = {'Right': 1, 'Left': 3} # added to the rotation state, modulo 4
+
+def _turn(x, y, direction):
+    ''' Return value: type: tuple - the vector (x, y) turned a quarter, as Board.rotate turns '''
+    sign = 1 if direction == 'Right' else -1
+    return -sign*y, sign*x
+
+def _table(published, spawn, center):
+    ''' Parameters: spawn, center - the kind's entry of SPAWN
+        Return value: type: dictionary - (rotation, direction) -> offsets on the board
+    '''
+    table = {}
+    # The center block relative to the SRS center; it turns with the shape
+    away = (-center[0], -center[1])
+    for rotation in range(4):
+        state = (spawn + rotation) % 4
+        for direction, turn in TURN.items():
+            # Turning about the center block instead of the SRS center lands
+            #   the cells off by where the turn takes the center block
+            turned = _turn(*away, direction)
+            shift_x, shift_y = turned[0] - away[0], turned[1] - away[1]
+            offsets = published[(state, (state + turn) % 4)]
+            table[(rotation, direction)] = tuple((round(dx + shift_x), round(-dy + shift_y))
+                                                 for dx, dy in offsets)
+        away = _turn(*away, 'Right')
+    return table
+
+KICKS = {'O': {}}
+for kind, (spawn, center) in SPAWN.items():
+    KICKS[kind] = _table(_I if kind == 'I' else _JLSTZ, spawn, center)
+NO_KICKS = ((0, 0),) # a shape of no known kind only turns in place
+
+
+def kicks(kind, rotation, direction):
+    ''' Parameters: kind - type: string - the shape's letter, e.g. 'T'
+                    rotation - type: int - its rotation state, 0 to 3
+                    direction - type: string - 'Left' or 'Right'
+        Return value: type: tuple - the offsets to try, empty if it does not turn
+    '''
+    table = KICKS.get(kind)
+    if table is None: return NO_KICKS
+    return table.get((rotation, direction), ())
+
+def rotate(cells, center, kind, rotation, direction, fits):
+    ''' Turns cells about center as Board.rotate does
+        Parameter: fits - a function of a list of cells, True if they are free
+        Return value: type: tuple - (cells, center, rotation) after the turn,
+        None if no kick fits
+    '''
+    sign = 1 if direction == 'Right' else -1
+    c_x, c_y = center
+    turned = [(sign*(c_y - y) + c_x, -sign*(c_x - x) + c_y) for x, y in cells]
+    for dx, dy in kicks(kind, rotation, direction):
+        moved = [(x+dx, y+dy) for x, y in turned]
+        if fits(moved):
+            return moved, (c_x+dx, c_y+dy), (rotation + TURN[direction]) % 4
+    return None
@@ -0,0 +1,282 @@
+# perft.py
+"""Counts the placements reachable down a sequence of shapes ("perft").
+
+Chess engines check and time their move generators by counting every
+position reachable to a fixed depth. Here a node is a placement: a place
+where the shape comes to rest, reached from where Tetris spawns it with
+the moves of Board.move_on_board and Board.rotate (Left, Right, Down and
+rotating about the center block with the wall kicks of kicks.py). The
+shape is locked there, complete rows are removed and the next shape of
+the sequence is placed on the resulting board, down to the given depth.
+Placements are distinct when their cells are, however they were reached.
+
+A shape only locks where it cannot move down. The game also locks one
+that is pushed sideways into a block; perft does not count those.
+
+The generator works on bit mask rows like agent.py. --check generates
+the first placements again by moving Shapes on a real Board and stops
+if the two disagree, so a faster generator can be checked against the
+same counts.
+
+Usage: python perft.py [--depth 3] [--seed 0 | --shapes ITLO...] [--size 10x20]
+                       [--fill ROWS] [--processes N] [--divide] [--check]
+"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+from collections import deque
+
+from agent import fits
+from graphics import Point
+from kicks import TURN, kicks
+from render import NullBackend
+from tetris import Block, Board, Tetris
+
+
+SHAPE_NAMES = [shape_class.__name__[0] for shape_class in Tetris.SHAPES] # I, J, L, O, S, T, Z
+
+
+############################################################
+# MOVE GENERATOR
+############################################################
+
+def spawn(shape, width):
+    ''' Return value: type: tuple - (cells, center, kind) of shape, an index
+        into Tetris.SHAPES, where Tetris.create_new_shape puts it
+    '''
+    new = Tetris.SHAPES[shape](Point(width//2, 0))
+    return (tuple((b.x, b.y) for b in new.get_blocks()),
+            (new.center_block.x, new.center_block.y), new.kind)
+
+def placements(rows, width, cells, center, kind=None):
+    ''' Every resting place the shape can reach from cells, centered on center
+        Return value: type: list - the distinct resting cells, each a sorted tuple
+    '''
+    # A state is the center and the number of right turns; Board.rotate turns
+    # the cell (x, y) about the center to (c_x - (y - c_y), c_y + (x - c_x)),
+    # then moves it by the first kick where it fits
+    c_x, c_y = center
+    turns = [[(x - c_x, y - c_y) for x, y in cells]]
+    for i in range(3):
+        turns.append([(-dy, dx) for dx, dy in turns[-1]])
+    height = len(rows)
+    def fits(x0, y0, offsets):
+        for dx, dy in offsets:
+            x, y = x0+dx, y0+dy
+            if x < 0 or y < 0 or x >= width or y >= height or rows[y] >> x & 1:
+                return False
+        return True
+
+    turning = [[((turn + TURN[direction]) % 4, kicks(kind, turn, direction))
+                for direction in ('Left', 'Right')] for turn in range(4)]
+
+    start = (c_x, c_y, 0)
+    seen = {start}
+    todo = deque([start])
+    found = {}
+    while todo:
+        x0, y0, turn = state = todo.popleft()
+        offsets = turns[turn]
+        for next_state in ((x0-1, y0, turn), (x0+1, y0, turn), (x0, y0+1, turn)):
+            if next_state in seen: continue
+            x, y, t = next_state
+            if fits(x, y, offsets):
+                seen.add(next_state)
+                todo.append(next_state)
+        for t, offsets_tried in turning[turn]:
+            for dx, dy in offsets_tried:
+                if fits(x0+dx, y0+dy, turns[t]):
+                    next_state = (x0+dx, y0+dy, t)
+                    if next_state not in seen:
+                        seen.add(next_state)
+                        todo.append(next_state)
+                    break
+        if not fits(x0, y0+1, offsets): # resting
+            found[tuple(sorted((x0+dx, y0+dy) for dx, dy in offsets))] = True
+    return list(found)
+
+def lock(rows, cells, full):
+    ''' Return value: type: list - rows with cells locked in and the complete rows removed '''
+    rows = list(rows)
+    for x, y in cells:
+        rows[y] |= 1 << x
+    kept = [row for row in rows if row != full]
+    return [0]*(len(rows) - len(kept)) + kept
+
+def perft(rows, width, shapes, counts, depth=0):
+    ''' Counts the placements of shapes[depth:] on rows into counts[depth:] '''
+    if depth == len(shapes): return
+    cells, center, kind = spawn(shapes[depth], width)
+    if not fits(rows, width, cells): return # topped out
+    full = (1 << width) - 1
+    found = placements(rows, width, cells, center, kind)
+    counts[depth] += len(found)
+    if depth+1 < len(shapes):
+        for landed in found:
+            perft(lock(rows, landed, full), width, shapes, counts, depth+1)
+
+def _subtree(job):
+    rows, width, shapes = job
+    counts = [0]*len(shapes)
+    perft(rows, width, shapes, counts, 1)
+    return counts
+
+def run(rows, width, shapes, processes=1, divide=False):
+    ''' Return value: type: tuple - (placements per depth, placements after
+        each first one if divide else None)
+    '''
+    counts = [0]*len(shapes)
+    cells, center, kind = spawn(shapes[0], width)
+    if not fits(rows, width, cells): return counts, [] if divide else None
+    first = placements(rows, width, cells, center, kind)
+    counts[0] = len(first)
+    full = (1 << width) - 1
+    jobs = [(lock(rows, landed, full), width, shapes) for landed in first]
+    if processes > 1 and len(shapes) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            subtrees = pool.map(_subtree, jobs, chunksize=1)
+    else:
+        subtrees = [_subtree(job) for job in jobs]
+    for subtree in subtrees:
+        for depth in range(1, len(shapes)):
+            counts[depth] += subtree[depth]
+    if divide:
+        return counts, [(landed, subtree[-1] if len(shapes) > 1 else 1)
+                        for landed, subtree in zip(first, subtrees)]
+    return counts, None
+
+
+############################################################
+# BOARD ORACLE
+############################################################
+
+def board_placements(rows, width, shape):
+    ''' placements() for shape, an index into Tetris.SHAPES, found by moving
+        a Shape on a real Board with move_on_board and rotate
+        Return value: type: set - the resting cells, each a sorted tuple
+    '''
+    board = Board(NullBackend(), width, len(rows))
+    for y, row in enumerate(rows):
+        for x in range(width):
+            if row >> x & 1: board.put_block(Block(Point(x, y), 'blue'))
+    start = Tetris.SHAPES[shape](Point(width//2, 0))
+    key = lambda s: (tuple(sorted((b.x, b.y) for b in s.get_blocks())),
+                     (s.center_block.x, s.center_block.y), s.rotation)
+    seen = {key(start)}
+    todo = deque([start])
+    found = set()
+    while todo:
+        shape = todo.popleft()
+        attempts = [(board.move_on_board, Tetris.DIRECTION[name]) for name in ('Left', 'Right', 'Down')]
+        attempts += [(board.rotate, 'Left'), (board.rotate, 'Right')]
+        for attempt, argument in attempts:
+            board._add_shape(shape.deepcopy())
+            board.cant_move = False
+            moved = attempt(argument)
+            after = board.active_shape
+            board.remove_shape(after)
+            if moved:
+                if key(after) not in seen:
+                    seen.add(key(after))
+                    todo.append(after)
+            elif argument is Tetris.DIRECTION['Down']:
+                found.add(key(shape)[0])
+    return found
+
+def check(rows, width, shapes, samples=20, seed=0):
+    ''' Compares placements() with board_placements() at the root and on
+        samples boards reached further down
+        Return value: type: int - the boards compared
+    '''
+    rng = random.Random(seed)
+    full = (1 << width) - 1
+    checked = 0
+    todo = [(rows, 0)]
+    while todo and checked < samples+1:
+        rows, depth = todo.pop(rng.randrange(len(todo)))
+        cells, center, kind = spawn(shapes[depth], width)
+        if not fits(rows, width, cells): continue
+        found = placements(rows, width, cells, center, kind)
+        oracle = board_placements(rows, width, shapes[depth])
+        if set(found) != oracle:
+            raise AssertionError("placements of {} differ from the Board's at depth {}: "
+                                 "{} extra, {} missing".format(SHAPE_NAMES[shapes[depth]], depth+1,
+                                 len(set(found) - oracle), len(oracle - set(found))))
+        checked += 1
+        if depth+1 < len(shapes):
+            for landed in rng.sample(found, min(3, len(found))):
+                todo.append((lock(rows, landed, full), depth+1))
+    return checked
+
+
+############################################################
+# BOARDS AND SEQUENCES
+############################################################
+
+def shape_sequence(count, seed):
+    ''' Return value: type: list - the first count shapes of Tetris(seed=seed) '''
+    rng = random.Random(seed)
+    return [rng.randrange(0, len(Tetris.SHAPES)) for i in range(count)]
+
+def filled_rows(width, height, fill, seed=0):
+    ''' Return value: type: list - bit mask rows, the lowest fill rows full
+        but for one random hole each
+    '''
+    rng = random.Random(seed)
+    full = (1 << width) - 1
+    return [0]*(height-fill) + [full & ~(1 << rng.randrange(width)) for y in range(fill)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the placements reachable down a sequence of shapes")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0, help="take the shapes of Tetris(seed=SEED)")
+    parser.add_argument('--shapes', metavar='LETTERS', help="the shapes instead, e.g. TIOL")
+    parser.add_argument('--size', metavar='COLSxROWS', default='{}x{}'.format(Tetris.BB_WIDTH, Tetris.BB_HEIGHT))
+    parser.add_argument('--fill', type=int, default=0, metavar='ROWS',
+                        help="start with ROWS rows at the bottom, one hole each")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="count the subtrees of the first placements on this many processes")
+    parser.add_argument('--divide', action='store_true',
+                        help="print the count below every first placement")
+    parser.add_argument('--check', action='store_true',
+                        help="compare the generator with moves on a real Board first")
+    args = parser.parse_args()
+
+    try:
+        width, height = map(int, args.size.split('x'))
+    except ValueError:
+        parser.error("--size must look like 10x20")
+    if args.shapes:
+        unknown = set(args.shapes.upper()) - set(SHAPE_NAMES)
+        if unknown: parser.error("unknown shapes {}, use {}".format(''.join(sorted(unknown)), ''.join(SHAPE_NAMES)))
+        shapes = [SHAPE_NAMES.index(letter) for letter in args.shapes.upper()][:args.depth]
+    else:
+        shapes = shape_sequence(args.depth, args.seed)
+    if len(shapes) < args.depth:
+        parser.error("--shapes has fewer than --depth shapes")
+    rows = filled_rows(width, height, args.fill, args.seed)
+
+    if args.check:
+        print("checked {} boards against Board.move_on_board and Board.rotate".format(
+              check(rows, width, shapes)), file=sys.stderr)
+    start = time.perf_counter()
+    counts, divided = run(rows, width, shapes, args.processes, args.divide)
+    elapsed = time.perf_counter() - start
+    if divided:
+        for landed, count in divided:
+            print("{}  {}".format(' '.join('{},{}'.format(x, y) for x, y in landed), count))
+    print("shapes {}".format(''.join(SHAPE_NAMES[shape] for shape in shapes)))
+    for depth, count in enumerate(counts):
+        print("depth {}: {} placements".format(depth+1, count))
+    nodes = sum(counts)
+    print("{} nodes in {:.2f} s, {:.0f} nodes/s on {} process{}".format(
+          nodes, elapsed, nodes/elapsed if elapsed else 0, args.processes,
+          'es' if args.processes > 1 else ''))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# profiling.py
+"""Low overhead timing of the phases of a game tick.
+
+Functions decorated with @profiled('phase') record how long every call
+took into a fixed-bucket histogram for that phase, from which p50, p95,
+p99 and max are reported. Recording is switched on and off at runtime
+with profiler.enable()/disable(); while off, a decorated function costs
+one attribute check on top of the call.
+
+The same calls can also be written as a timeline: with a Tracer
+attached, every call becomes a span in Chrome trace_event JSON, which
+chrome://tracing and Perfetto (ui.perfetto.dev) can open.
+
+While the profiler is on, garbage collections are recorded too, through
+gc.callbacks, as the phases gc.gen0, gc.gen1 and gc.gen2: the pauses the
+collector adds to whatever frame it interrupts.
+
+Example:
+    profiler.enable()
+    profiler.trace(Tracer('game.trace.json'))
+    ... play ...
+    print(profiler.format())
+    profiler.save('profile.json')
+    profiler.stop_trace()
+"""
+
+import bisect
+import collections
+import functools
+import gc
+import json
+import os
+import threading
+import time
+
+
+############################################################
+# HISTOGRAM
+############################################################
+
+class Histogram():
+    ''' Histogram class:
+        Counts durations in fixed, logarithmically spaced buckets, so
+        recording costs the same no matter how many samples there are
+        Attributes: count - type: int - number of samples
+                    total - type: float - sum of all samples in seconds
+                    max - type: float - the longest sample in seconds
+    '''
+
+    # Bucket upper bounds: 1 microsecond to about 16 seconds, 4 buckets per doubling
+    BOUNDS = [1e-6 * 2**(i/4) for i in range(97)]
+
+    def __init__(self):
+        self.counts = [0]*(len(self.BOUNDS)+1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def percentile(self, p):
+        ''' Parameter: p - type: float - between 0 and 100
+            Return value: type: float - the upper bound of the bucket that
+            holds the p-th percentile, in seconds (never above max)
+        '''
+        if not self.count: return 0.0
+        rank = p/100*self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self.BOUNDS[i] if i < len(self.BOUNDS) else self.max, self.max)
+        return self.max
+
+    def summary(self):
+        ''' Return value: type: dictionary - count and times in microseconds '''
+        us = 1e6
+        return {'count': self.count,
+                'total_ms': self.total*1e3,
+                'mean_us': self.total/self.count*us if self.count else 0.0,
+                'p50_us': self.percentile(50)*us,
+                'p95_us': self.percentile(95)*us,
+                'p99_us': self.percentile(99)*us,
+                'max_us': self.max*us,
+                # [upper bound in microseconds (None past the last bound), count]
+                'buckets': [[self.BOUNDS[i]*us if i < len(self.BOUNDS) else None, n]
+                            for i, n in enumerate(self.counts) if n]}
+
+
+############################################################
+# PROFILER
+############################################################
+
+class Profiler():
+    ''' Profiler class:
+        One histogram per phase name
+        Attributes: enabled - type: bool - whether decorated functions fill histograms
+                    tracer - type: Tracer - where spans go, None when not tracing
+                    active - type: bool - enabled or tracing, the only thing
+                             a decorated function checks
+                    phases - type: dictionary - phase name -> Histogram
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.tracer = None
+        self.active = False
+        self.phases = {}
+        self.gc_started = None
+
+    def _update_active(self):
+        self.active = self.enabled or self.tracer is not None
+        watching = self._collected in gc.callbacks
+        if self.active and not watching:
+            gc.callbacks.append(self._collected)
+        elif watching and not self.active:
+            gc.callbacks.remove(self._collected)
+
+    def _collected(self, phase, info):
+        ''' gc.callbacks hook: records every collection as gc.gen<generation> '''
+        if phase == 'start':
+            self.gc_started = time.perf_counter()
+        elif self.gc_started is not None:
+            self.record('gc.gen{}'.format(info['generation']), self.gc_started,
+                        time.perf_counter(), {'collected': info['collected']})
+            self.gc_started = None
+
+    def enable(self):
+        self.enabled = True
+        self._update_active()
+
+    def disable(self):
+        self.enabled = False
+        self._update_active()
+
+    def toggle(self):
+        self.enable() if not self.enabled else self.disable()
+        return self.enabled
+
+    def trace(self, tracer):
+        ''' Parameter: tracer - type: Tracer - receives a span for every call '''
+        self.tracer = tracer
+        self._update_active()
+
+    def stop_trace(self):
+        ''' Detaches and closes the tracer '''
+        tracer, self.tracer = self.tracer, None
+        self._update_active()
+        if tracer: tracer.close()
+
+    def reset(self):
+        self.phases = {}
+
+    def record(self, phase, start, end, args=None):
+        ''' Records a call of phase that ran from start to end (time.perf_counter) '''
+        if self.enabled:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.record(end - start)
+        tracer = self.tracer
+        if tracer is not None:
+            tracer.span(phase, start, end, args)
+
+    def summary(self):
+        return {phase: h.summary() for phase, h in sorted(self.phases.items())}
+
+    def save(self, filename):
+        ''' Writes the summary of every phase to filename as JSON '''
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def format(self):
+        ''' Return value: type: string - a table of the phases '''
+        lines = ["{:<20} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+                 'phase', 'calls', 'mean us', 'p50 us', 'p95 us', 'p99 us', 'max us')]
+        for phase, s in self.summary().items():
+            lines.append("{:<20} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                         phase, s['count'], s['mean_us'], s['p50_us'], s['p95_us'],
+                         s['p99_us'], s['max_us']))
+        return "\n".join(lines)
+
+profiler = Profiler()
+
+
+def profiled(phase, trace_args=None):
+    ''' Decorator: records the duration of every call as phase while the
+        profiler is enabled or tracing. trace_args, if given, is called
+        with the arguments of the call and returns a dictionary shown with
+        the span in the trace.
+    '''
+    def decorate(func):
+        @functools.wraps(func)
+        def timed(*args, **kws):
+            if not profiler.active:
+                return func(*args, **kws)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kws)
+            finally:
+                end = time.perf_counter()
+                details = trace_args(*args, **kws) if trace_args and profiler.tracer else None
+                profiler.record(phase, start, end, details)
+        return timed
+    return decorate
+
+
+############################################################
+# TRACER
+############################################################
+
+class Tracer():
+    ''' Tracer class:
+        Writes spans as Chrome trace_event JSON (complete 'X' events, which
+        nest by time within a thread). Events are buffered and written in
+        chunks of CHUNK events, so a trace can stay on for hours with a
+        small, constant amount of memory.
+        Attributes: filename - type: string - the trace file
+                    events - type: int - spans written so far
+    '''
+
+    CHUNK = 4096
+
+    def __init__(self, filename, process_name="tetris"):
+        self.filename = filename
+        self.file = open(filename, 'w')
+        # The array format; viewers accept it without the closing bracket,
+        #   so a trace of a crashed session still opens
+        self.file.write('[\n')
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.events = 0
+        self.first = True
+        self._metadata('process_name', threading.get_ident(), {'name': process_name})
+
+    def _metadata(self, name, tid, args):
+        self.buffer.append({'name': name, 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': args})
+
+    def span(self, name, start, end, args=None):
+        ''' Adds a span that ran from start to end (time.perf_counter) on the calling thread '''
+        tid = threading.get_ident()
+        event = {'name': name, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                 'ts': (start - self.origin)*1e6, 'dur': (end - start)*1e6}
+        if args: event['args'] = args
+        with self.lock:
+            if tid not in self.threads:
+                self.threads.add(tid)
+                self._metadata('thread_name', tid, {'name': threading.current_thread().name})
+            self.buffer.append(event)
+            full = len(self.buffer) >= self.CHUNK
+        # flush() takes the lock itself
+        if full:
+            self.flush()
+
+    def flush(self):
+        ''' Writes the buffered events to the file '''
+        with self.lock:
+            events, self.buffer = self.buffer, []
+            if not events or self.file.closed: return
+            text = ',\n'.join(json.dumps(e, separators=(',', ':')) for e in events)
+            self.file.write(text if self.first else ',\n' + text)
+            self.first = False
+            self.events += len(events)
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if not self.file.closed:
+                self.file.write('\n]\n')
+                self.file.close()
+
+
+############################################################
+# PERFORMANCE OVERLAY
+############################################################
+
+class PerfOverlay():
+    ''' PerfOverlay class:
+        Live frame statistics of a game, shown through its render backend.
+        Samples are kept for the last second; the text is rebuilt at most
+        REFRESH_HZ times per second so drawing it barely shows up in what
+        it measures.
+        Attributes: game - type: Tetris - the game being measured
+                    visible - type: bool - whether the overlay is shown
+    '''
+
+    REFRESH_HZ = 4
+    WINDOW = 1.0 # seconds of samples behind every figure
+
+    def __init__(self, game):
+        self.game = game
+        self.visible = False
+        self.frames = collections.deque()    # (end time, duration)
+        self.latencies = collections.deque() # (apply time, latency)
+        self.last_refresh = 0.0
+
+    def frame(self, start, end):
+        ''' Records a frame that ran from start to end (time.perf_counter) '''
+        self.frames.append((end, end - start))
+        self._expire(self.frames, end)
+        if end - self.last_refresh >= 1/self.REFRESH_HZ:
+            self.refresh(end)
+
+    def input_applied(self, queued, now):
+        ''' Records an input that was queued at queued and applied at now '''
+        self.latencies.append((now, now - queued))
+        self._expire(self.latencies, now)
+
+    def _expire(self, samples, now):
+        ''' Drops the samples older than WINDOW, shown or not '''
+        horizon = now - self.WINDOW
+        while samples and samples[0][0] < horizon:
+            samples.popleft()
+
+    def lines(self, now):
+        ''' Return value: type: list - the overlay text, one string per line '''
+        for samples in (self.frames, self.latencies):
+            self._expire(samples, now)
+        worst = max((d for t, d in self.frames), default=0.0)
+        latency = max((d for t, d in self.latencies), default=None)
+        items = self.game.board.backend.item_count()
+        return ["FPS {:.0f}".format(len(self.frames)/self.WINDOW),
+                "worst {:.1f} ms".format(worst*1e3),
+                "queue {}".format(self.game.queue.qsize()),
+                "input {}".format('-' if latency is None else "{:.1f} ms".format(latency*1e3)),
+                "items {}".format('-' if items is None else items)]
+
+    def refresh(self, now=None):
+        now = time.perf_counter() if now is None else now
+        self.last_refresh = now
+        if self.visible:
+            self.game.board.backend.show_overlay(self.lines(now))
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible: self.refresh()
+        else: self.game.board.backend.hide_overlay()
+        return self.visible
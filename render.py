@@ -0,0 +1,618 @@
+# render.py
+"""Render backends for the Tetris board.
+
+A Board only keeps the game state. Everything that is shown goes through
+a RenderBackend: the board tells its backend which blocks appeared,
+disappeared or moved, and calls flush() once the grid is consistent
+again. The backend also owns the event loop (after/mainloop) and key
+input, since those differ between Tk and a terminal.
+
+Backends:
+    null   - draws nothing, for benchmarks and headless runs
+    canvas - every Block is its own rectangle on a GraphWin
+    raster - the whole board is one graphics.Image, repainted per cell
+    ansi   - colored cells on a terminal, works over SSH without X
+    panel  - a canvas board in a region of a window shared with other
+             boards, used by dashboard.py (not selectable with --render)
+"""
+
+import heapq
+import itertools
+import os
+import select
+import sys
+import time
+import _tkinter
+
+from graphics import GraphWin, Image, Point, Rectangle, Text, Viewport
+
+# Every block canvas item carries BLOCK_TAG and the tag of its color, so
+#   restyling all blocks, or all blocks of one color, is a single itemconfig
+BLOCK_TAG = 'block'
+FLASH_TAG = 'flash'
+DIM_TAG = 'dim'
+
+def color_tag(color):
+    return 'color:' + color.replace(' ', '_')
+
+try:
+    import termios, tty
+except ImportError: # Windows: output still works, keyboard input does not
+    termios = tty = None
+
+
+############################################################
+# NULL BACKEND
+############################################################
+
+class RenderBackend():
+    ''' RenderBackend class:
+        Base class for everything that can display a Board. Every hook
+        does nothing, so the base class is also the no-op backend.
+        It provides a small timer loop for backends that have no
+        event loop of their own.
+        Attributes: board - type: Board - the board being displayed, set by attach
+    '''
+
+    name = 'null'
+
+    def __init__(self, title="Tetris"):
+        self.title = title
+        self.board = None
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self.closed = False
+
+    def attach(self, board):
+        ''' Parameter: board - type: Board
+            Called once by the board before anything is drawn
+        '''
+        self.board = board
+
+    def draw_block(self, block):
+        ''' Called after block was put into the board grid '''
+
+    def undraw_block(self, block):
+        ''' Called after block was taken out of the board grid '''
+
+    def moved_block(self, block, old_x, old_y):
+        ''' Called after a block in the grid moved from old_x, old_y '''
+
+    def set_score(self, text):
+        ''' Shows the score line '''
+
+    def show_stats(self, stats):
+        ''' Parameter: stats - type: GameStats
+            Shows the statistics of the game, called at most once per frame
+        '''
+        self.set_score("Score: {}".format(stats.score))
+
+    def show_game_over(self):
+        ''' Shows that the game has ended '''
+
+    def set_theme(self, fills):
+        ''' Parameter: fills - type: dictionary - block color -> color to show
+            Recolors every block
+        '''
+
+    def flash_rows(self, rows):
+        ''' Highlights the complete rows about to be cleared '''
+
+    def dim(self):
+        ''' Dims every block, e.g. when the game is over '''
+
+    def show_overlay(self, lines):
+        ''' Parameter: lines - type: list - strings to show over the board '''
+
+    def hide_overlay(self):
+        ''' Removes the overlay '''
+
+    def item_count(self):
+        ''' Return value: the number of live canvas items, None without a canvas '''
+        return None
+
+    def flush(self):
+        ''' Called once the grid is consistent after a change '''
+
+    def bind_keys(self, handler):
+        ''' Parameter: handler - a function taking a Tk keysym string
+            Registers handler to be called for every key press
+        '''
+
+    def pump(self):
+        ''' Handles pending window events without blocking, for when another
+            event loop drives the game (see aio.py)
+            Return value: type: float - seconds until pump should run again,
+            None if the backend has no events to pump
+        '''
+        return None
+
+    def input_fd(self):
+        ''' Return value: type: int - a file descriptor that becomes readable
+            when read_keys() has keys to deliver, or None
+        '''
+        return None
+
+    def read_keys(self):
+        ''' Delivers the pending key presses to the handler of bind_keys '''
+
+    def after(self, ms, func, *args):
+        ''' Calls func(*args) after ms milliseconds from within mainloop '''
+        heapq.heappush(self._timers, (time.monotonic() + ms/1000, next(self._timer_ids), func, args))
+
+    def wait(self, timeout):
+        ''' Blocks for at most timeout seconds while mainloop has nothing to do '''
+        time.sleep(timeout)
+
+    def mainloop(self):
+        ''' Runs the timers registered with after() until there are none
+            left or the backend is closed
+        '''
+        while self._timers and not self.is_closed():
+            when = self._timers[0][0]
+            delay = when - time.monotonic()
+            if delay > 0:
+                self.wait(delay)
+                continue
+            when, i, func, args = heapq.heappop(self._timers)
+            func(*args)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+NullBackend = RenderBackend
+
+
+############################################################
+# TK CANVAS BACKEND
+############################################################
+
+class CanvasBackend(RenderBackend):
+    ''' CanvasBackend class:
+        Draws every Block as its own canvas rectangle on a GraphWin
+        Attributes: win - type: GraphWin - the window, created by attach
+                    block_size - type: float - pixels per board unit, by default
+                    BLOCK_SIZE shrunk to keep the window within MAX_HEIGHT;
+                    below one pixel for very tall boards, setCoords scales it
+    '''
+
+    name = 'canvas'
+    BACKGROUND = 'light gray'
+    BLOCK_SIZE = 25
+    MAX_HEIGHT = 1000
+    PUMP_INTERVAL = 1/120 # Tk has no descriptor to wait on, so pump() runs at this rate
+
+    def __init__(self, title="Tetris", block_size=None):
+        super().__init__(title)
+        self.block_size = block_size
+        self.win = None
+        self.text_score = None
+        self.text_overlay = None
+
+    def attach(self, board):
+        super().attach(board)
+        if self.block_size is None:
+            self.block_size = min(self.BLOCK_SIZE, self.MAX_HEIGHT/board.world_height)
+        self.win = self.open_window(max(1, round(self.block_size*board.world_width)),
+                                    max(1, round(self.block_size*board.world_height)))
+        # y grows downwards like the rows of the board
+        self.win.setCoords(0, board.world_height, board.world_width, 0)
+        self.draw_background()
+        self.text_score = Text(Point(2, 1), "Score: 0")
+        self.text_score.draw(self.win)
+
+    def open_window(self, width, height):
+        ''' Return value: type: GraphWin - where the board is drawn, width x height pixels;
+            it does not redraw after every canvas call, flush() does once per change
+        '''
+        win = GraphWin(self.title, width, height, autoflush=False)
+        win.setBackground(self.BACKGROUND)
+        return win
+
+    def flush(self):
+        ''' Lets Tk draw the canvas changes since the last flush '''
+        if not self.win.isClosed(): self.win.update()
+
+    def draw_background(self):
+        ''' Draws whatever sits below the blocks; nothing for the canvas backend '''
+
+    def draw_block(self, block):
+        block.draw(self.win)
+
+    def undraw_block(self, block):
+        block.undraw()
+
+    def set_score(self, text):
+        self.text_score.setText(text)
+
+    def show_game_over(self):
+        text = Text(Point(self.board.world_width/2, self.board.world_height/2), "Game over")
+        text.setFill('black')
+        text.setSize(36)
+        text.draw(self.win)
+
+    def set_theme(self, fills):
+        for color, fill in fills.items():
+            self.win.configTag(color_tag(color), fill=fill)
+
+    def flash_rows(self, rows):
+        win, board = self.win, self.board
+        left, _ = win.toScreen(0, 0)
+        right, _ = win.toScreen(board.world_width, 0)
+        side = board.world_height/board.height
+        for y in rows:
+            _, middle = win.toScreen(0, (y+0.5)*side)
+            win.addtag_overlapping(FLASH_TAG, left, middle, right, middle)
+        win.configTag(FLASH_TAG + '&&' + BLOCK_TAG, fill='white')
+        win.dtag(FLASH_TAG)
+        self.flush() # show the flash before the rows go
+
+    def dim(self):
+        self.win.configTag(BLOCK_TAG, stipple='gray50')
+
+    def show_overlay(self, lines):
+        text = "\n".join(lines)
+        if self.text_overlay is None:
+            self.text_overlay = Text(Point(self.board.world_width*0.8, 4), text)
+            self.text_overlay.setSize(10)
+            self.text_overlay.setFace('courier')
+        else:
+            self.text_overlay.setText(text)
+        if self.text_overlay.canvas is None:
+            self.text_overlay.draw(self.win)
+
+    def hide_overlay(self):
+        if self.text_overlay: self.text_overlay.undraw()
+
+    def item_count(self):
+        return len(self.win.items)
+
+    def bind_keys(self, handler):
+        self.win.bind_all('<Key>', lambda evnt: handler(evnt.keysym))
+
+    def pump(self):
+        root = self.win.getRoot()
+        while root.tk.dooneevent(_tkinter.DONT_WAIT):
+            pass
+        return self.PUMP_INTERVAL
+
+    def after(self, ms, func, *args):
+        self.win.getRoot().after(ms, func, *args)
+
+    def mainloop(self):
+        self.win.getRoot().mainloop()
+
+    def is_closed(self):
+        return self.win is None or self.win.isClosed()
+
+    def close(self):
+        if self.win: self.win.close()
+
+
+############################################################
+# PANEL BACKEND
+############################################################
+
+class PanelBackend(CanvasBackend):
+    ''' PanelBackend class:
+        Draws a board into its own Viewport of a window shared with other
+        boards, e.g. one panel of the dashboard. It never updates the
+        window; whoever owns the window flushes it once per frame.
+        Attributes: shared - type: GraphWin - the window the panel is part of
+                    x, y - type: int - the pixel position of the panel in it
+    '''
+
+    name = 'panel'
+    TEXT_SIZE = 8
+
+    def __init__(self, shared, x, y, block_size, title="Tetris"):
+        super().__init__(title, block_size)
+        self.shared = shared
+        self.x, self.y = x, y
+
+    def open_window(self, width, height):
+        return Viewport(self.shared, self.x, self.y, width, height)
+
+    def draw_background(self):
+        background = Rectangle(Point(0, 0), Point(self.board.world_width, self.board.world_height))
+        background.setFill(self.BACKGROUND)
+        background.setOutline(self.BACKGROUND)
+        background.draw(self.win)
+
+    def attach(self, board):
+        super().attach(board)
+        self.text_score.setSize(self.TEXT_SIZE)
+
+    def show_game_over(self):
+        text = Text(Point(self.board.world_width/2, self.board.world_height/2), "Game over")
+        text.setSize(self.TEXT_SIZE)
+        text.draw(self.win)
+
+    def dim(self):
+        # Only this panel's blocks, the block tag is shared by every panel
+        win = self.win
+        left, top = win.toScreen(0, 0)
+        right, bottom = win.toScreen(self.board.world_width, self.board.world_height)
+        win.addtag_enclosed(DIM_TAG, left-1, top-1, right+1, bottom+1)
+        win.configTag(DIM_TAG + '&&' + BLOCK_TAG, stipple='gray50')
+        win.dtag(DIM_TAG)
+
+    def bind_keys(self, handler):
+        pass # panels are played by agents
+
+    def flush(self):
+        pass # the dashboard updates the shared window once per frame
+
+    def close(self):
+        ''' Removes everything the panel drew, the shared window stays open '''
+        if self.win is None or self.win.isClosed(): return
+        for item in list(self.win.items):
+            item.undraw()
+
+
+############################################################
+# RASTER BACKEND
+############################################################
+
+class RasterBackend(CanvasBackend):
+    ''' RasterBackend class:
+        Renders the whole board grid into a single graphics.Image
+        instead of one canvas rectangle per Block
+        Attributes: image - type: Image - the pixel buffer shown on the board
+                    tiles - type: dictionary - pre-rendered Image per block color
+                    dirty - type: set - (x, y) cells that changed since the last flush
+    '''
+
+    name = 'raster'
+
+    def draw_background(self):
+        board = self.board
+        width, height = self.win.getWidth(), self.win.getHeight()
+        self.cell_width = width//board.width
+        self.cell_height = height//board.height
+        if not self.cell_width or not self.cell_height:
+            raise ValueError("A {}x{} board leaves less than a pixel per cell in a {}x{} window, "
+                             "use the canvas backend".format(board.width, board.height, width, height))
+        self.image = Image(Point(board.world_width/2, board.world_height/2), width, height)
+        self.image.fillRect(0, 0, width, height, self.BACKGROUND)
+        self.blank_tile = Image(Point(0,0), self.cell_width, self.cell_height)
+        self.blank_tile.fillRect(0, 0, self.cell_width, self.cell_height, self.BACKGROUND)
+        self.tiles = {}
+        self.fills = {}
+        self.dimmed = False
+        self.dirty = set()
+        self.image.draw(self.win)
+
+    def tile(self, color):
+        ''' Parameter: color - type: string
+            Return value: type: Image
+
+            returns the pre-rendered tile for color, rendering it
+            the first time the color is seen
+        '''
+        tile = self.tiles.get(color)
+        if tile is None:
+            fill = 'gray60' if self.dimmed else self.fills.get(color, color)
+            tile = Image(Point(0,0), self.cell_width, self.cell_height)
+            tile.fillRect(0, 0, self.cell_width, self.cell_height, 'black')
+            tile.fillRect(1, 1, self.cell_width-1, self.cell_height-1, fill)
+            self.tiles[color] = tile
+        return tile
+
+    def repaint(self):
+        ''' Drops the rendered tiles and redraws every block with new ones '''
+        self.tiles.clear()
+        blank = self.board.blank_block
+        for x, column in enumerate(self.board.grid):
+            for y, block in enumerate(column):
+                if block is not blank: self.dirty.add((x, y))
+
+    def set_theme(self, fills):
+        self.fills = dict(fills)
+        self.repaint()
+
+    def flash_rows(self, rows):
+        for y in rows:
+            self.image.fillRect(0, y*self.cell_height, self.board.width*self.cell_width,
+                                (y+1)*self.cell_height, 'white')
+        CanvasBackend.flush(self) # show the flash, the dirty cells are copied later
+
+    def dim(self):
+        self.dimmed = True
+        self.repaint()
+
+    def draw_block(self, block):
+        self.dirty.add((block.x, block.y))
+
+    def undraw_block(self, block):
+        self.dirty.add((block.x, block.y))
+
+    def moved_block(self, block, old_x, old_y):
+        self.dirty.add((old_x, old_y))
+        self.dirty.add((block.x, block.y))
+
+    def flush(self):
+        ''' Copies the tile of every dirty cell into the image
+        '''
+        if not self.dirty: return
+        grid = self.board.grid
+        blank = self.board.blank_block
+        for x, y in self.dirty:
+            block = grid[x][y]
+            tile = self.blank_tile if block is blank else self.tile(block.color)
+            self.image.paste(tile, x*self.cell_width, y*self.cell_height)
+        self.dirty.clear()
+        super().flush()
+
+
+############################################################
+# ANSI TERMINAL BACKEND
+############################################################
+
+class AnsiBackend(RenderBackend):
+    ''' AnsiBackend class:
+        Draws the board as colored character cells on a terminal and
+        reads the keyboard from stdin, so a game can be played over SSH
+        Attributes: stream - the file the board is written to
+                    dirty - type: set - rows that changed since the last flush
+    '''
+
+    name = 'ansi'
+    # 256-color palette indexes for the Tk color names used by the shapes
+    COLORS = {'blue': 21, 'orange': 208, 'cyan': 51, 'red': 196,
+              'green': 46, 'yellow': 226, 'magenta': 201, 'dim gray': 242}
+    BACKGROUND = 252
+    # Terminal key sequences and the Tk keysyms they stand for
+    KEYS = {'\x1b[A': 'KP_0', '\x1b[B': 'Down', '\x1b[C': 'Right', '\x1b[D': 'Left',
+            ' ': 'space', 'z': 'Control_R', 'x': 'KP_0', 'e': 'e', 'c': 'c'}
+
+    DIM = 244
+    FLASH = 231
+
+    def __init__(self, title="Tetris", stream=None, keyboard=None):
+        super().__init__(title)
+        self.stream = stream if stream is not None else sys.stdout
+        self.keyboard = keyboard if keyboard is not None else sys.stdin
+        self.handler = None
+        self.palette = dict(self.COLORS)
+        self.overlay_lines = 0
+        self.dimmed = False
+        self.dirty = set()
+        self.score = ""
+        self._saved_tty = None
+
+    def attach(self, board):
+        super().attach(board)
+        self.dirty.update(range(board.height))
+        self.stream.write("\x1b[2J\x1b[?25l")
+
+    def _cell(self, block):
+        if block is self.board.blank_block:
+            color = self.BACKGROUND
+        elif self.dimmed:
+            color = self.DIM
+        else:
+            color = self.palette.get(block.color, 15)
+        return "\x1b[48;5;{}m  ".format(color)
+
+    @classmethod
+    def palette_index(cls, color):
+        ''' Return value: type: int - the closest 256-color index for a Tk
+            color name, '#rrggbb' or 'grayNN' color
+        '''
+        if color in cls.COLORS:
+            return cls.COLORS[color]
+        if color.startswith('#') and len(color) == 7:
+            r, g, b = (int(color[i:i+2], 16) for i in (1, 3, 5))
+            return 16 + 36*round(r/51) + 6*round(g/51) + round(b/51)
+        if color.startswith('gray') and color[4:].isdigit():
+            return 232 + min(23, int(color[4:])*24//100)
+        return 15
+
+    def set_theme(self, fills):
+        self.palette = {color: self.palette_index(fill) for color, fill in fills.items()}
+        self.dirty.update(range(self.board.height))
+
+    def flash_rows(self, rows):
+        for y in rows:
+            self.stream.write("\x1b[{};1H\x1b[48;5;{}m{}\x1b[0m".format(
+                              y+2, self.FLASH, "  "*self.board.width))
+        self.stream.flush()
+
+    def dim(self):
+        self.dimmed = True
+        self.dirty.update(range(self.board.height))
+
+    def show_overlay(self, lines):
+        column = 2*self.board.width + 3
+        self.overlay_lines = len(lines)
+        self.stream.write("\x1b[0m" + "".join("\x1b[{};{}H{}\x1b[K".format(i+2, column, line)
+                                              for i, line in enumerate(lines)))
+        self.stream.flush()
+
+    def hide_overlay(self):
+        column = 2*self.board.width + 3
+        self.stream.write("".join("\x1b[{};{}H\x1b[K".format(i+2, column)
+                                  for i in range(self.overlay_lines)))
+        self.stream.flush()
+
+    def draw_block(self, block):
+        self.dirty.add(block.y)
+
+    def undraw_block(self, block):
+        self.dirty.add(block.y)
+
+    def moved_block(self, block, old_x, old_y):
+        self.dirty.add(old_y)
+        self.dirty.add(block.y)
+
+    def set_score(self, text):
+        self.score = text
+        self.stream.write("\x1b[1;1H\x1b[0m{}\x1b[K".format(text))
+
+    def show_stats(self, stats):
+        self.set_score(stats.format())
+
+    def show_game_over(self):
+        self.stream.write("\x1b[{};1H\x1b[0mGame over\x1b[K\n".format(self.board.height+2))
+        self.stream.flush()
+
+    def flush(self):
+        ''' Rewrites every dirty row, the terminal keeps the rest '''
+        if not self.dirty: return
+        board = self.board
+        out = []
+        for y in sorted(self.dirty):
+            out.append("\x1b[{};1H".format(y+2))
+            out.extend(self._cell(board.grid[x][y]) for x in range(board.width))
+        out.append("\x1b[0m")
+        self.dirty.clear()
+        self.stream.write("".join(out))
+        self.stream.flush()
+
+    def bind_keys(self, handler):
+        self.handler = handler
+        if termios and self.keyboard.isatty() and self._saved_tty is None:
+            fd = self.keyboard.fileno()
+            self._saved_tty = termios.tcgetattr(fd)
+            tty.setcbreak(fd)
+
+    def wait(self, timeout):
+        ''' Sleeps until timeout or a key press, whichever comes first '''
+        if self._saved_tty is None:
+            time.sleep(timeout)
+            return
+        ready, _, _ = select.select([self.keyboard], [], [], timeout)
+        if ready:
+            self.read_keys()
+
+    def input_fd(self):
+        return self.keyboard.fileno() if self._saved_tty is not None else None
+
+    def read_keys(self):
+        data = os.read(self.keyboard.fileno(), 64).decode(errors='ignore')
+        while data:
+            for seq, keysym in self.KEYS.items():
+                if data.startswith(seq):
+                    data = data[len(seq):]
+                    self.handler(keysym)
+                    break
+            else:
+                data = data[1:]
+
+    def close(self):
+        if self._saved_tty is not None:
+            termios.tcsetattr(self.keyboard.fileno(), termios.TCSADRAIN, self._saved_tty)
+            self._saved_tty = None
+        self.stream.write("\x1b[0m\x1b[?25h\x1b[{};1H\n".format(self.board.height+3 if self.board else 1))
+        self.stream.flush()
+        super().close()
+
+
+BACKENDS = {'canvas': CanvasBackend,
+            'raster': RasterBackend,
+            'ansi': AnsiBackend,
+            'null': NullBackend}
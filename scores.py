@@ -0,0 +1,269 @@
+# scores.py
+"""A persistent store of finished games and high scores.
+
+A store is a directory of three files:
+
+    records.bin - every finished game as one fixed size RECORD, only ever
+                  appended to, so record n is at byte n*RECORD.size
+    names.txt   - the agent and version names the records refer to by
+                  number, line n is name n
+    index.json  - the TOP_KEPT best records and per agent totals, and how
+                  many records they cover
+
+Records are collected in memory and written in batches, with one fsync
+per batch (BATCH records or SYNC_INTERVAL seconds, whichever comes
+first) instead of one per game. The index is small and rewritten after
+every batch; the top scores and agent totals are read from it, so
+neither depends on how many records the store holds. If the index is
+behind the records (the process died between the two writes) only the
+records it does not cover are read to catch up, and a partly written
+record at the end of records.bin is cut off.
+
+Usage: python scores.py [DIR] [--top 10] [--agents]
+"""
+
+import argparse
+import bisect
+import json
+import os
+import struct
+import sys
+import time
+
+
+# seed, score, lines, duration in seconds, finished at (Unix time), agent name, version name
+RECORD = struct.Struct('<qQIddHH')
+NO_SEED = -1
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.tetris_scores')
+
+
+class ScoreStore():
+    ''' ScoreStore class:
+        Attributes: directory - type: string - where the files are
+                    count - type: int - records in the store, written or not
+                    index - type: dictionary - 'records', 'top' and 'agents'
+    '''
+
+    TOP_KEPT = 100
+    BATCH = 64
+    SYNC_INTERVAL = 1.0 # seconds
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.records_path = os.path.join(directory, 'records.bin')
+        self.names_path = os.path.join(directory, 'names.txt')
+        self.index_path = os.path.join(directory, 'index.json')
+
+        self.names = []
+        if os.path.exists(self.names_path):
+            with open(self.names_path, encoding='utf-8') as f:
+                self.names = f.read().splitlines()
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+        self.new_names = []
+
+        self.file = open(self.records_path, 'a+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD.size: # a record was cut off by a crash
+            self.file.truncate(size - size % RECORD.size)
+        self.written = size//RECORD.size
+        self.count = self.written
+        self.batch = bytearray()
+        self.batch_started = None
+
+        self.index = self._load_index()
+        if self.index['records'] > self.written: # the index is not about these records
+            self.index = self._empty_index()
+        if self.index['records'] < self.written:
+            self._catch_up(self.index['records'])
+
+    ############################################################
+    # INDEX
+
+    def _empty_index(self):
+        return {'records': 0, 'top': [], 'agents': {}}
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            if {'records', 'top', 'agents'} <= set(index): return index
+        except (OSError, ValueError):
+            pass
+        return self._empty_index()
+
+    def _catch_up(self, start):
+        ''' Adds records start.. to the index, reading only those '''
+        for number, record in enumerate(self.scan(start), start):
+            self._index_record(number, record)
+        self.index['records'] = self.written
+        self._save_index()
+
+    def _index_record(self, number, record):
+        seed, score, lines, duration, finished, agent, version = record
+        top = self.index['top']
+        # Sorted by score, best first; an older record wins a tie
+        key = [-score, number]
+        if len(top) < self.TOP_KEPT or key < top[-1]:
+            bisect.insort(top, key)
+            del top[self.TOP_KEPT:]
+        totals = self.index['agents'].setdefault(self.names[agent], {
+                 'games': 0, 'score': 0, 'best': 0, 'lines': 0, 'seconds': 0.0})
+        totals['games'] += 1
+        totals['score'] += score
+        totals['lines'] += lines
+        totals['seconds'] += duration
+        if score > totals['best']: totals['best'] = score
+
+    def _save_index(self):
+        temporary = self.index_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(temporary, self.index_path) # a reader sees the old or the new index, never half
+
+    ############################################################
+    # WRITING
+
+    def _name_id(self, name):
+        number = self.name_ids.get(name)
+        if number is None:
+            number = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            self.new_names.append(name)
+        return number
+
+    def append(self, seed, score, lines, duration, agent='human', version='', finished=None):
+        ''' Adds a finished game; it is written with the current batch
+            Return value: type: int - the number of the record
+        '''
+        record = (NO_SEED if seed is None else seed, score, lines, duration,
+                  time.time() if finished is None else finished,
+                  self._name_id(agent), self._name_id(version))
+        number = self.count
+        self.batch += RECORD.pack(*record)
+        self.count += 1
+        self._index_record(number, record)
+        now = time.monotonic()
+        if self.batch_started is None: self.batch_started = now
+        if len(self.batch) >= self.BATCH*RECORD.size or now - self.batch_started >= self.SYNC_INTERVAL:
+            self.flush()
+        return number
+
+    def add_game(self, game, agent='human', version=''):
+        ''' Adds a finished Tetris game
+            Return value: type: int - the number of the record
+        '''
+        stats = game.board.stats
+        return self.append(game.seed, stats.score, stats.lines,
+                           time.perf_counter() - stats.started, agent, version)
+
+    def flush(self):
+        ''' Writes the batch with one fsync, then the index that covers it '''
+        if not self.batch: return
+        if self.new_names: # names first, a record must never point past them
+            with open(self.names_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(name + '\n' for name in self.new_names))
+                f.flush()
+                os.fsync(f.fileno())
+            self.new_names = []
+        self.file.write(self.batch)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.written = self.count
+        self.batch = bytearray()
+        self.batch_started = None
+        self.index['records'] = self.written
+        self._save_index()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    ############################################################
+    # READING
+
+    def read(self, number):
+        ''' Return value: type: dictionary - record number '''
+        if number >= self.written:
+            offset = (number - self.written)*RECORD.size
+            record = RECORD.unpack_from(self.batch, offset)
+        else:
+            record = RECORD.unpack(os.pread(self.file.fileno(), RECORD.size, number*RECORD.size))
+        return self._as_dict(number, record)
+
+    def _as_dict(self, number, record):
+        seed, score, lines, duration, finished, agent, version = record
+        return {'number': number, 'seed': None if seed == NO_SEED else seed, 'score': score,
+                'lines': lines, 'duration': duration, 'finished': finished,
+                'agent': self.names[agent], 'version': self.names[version]}
+
+    def scan(self, start=0, chunk=4096):
+        ''' Yields: the tuple of every written record from number start on '''
+        fd = self.file.fileno()
+        number = start
+        while number < self.written:
+            data = os.pread(fd, min(chunk, self.written - number)*RECORD.size, number*RECORD.size)
+            if not data: return
+            for record in RECORD.iter_unpack(data):
+                yield record
+            number += len(data)//RECORD.size
+
+    def top(self, n=10):
+        ''' Return value: type: list - the n best records, best first. Up to
+            TOP_KEPT comes from the index, more needs a full scan
+        '''
+        if n <= self.TOP_KEPT:
+            return [self.read(number) for score, number in self.index['top'][:n]]
+        self.flush()
+        best = sorted(([-r[1], i] for i, r in enumerate(self.scan())))[:n]
+        return [self.read(number) for score, number in best]
+
+    def rank(self, number):
+        ''' Return value: type: int - 1 for the best record, None below TOP_KEPT '''
+        for i, (score, kept) in enumerate(self.index['top']):
+            if kept == number: return i+1
+        return None
+
+    def agents(self):
+        ''' Return value: type: dictionary - agent name -> games, score, best,
+            lines, seconds and mean score
+        '''
+        result = {}
+        for name, totals in self.index['agents'].items():
+            result[name] = dict(totals, mean=totals['score']/totals['games'])
+        return result
+
+
+def format_top(records, highlight=None):
+    ''' Return value: type: string - a high score table '''
+    lines = ["{:>4} {:>10} {:>7} {:>8}  {:<12} {}".format('#', 'score', 'lines', 'time', 'agent', 'date')]
+    for i, r in enumerate(records):
+        mark = ' <' if r['number'] == highlight else ''
+        lines.append("{:>4} {:>10} {:>7} {:>7.0f}s  {:<12} {}{}".format(
+                     i+1, r['score'], r['lines'], r['duration'], r['agent'],
+                     time.strftime('%Y-%m-%d %H:%M', time.localtime(r['finished'])), mark))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the high scores")
+    parser.add_argument('directory', nargs='?', default=DEFAULT_DIR)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--agents', action='store_true', help="show the totals of every agent")
+    args = parser.parse_args()
+    if not os.path.exists(os.path.join(args.directory, 'records.bin')):
+        sys.exit("No scores in {}".format(args.directory))
+
+    store = ScoreStore(args.directory)
+    print("{} games in {}".format(store.count, args.directory))
+    print(format_top(store.top(args.top)))
+    if args.agents:
+        print("\n{:<12} {:>8} {:>10} {:>10} {:>10}".format('agent', 'games', 'best', 'mean', 'lines'))
+        for name, a in sorted(store.agents().items()):
+            print("{:<12} {:>8} {:>10} {:>10.1f} {:>10}".format(name, a['games'], a['best'],
+                                                                a['mean'], a['lines']))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+# spectate.py
+"""Streams a live game to any number of local viewers.
+
+A Publisher is ticked by the game after every update (see
+Tetris.publisher and --spectate). It encodes what changed on the board
+once, in the format of wire.py, and hands the same bytes to every
+subscriber: a KEYFRAME every KEYFRAME_PERIOD seconds, and in between only
+the rows and piece moves of each tick. A subscriber that joins gets the
+whole board right away.
+
+Nothing a subscriber does can slow the game down. All writes are non
+blocking; what a subscriber cannot take yet waits in its own buffer, and
+when that buffer is full (a few keyframes of the board) its queued
+deltas are thrown away and it gets a keyframe instead (it skips ahead).
+A subscriber that takes no bytes at all for DROP_AFTER seconds is
+disconnected.
+
+Addresses:
+    unix:PATH  - a Unix socket, any number of subscribers
+    pipe:PATH  - a named pipe (FIFO), one reader at a time
+
+Usage: python tetris.py --spectate unix:/tmp/tetris.sock
+       python spectate.py unix:/tmp/tetris.sock [--render ansi|canvas|null] [--record FILE]
+"""
+
+import argparse
+import collections
+import errno
+import os
+import socket
+import stat
+import sys
+import time
+
+import wire
+
+
+############################################################
+# SUBSCRIBERS
+############################################################
+
+class Subscriber():
+    ''' Subscriber class:
+        One viewer and the bytes it has not taken yet
+        Attributes: name - type: string - shown in the publisher's report
+                    buffered - type: int - bytes waiting to be written
+                    needs_keyframe - type: bool - its next messages are a keyframe
+                    skipped - type: int - times its queued deltas were dropped
+                    bytes_sent - type: int - bytes it has taken
+    '''
+
+    def __init__(self, name, write, close):
+        self.name = name
+        self.write = write   # write(bytes) -> bytes written, raises BlockingIOError when full
+        self._close = close
+        self.seq = 0
+        self.partial = b''   # the rest of a message that was partly written
+        self.pending = collections.deque() # whole messages not written yet
+        self.buffered = 0
+        self.needs_keyframe = True
+        self.skipped = 0
+        self.bytes_sent = 0
+        self.stalled_since = None
+
+    def queue(self, kind, payload=b''):
+        data = wire.HEADER.pack(kind, self.seq & 0xffffffff, len(payload)) + payload
+        self.seq += 1
+        self.pending.append(data)
+        self.buffered += len(data)
+
+    def skip_ahead(self):
+        ''' Drops the queued messages; the one being written is finished first '''
+        self.pending.clear()
+        self.buffered = len(self.partial)
+        self.needs_keyframe = True
+        self.skipped += 1
+
+    def flush(self, now, drop_after):
+        ''' Writes as much as the subscriber takes without blocking
+            Return value: type: bool - False if it should be disconnected
+        '''
+        if not self.buffered: return True
+        data = self.partial + b''.join(self.pending)
+        try:
+            written = self.write(data)
+        except BlockingIOError:
+            written = 0
+        except OSError: # it went away
+            return False
+        self.bytes_sent += written
+        if written:
+            self.stalled_since = None
+        elif self.stalled_since is None:
+            self.stalled_since = now
+        if written == len(data):
+            self.partial = b''
+            self.pending.clear()
+        elif written < len(self.partial):
+            self.partial = self.partial[written:]
+        else:
+            rest = written - len(self.partial)
+            while rest >= len(self.pending[0]):
+                rest -= len(self.pending.popleft())
+            self.partial = self.pending.popleft()[rest:] if rest else b''
+        self.buffered = len(data) - written
+        return self.stalled_since is None or now - self.stalled_since < drop_after
+
+    def close(self):
+        try:
+            self._close()
+        except OSError:
+            pass
+
+
+############################################################
+# PUBLISHER
+############################################################
+
+class Publisher():
+    ''' Publisher class:
+        Sends the state of a board to every subscriber of an address
+        Attributes: board - type: Board - the board being published
+                    address - type: string - unix:PATH or pipe:PATH
+                    subscribers - type: list - the connected Subscribers
+                    ticks - type: int - ticks published so far
+                    dropped - type: int - subscribers disconnected for stalling
+                    max_buffer - type: int - bytes a subscriber may fall behind
+                    before it skips ahead
+    '''
+
+    KEYFRAME_PERIOD = 2.0 # seconds
+    MIN_BUFFER = 64*1024  # bytes a subscriber may always fall behind
+    BUFFER_KEYFRAMES = 4  # or this many keyframes, for the boards where that is more
+    DROP_AFTER = 5.0      # seconds a subscriber may take nothing before it is dropped
+
+    def __init__(self, board, address):
+        self.board = board
+        self.address = address
+        self.encoder = wire.StateEncoder(board)
+        self.subscribers = []
+        self.lines = 0
+        self.ticks = 0
+        self.dropped = 0
+        # A subscriber must at least have room for the keyframe it gets on connect
+        self.max_buffer = max(self.MIN_BUFFER,
+                              self.BUFFER_KEYFRAMES*wire.keyframe_size(board.width, board.height))
+        self.next_keyframe = 0.0
+        self.listener = None
+        self.pipe = None
+        board.on_clear.append(self._on_clear)
+        kind, _, path = address.partition(':')
+        if kind == 'unix':
+            self._listen(path)
+        elif kind == 'pipe':
+            self.pipe = path
+            if not os.path.exists(path): os.mkfifo(path)
+        else:
+            raise ValueError("Unknown spectator address '{}', use unix:PATH or pipe:PATH".format(address))
+
+    def _on_clear(self, rows):
+        self.lines += rows
+
+    def _listen(self, path):
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path) # left over from a game that did not close it
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.path = path
+
+    def accept(self):
+        ''' Takes in the subscribers that connected since the last tick '''
+        if self.listener:
+            while True:
+                try:
+                    connection, _ = self.listener.accept()
+                except (BlockingIOError, InterruptedError):
+                    break
+                connection.setblocking(False)
+                self._add("subscriber {}".format(connection.fileno()),
+                          connection.send, connection.close)
+        elif self.pipe and not self.subscribers:
+            try: # fails with ENXIO until a reader opens the pipe
+                fd = os.open(self.pipe, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as error:
+                if error.errno != errno.ENXIO: raise
+                return
+            self._add("pipe reader", lambda data: os.write(fd, data), lambda: os.close(fd))
+
+    def _add(self, name, write, close):
+        subscriber = Subscriber(name, write, close)
+        subscriber.queue(wire.HELLO, wire.hello(self.board))
+        self.subscribers.append(subscriber)
+
+    def tick(self):
+        ''' Publishes the changes of the last tick; call it once per game tick '''
+        self.accept()
+        if not self.subscribers: return # the board's row tracker keeps the changes
+        self.ticks += 1
+        now = time.perf_counter()
+        if now >= self.next_keyframe:
+            self.encoder.keyframe_due = True
+            self.next_keyframe = now + self.KEYFRAME_PERIOD
+        messages = self.encoder.encode()
+        status = self.encoder.status_message(self.lines)
+        if status: messages.append(status)
+        keyframe = None
+        for subscriber in list(self.subscribers):
+            if not subscriber.needs_keyframe and messages:
+                size = sum(wire.HEADER.size + len(payload) for kind, payload in messages)
+                if subscriber.buffered + size > self.max_buffer:
+                    subscriber.skip_ahead()
+                else:
+                    for message in messages: subscriber.queue(*message)
+            if subscriber.needs_keyframe:
+                if keyframe is None: keyframe = self.encoder.keyframe()
+                for message in keyframe: subscriber.queue(*message)
+                subscriber.needs_keyframe = False
+            if not subscriber.flush(now, self.DROP_AFTER):
+                self.remove(subscriber, stalled=subscriber.stalled_since is not None)
+
+    def remove(self, subscriber, stalled=False):
+        self.subscribers.remove(subscriber)
+        subscriber.close()
+        if stalled: self.dropped += 1
+
+    def close(self):
+        ''' Sends the final state, says goodbye to every subscriber and
+            stops listening
+        '''
+        messages = self.encoder.encode() if self.subscribers else []
+        messages.append(self.encoder.status_message(self.lines, force=True))
+        for subscriber in list(self.subscribers):
+            for message in messages: subscriber.queue(*message)
+            subscriber.queue(wire.BYE)
+            subscriber.flush(time.perf_counter(), self.DROP_AFTER)
+            self.remove(subscriber)
+        if self.listener:
+            self.listener.close()
+            self.listener = None
+            os.remove(self.path)
+        self.board.on_clear.remove(self._on_clear)
+        self.encoder.close()
+
+    def report(self):
+        return "spectators: {} ticks published, {} connected, {} dropped for stalling".format(
+               self.ticks, len(self.subscribers), self.dropped)
+
+
+############################################################
+# VIEWER
+############################################################
+
+def open_stream(address):
+    ''' Return value: a binary file reading the stream published at address '''
+    kind, _, path = address.partition(':')
+    if kind == 'unix':
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+        return connection.makefile('rb')
+    if kind == 'pipe':
+        return open(path, 'rb')
+    raise ValueError("Unknown spectator address '{}', use unix:PATH or pipe:PATH".format(address))
+
+def read_messages(stream, record=None):
+    ''' Yields: (type, payload, gap) for every message of a stream until it
+        ends; record, if given, gets a copy of every byte read
+    '''
+    expected = 0
+    while True:
+        header = stream.read(wire.HEADER.size)
+        if len(header) < wire.HEADER.size: return
+        kind, seq, length = wire.HEADER.unpack(header)
+        payload = stream.read(length) if length else b''
+        if len(payload) < length: return
+        if record: record.write(header + payload)
+        gap = (seq - expected) & 0xffffffff
+        expected = (seq + 1) & 0xffffffff
+        yield kind, payload, gap
+
+def watch(address, render='ansi', record=None):
+    ''' Shows the game published at address until it ends
+        Return value: type: dictionary - counts of what was received
+    '''
+    # versus imports tetris, which imports this module
+    from versus import AnsiMirrorView, CanvasMirrorView, MirrorView
+    import graphics
+
+    mirror = wire.MirrorBoard()
+    if render == 'ansi':
+        view = AnsiMirrorView(mirror, sys.stdout, title="Watching")
+        sys.stdout.write("\x1b[2J")
+    elif render == 'canvas':
+        view = CanvasMirrorView(mirror, title="Watching")
+    else:
+        view = MirrorView(mirror)
+    counts = collections.Counter()
+    out = open(record, 'wb') if record else None
+    stream = open_stream(address)
+    try:
+        for kind, payload, gap in read_messages(stream, out):
+            counts[wire.NAMES.get(kind, kind)] += 1
+            counts['lost'] += gap
+            counts['bytes'] += wire.HEADER.size + len(payload)
+            if kind == wire.BYE: break
+            if mirror.apply(kind, payload):
+                view.draw()
+                if render == 'canvas': graphics.update()
+    finally:
+        stream.close()
+        if out: out.close()
+        if render == 'ansi':
+            sys.stdout.write("\x1b[0m\x1b[{};1H\n".format(mirror.height+2))
+        view.close()
+    counts['score'] = mirror.score
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a game started with --spectate")
+    parser.add_argument('address', help="unix:PATH or pipe:PATH")
+    parser.add_argument('--render', choices=['ansi', 'canvas', 'null'], default='ansi')
+    parser.add_argument('--record', metavar='FILE', help="also save the raw stream to FILE")
+    args = parser.parse_args()
+    try:
+        counts = watch(args.address, args.render, args.record)
+    except KeyboardInterrupt:
+        return
+    except (ConnectionError, FileNotFoundError) as error:
+        sys.exit("Cannot watch {}: {}".format(args.address, error))
+    print("final score {}, {} bytes, {} keyframes, {} row updates, {} piece moves, {} lost".format(
+          counts['score'], counts['bytes'], counts['KEYFRAME'], counts['ROWS'], counts['PIECE'],
+          counts['lost']), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
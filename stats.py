@@ -0,0 +1,83 @@
+# stats.py
+"""The statistics of one game, kept as plain counters.
+
+The engine updates a GameStats as the game goes (Board.stats): the score
+when rows are cleared, the lines, level and combo when a shape lands, the
+pieces when a shape appears and the actions when the player or an agent
+sends one. Updating a counter costs an addition; nothing is drawn. The
+display is refreshed from the counters at most once per frame (see
+Board.refresh_stats), and headless runs and benchmarks read them directly.
+
+Example:
+    stats = game.board.stats
+    print(stats.score, stats.lines, stats.level, stats.apm())
+"""
+
+import time
+
+
+class GameStats():
+    ''' GameStats class:
+        Attributes: score - type: int
+                    lines - type: int - rows cleared
+                    level - type: int - the start level, then one more every
+                    LINES_PER_LEVEL lines
+                    combo - type: int - shapes in a row that cleared rows
+                    max_combo - type: int - the longest combo so far
+                    pieces - type: int - shapes that appeared
+                    actions - type: int - actions sent by the player or an agent
+                    changed - type: bool - something changed since the display
+                    was last refreshed
+    '''
+
+    LINES_PER_LEVEL = 10
+
+    def __init__(self, level=1):
+        self.score = 0
+        self.lines = 0
+        self.start_level = level
+        self.level = level
+        self.combo = 0
+        self.max_combo = 0
+        self.pieces = 0
+        self.actions = 0
+        self.started = time.perf_counter()
+        self.changed = True
+
+    def add_score(self, points):
+        self.score += points
+        self.changed = True
+
+    def piece(self):
+        self.pieces += 1
+        self.changed = True
+
+    def action(self):
+        self.actions += 1 # shown with the next change, APM drifts with time anyway
+
+    def landed(self, rows):
+        ''' Parameter: rows - type: int - rows the landed shape completed '''
+        if rows:
+            self.lines += rows
+            self.level = self.start_level + self.lines//self.LINES_PER_LEVEL
+            self.combo += 1
+            if self.combo > self.max_combo: self.max_combo = self.combo
+            self.changed = True
+        elif self.combo:
+            self.combo = 0
+            self.changed = True
+
+    def apm(self, now=None):
+        ''' Return value: type: float - actions per minute since the game started '''
+        now = time.perf_counter() if now is None else now
+        minutes = (now - self.started)/60
+        return self.actions/minutes if minutes > 0 else 0.0
+
+    def as_dict(self, now=None):
+        return {'score': self.score, 'lines': self.lines, 'level': self.level,
+                'combo': self.combo, 'max_combo': self.max_combo, 'pieces': self.pieces,
+                'actions': self.actions, 'apm': round(self.apm(now), 1)}
+
+    def format(self):
+        ''' Return value: type: string - a short line for a score display '''
+        return "Score: {}  Lines: {}  Level: {}".format(self.score, self.lines, self.level)
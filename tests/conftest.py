@@ -0,0 +1,9 @@
+# conftest.py
+"""The game's modules sit at the top of the repository, next to this
+directory; put it on the path so the tests import them as the scripts do.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
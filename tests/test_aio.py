@@ -0,0 +1,54 @@
+# test_aio.py
+"""AsyncGame: the history file of an async game is complete however the game ends,
+and the overlay counts the frames of its display."""
+
+import asyncio
+import time
+
+from aio import AsyncGame, read_history
+from profiling import PerfOverlay
+from tetris import Tetris
+
+
+def test_quitting_mid_shape_keeps_the_history(tmp_path):
+    filename = str(tmp_path / 'game.history')
+    game = Tetris("aio", render_mode='null', seed=8, record=True)
+    runner = AsyncGame(game, history=filename)
+
+    async def play():
+        task = asyncio.ensure_future(runner.run())
+        for action in ['All Down', 'Left', 'Left', 'Rotate Right', 'All Down', 'Right', 'Rotate Left']:
+            game.input(action)
+            await asyncio.sleep(0.01)
+        game.key_eval('e') # quit, with actions since the last spawn
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(play())
+    assert game.runner is None
+    assert game.history[-1] == 'Rotate Left'
+    seed, history = read_history(filename)
+    assert (seed, history) == (8, game.history)
+    replayed = Tetris("aio", render_mode='null', seed=seed)
+    replayed.replay(history)
+    assert ({(b.x, b.y) for b in replayed.board.active_shape.get_blocks()} ==
+            {(b.x, b.y) for b in game.board.active_shape.get_blocks()})
+
+def test_overlay_counts_display_frames_not_input_batches():
+    game = Tetris("aio", render_mode='null', seed=1)
+    game.overlay = PerfOverlay(game)
+    runner = AsyncGame(game)
+
+    async def play():
+        task = asyncio.ensure_future(runner.run())
+        start = time.perf_counter()
+        for i in range(300):
+            game.input('Left' if i % 2 else 'Right')
+            await asyncio.sleep(0) # applied on its own, one update each
+        elapsed = time.perf_counter() - start
+        runner.stop()
+        await asyncio.wait_for(task, 5)
+        return elapsed
+
+    elapsed = asyncio.run(play())
+    assert game.board.stats.actions == 300
+    assert 1 <= len(game.overlay.frames) <= elapsed/AsyncGame.FRAME + 2
@@ -0,0 +1,23 @@
+# test_capture.py
+"""FrameCapture: a sink that keeps failing is counted, not kept frame by frame."""
+
+from capture import FrameCapture
+from tetris import Tetris
+
+
+class FailingSink():
+    def open(self, width, height, fps): pass
+    def write(self, number, pixels): raise OSError("disk full at frame {}".format(number))
+    def close(self): pass
+
+def test_failed_writes_keep_one_error():
+    game = Tetris("capture", render_mode='null', seed=0)
+    capture = FrameCapture(game.board, FailingSink(), ring_size=2)
+    for frame in range(20):
+        capture.capture()
+    capture.close()
+    assert capture.failed + capture.dropped == 20
+    assert capture.written == 0
+    assert str(capture.first_error) == "disk full at frame 0"
+    assert capture.first_error.__traceback__ is None
+    assert "{} failed to write (first: OSError".format(capture.failed) in capture.report()
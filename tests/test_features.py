@@ -0,0 +1,50 @@
+# test_features.py
+"""BoardFeatures.after against the features of the resulting board computed in full."""
+
+import random
+
+from agent import land, placements
+from features import FEATURES, BoardFeatures
+from perft import SHAPE_NAMES, spawn
+
+
+def random_rows(rng, width, height):
+    ''' Return value: type: list - a ragged stack with holes, some rows nearly full '''
+    full = (1 << width) - 1
+    rows = [0]*height
+    for y in range(rng.randrange(height//4, height*3//4), height):
+        if rng.random() < 0.3:
+            rows[y] = full & ~(1 << rng.randrange(width))
+        else:
+            rows[y] = rng.getrandbits(width) & full
+    return rows
+
+def test_after_matches_a_full_recompute():
+    rng = random.Random(7)
+    checked = 0
+    for board in range(40):
+        width, height = rng.choice([(10, 20), (6, 12), (13, 25)])
+        rows = random_rows(rng, width, height)
+        base = BoardFeatures(rows, width)
+        for shape in range(len(SHAPE_NAMES)):
+            cells, center, kind = spawn(shape, width)
+            for actions, landed in placements(rows, width, cells, center, kind):
+                after, lines = land(rows, width, landed)
+                expected = BoardFeatures(after, width).totals
+                expected['lines'] = lines
+                assert base.after(landed) == expected, (rows, landed)
+                checked += 1
+    assert checked > 1000
+
+def test_after_computes_only_the_names_asked_for():
+    rng = random.Random(3)
+    rows = random_rows(rng, 10, 20)
+    cells, center, kind = spawn(SHAPE_NAMES.index('T'), 10)
+    full = BoardFeatures(rows, 10)
+    some = BoardFeatures(rows, 10, ['holes', 'wells'])
+    for actions, landed in placements(rows, 10, cells, center, kind):
+        values = some.after(landed)
+        assert set(values) == {'lines', 'holes', 'wells'}
+        expected = full.after(landed)
+        assert all(values[name] == expected[name] for name in values)
+    assert set(full.totals) == set(FEATURES)
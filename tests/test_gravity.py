@@ -0,0 +1,25 @@
+# test_gravity.py
+"""Gravity: every new shape starts its own fall, whichever driver spawns it."""
+
+from tetris import Tetris
+
+
+def test_every_shape_drops_at_the_instant_levels():
+    game = Tetris("gravity", render_mode='null', seed=3, level=20)
+    board = game.board
+    for piece in range(6):
+        game.fall()
+        game.update()
+        assert board.cant_move # all the way down at once
+        game.animate() # spawns the next shape right away, as the dashboard does
+        assert not board.game_over
+
+def test_a_new_shape_starts_without_a_fraction_of_a_row():
+    game = Tetris("gravity", render_mode='null', seed=3)
+    gravity = game.gravity
+    game.input('All Down')
+    game.update()
+    gravity.rows = 0.9
+    game.spawn(now=12.0)
+    assert gravity.rows == 0.0
+    assert gravity.last == 12.0
@@ -0,0 +1,156 @@
+# test_kicks.py
+"""Wall kicks: the searches turn shapes exactly as Board.rotate does."""
+
+import random
+
+import kicks
+from agent import fits, snapshot
+from tetris import Tetris
+
+
+def test_every_kind_has_a_table():
+    for shape in Tetris.SHAPES:
+        for rotation in range(4):
+            for direction in ('Left', 'Right'):
+                offsets = kicks.kicks(shape.kind, rotation, direction)
+                if shape.kind == 'O': assert offsets == ()
+                else: assert len(offsets) == 5
+
+def test_rotate_matches_the_board():
+    rng = random.Random(1)
+    actions = ['Left', 'Right', 'Down', 'Down', 'Rotate Right', 'Rotate Left', 'All Down']
+    turns = 0
+    for seed in range(20):
+        game = Tetris("kicks", render_mode='null', seed=seed, width=rng.choice([6, 10, 13]))
+        for step in range(400):
+            board = game.board
+            if board.game_over: break
+            if board.cant_move:
+                game.spawn()
+                continue
+            action = rng.choice(actions)
+            if action.startswith('Rotate'):
+                rows, width, cells, center, kind, rotation = snapshot(board)
+                direction = action.split()[1]
+                expected = kicks.rotate(cells, center, kind, rotation, direction,
+                                        lambda cells: fits(rows, width, cells))
+                turned = board.rotate(direction)
+                shape = board.active_shape
+                if expected is None:
+                    assert not turned
+                else:
+                    assert turned
+                    assert sorted((b.x, b.y) for b in shape.get_blocks()) == sorted(expected[0])
+                    assert (shape.center_block.x, shape.center_block.y) == expected[1]
+                    assert shape.rotation == expected[2]
+                    turns += 1
+            else:
+                game.apply(action)
+    assert turns > 100
+
+
+############################################################
+# AGAINST THE SUPER ROTATION SYSTEM
+
+from graphics import Point
+from render import NullBackend
+from tetris import Board
+
+SHAPES = {shape.kind: shape for shape in Tetris.SHAPES}
+
+# The SRS shapes in their spawn state as published: cells in their
+#   bounding box, row 0 at the top, and the point of the box they turn about
+SRS = {'I': ([(0, 1), (1, 1), (2, 1), (3, 1)], (1.5, 1.5)),
+       'J': ([(0, 0), (0, 1), (1, 1), (2, 1)], (1, 1)),
+       'L': ([(2, 0), (0, 1), (1, 1), (2, 1)], (1, 1)),
+       'S': ([(1, 0), (2, 0), (0, 1), (1, 1)], (1, 1)),
+       'T': ([(1, 0), (0, 1), (1, 1), (2, 1)], (1, 1)),
+       'Z': ([(0, 0), (1, 0), (1, 1), (2, 1)], (1, 1))}
+# The SRS state of the shapes as this game spawns them: J, L and T upside down
+SPAWN_STATE = {'I': 0, 'J': 2, 'L': 2, 'S': 0, 'T': 2, 'Z': 0}
+
+def srs_cells(kind, state):
+    ''' Return value: type: set - the cells of kind in an SRS state, in its box '''
+    cells, (c_x, c_y) = SRS[kind]
+    for i in range(state):
+        cells = [(c_x - (y - c_y), c_y + (x - c_x)) for x, y in cells]
+    return {(round(x), round(y)) for x, y in cells}
+
+def srs_rotate(kind, state, cells, direction, free):
+    ''' Turns cells, a shape in an SRS state, the way SRS does
+        Return value: type: tuple - (cells, index of the kick used), None if none fits
+    '''
+    box = srs_cells(kind, state)
+    dx, dy = min(cells)[0] - min(box)[0], min(cells)[1] - min(box)[1]
+    assert {(x+dx, y+dy) for x, y in box} == set(cells)
+    turned = (state + kicks.TURN[direction]) % 4
+    table = kicks._I if kind == 'I' else kicks._JLSTZ
+    for index, (kx, ky) in enumerate(table[(state, turned)]):
+        moved = {(x + dx + kx, y + dy - ky) for x, y in srs_cells(kind, turned)} # published y is up
+        if all(free(cell) for cell in moved): return moved, index
+    return None
+
+def place(kind, center, turns=0, width=10, height=20):
+    ''' Return value: type: Board - an empty board with kind at center, turned
+        right turns times from its spawn state
+    '''
+    board = Board(NullBackend(), width, height)
+    shape = SHAPES[kind](Point(*center))
+    for i in range(turns): shape.rotate('Right')
+    board.add_shape(shape)
+    return board
+
+def cells_of(board):
+    return {(b.x, b.y) for b in board.active_shape.get_blocks()}
+
+def push(board, direction):
+    ''' Moves the shape as far as it goes in direction '''
+    while board.move_on_board(Tetris.DIRECTION[direction]): pass
+    board.cant_move = False # resting on the floor, it may still turn
+
+def test_t_kicks_off_the_floor():
+    board = place('T', (5, 19), turns=2) # SRS state 0, flat on the floor
+    assert cells_of(board) == {(4, 19), (5, 19), (6, 19), (5, 18)}
+    assert board.rotate('Right')
+    # The third SRS test, one left and one up
+    assert cells_of(board) == {(4, 17), (4, 18), (4, 19), (5, 18)}
+
+def test_t_kicks_off_the_right_wall():
+    board = place('T', (9, 10), turns=1) # SRS state L, against the wall
+    assert cells_of(board) == {(9, 9), (9, 10), (9, 11), (8, 10)}
+    assert board.rotate('Right')
+    assert cells_of(board) == {(8, 9), (7, 10), (8, 10), (9, 10)}
+
+def test_i_kicks_off_the_right_wall():
+    board = place('I', (9, 10), turns=1) # SRS state R, against the wall
+    assert cells_of(board) == {(9, 8), (9, 9), (9, 10), (9, 11)}
+    assert board.rotate('Left')
+    # The third SRS test, one left, in the row SRS turns the I into
+    assert cells_of(board) == {(6, 9), (7, 9), (8, 9), (9, 9)}
+
+def test_j_turns_in_place_as_srs_does():
+    board = place('J', (5, 10)) # SRS state 2
+    assert cells_of(board) == {(4, 10), (5, 10), (6, 10), (6, 11)}
+    assert board.rotate('Right')
+    assert cells_of(board) == {(5, 9), (5, 10), (5, 11), (4, 11)}
+
+def test_every_kind_kicks_like_srs_off_the_walls_and_the_floor():
+    kicked = set()
+    for kind in SRS:
+        for turns in range(4):
+            for wall in ('Left', 'Right', 'Down'):
+                for direction in ('Left', 'Right'):
+                    board = place(kind, (5, 8), turns)
+                    push(board, wall)
+                    before = cells_of(board)
+                    free = lambda cell: (0 <= cell[0] < board.width and 0 <= cell[1] < board.height
+                                         and (board.grid[cell[0]][cell[1]] is board.blank_block
+                                              or cell in before))
+                    state = (SPAWN_STATE[kind] + turns) % 4
+                    expected = srs_rotate(kind, state, before, direction, free)
+                    assert board.rotate(direction) == (expected is not None)
+                    if expected is None: continue
+                    assert cells_of(board) == expected[0], (kind, turns, wall, direction)
+                    assert board.active_shape.rotation == (turns + kicks.TURN[direction]) % 4
+                    if expected[1]: kicked.add((kind, wall))
+    assert kicked == {(kind, wall) for kind in SRS for wall in ('Left', 'Right', 'Down')}
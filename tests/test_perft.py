@@ -0,0 +1,15 @@
+# test_perft.py
+"""The move generator against moves on a real Board, as perft.py --check does."""
+
+from perft import SHAPE_NAMES, check, filled_rows, run
+
+
+def test_generator_matches_the_board():
+    for letters, fill in (('TIOL', 0), ('SZJT', 6), ('ILJO', 12)):
+        shapes = [SHAPE_NAMES.index(letter) for letter in letters]
+        assert check(filled_rows(10, 20, fill, seed=fill), 10, shapes, samples=8) > 1
+
+def test_parallel_count_is_the_serial_count():
+    shapes = [SHAPE_NAMES.index(letter) for letter in 'TS']
+    rows = filled_rows(10, 20, 4)
+    assert run(rows, 10, shapes, processes=2)[0] == run(rows, 10, shapes)[0]
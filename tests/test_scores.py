@@ -0,0 +1,73 @@
+# test_scores.py
+"""ScoreStore: the index is rebuilt or caught up from records.bin when it is missing or behind."""
+
+import os
+import random
+
+from scores import RECORD, ScoreStore
+
+
+def fill(store, count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        store.append(i, rng.randrange(10000), rng.randrange(200), rng.random()*100,
+                     agent=rng.choice(['human', 'greedy']), version='1.1', finished=1000.0+i)
+
+def expected_top(directory, n):
+    store = ScoreStore(directory)
+    records = [store._as_dict(i, r) for i, r in enumerate(store.scan())]
+    store.close()
+    return sorted(records, key=lambda r: (-r['score'], r['number']))[:n]
+
+def test_top_and_agents_survive_a_reopen(tmp_path):
+    store = ScoreStore(str(tmp_path))
+    fill(store, 300)
+    top, agents = store.top(10), store.agents()
+    store.close()
+    again = ScoreStore(str(tmp_path))
+    assert again.count == 300
+    assert again.top(10) == top == expected_top(str(tmp_path), 10)
+    assert again.agents() == agents
+    assert sum(totals['games'] for totals in agents.values()) == 300
+    again.close()
+
+def test_missing_index_is_rebuilt(tmp_path):
+    store = ScoreStore(str(tmp_path))
+    fill(store, 250)
+    top, agents = store.top(20), store.agents()
+    store.close()
+    os.remove(os.path.join(str(tmp_path), 'index.json'))
+    rebuilt = ScoreStore(str(tmp_path))
+    assert rebuilt.index['records'] == 250
+    assert rebuilt.top(20) == top
+    assert rebuilt.agents() == agents
+    rebuilt.close()
+
+def test_index_behind_the_records_catches_up(tmp_path):
+    store = ScoreStore(str(tmp_path))
+    fill(store, 100)
+    store.close()
+    index = open(os.path.join(str(tmp_path), 'index.json')).read()
+    store = ScoreStore(str(tmp_path))
+    fill(store, 100, seed=1)
+    store.close()
+    with open(os.path.join(str(tmp_path), 'index.json'), 'w') as f:
+        f.write(index) # as if the process died before the second index was written
+    behind = ScoreStore(str(tmp_path))
+    assert behind.index['records'] == 200
+    assert behind.top(10) == expected_top(str(tmp_path), 10)
+    assert sum(totals['games'] for totals in behind.agents().values()) == 200
+    behind.close()
+
+def test_partial_record_is_cut_off(tmp_path):
+    store = ScoreStore(str(tmp_path))
+    fill(store, 10)
+    store.close()
+    with open(os.path.join(str(tmp_path), 'records.bin'), 'ab') as f:
+        f.write(b'\x01' * (RECORD.size // 2))
+    store = ScoreStore(str(tmp_path))
+    assert store.count == 10
+    number = store.append(None, 5, 1, 2.0)
+    assert number == 10
+    store.close()
+    assert os.path.getsize(os.path.join(str(tmp_path), 'records.bin')) == 11*RECORD.size
@@ -0,0 +1,77 @@
+# test_spectate.py
+"""Publisher -> viewer over a Unix socket, on the default and the largest board."""
+
+import io
+import os
+import random
+import socket
+import threading
+
+import pytest
+
+import wire
+from spectate import Publisher, read_messages
+from tetris import Tetris
+from test_wire import board_cells, mirror_cells, play
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="needs Unix sockets")
+@pytest.mark.parametrize('width, height', [(10, 20), (200, 1000)])
+def test_viewer_sees_the_board(tmp_path, width, height):
+    game = Tetris("spectate", render_mode='null', seed=4, width=width, height=height)
+    address = 'unix:' + os.path.join(str(tmp_path), 'game.sock')
+    publisher = Publisher(game.board, address)
+    viewer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    viewer.connect(address.partition(':')[2])
+    mirror = wire.MirrorBoard()
+    kinds = []
+    def watch():
+        with viewer.makefile('rb') as stream:
+            for kind, payload, gap in read_messages(stream):
+                kinds.append(kind)
+                if kind == wire.BYE: break
+                mirror.apply(kind, payload)
+    reader = threading.Thread(target=watch)
+    reader.start()
+
+    rng = random.Random(4)
+    for tick in range(200):
+        play(game, rng, 2)
+        publisher.tick()
+        if game.board.game_over: break
+    subscriber = publisher.subscribers[0]
+    publisher.close()
+    reader.join(10)
+    viewer.close()
+
+    assert not reader.is_alive()
+    assert publisher.dropped == 0 and subscriber.skipped == 0
+    assert kinds[:2] == [wire.HELLO, wire.KEYFRAME] and kinds[-1] == wire.BYE
+    assert mirror_cells(mirror) == board_cells(game.board)
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="needs Unix sockets")
+def test_slow_viewer_of_a_large_board_keeps_its_deltas(tmp_path):
+    game = Tetris("spectate", render_mode='null', seed=6, width=200, height=1000)
+    publisher = Publisher(game.board, 'unix:' + os.path.join(str(tmp_path), 'game.sock'))
+    received = bytearray()
+    rate = [16*1024] # bytes the viewer takes per write, far less than a keyframe
+    def write(data):
+        taken = data[:rate[0]]
+        received.extend(taken)
+        return len(taken)
+    publisher._add("slow viewer", write, lambda: None)
+    subscriber = publisher.subscribers[0]
+
+    rng = random.Random(6)
+    for tick in range(60):
+        play(game, rng, 2)
+        publisher.tick()
+    rate[0] = None # catches up while the publisher closes
+    publisher.close()
+
+    assert subscriber.skipped == 0 and publisher.dropped == 0
+    mirror = wire.MirrorBoard()
+    for kind, payload, gap in read_messages(io.BytesIO(bytes(received))):
+        assert gap == 0
+        mirror.apply(kind, payload)
+    assert mirror_cells(mirror) == board_cells(game.board)
@@ -0,0 +1,104 @@
+# test_wire.py
+"""StateEncoder -> Channel -> MirrorBoard: the receiver ends up with the sender's board."""
+
+import asyncio
+import random
+import socket
+
+import wire
+from tetris import Tetris
+
+
+ACTIONS = ['Left', 'Right', 'Rotate Right', 'Rotate Left', 'Down', 'All Down']
+
+def board_cells(board):
+    ''' Return value: type: list - cells[y][x] as palette indexes, falling shape included '''
+    blank = board.blank_block
+    return [[0 if column[y] is blank else wire.INDEX.get(column[y].color, wire.UNKNOWN)
+             for column in board.grid] for y in range(board.height)]
+
+def mirror_cells(mirror):
+    return [mirror.row(y) for y in range(mirror.height)]
+
+def play(game, rng, moves):
+    for i in range(moves):
+        if game.board.game_over: return
+        if game.board.cant_move: game.spawn()
+        else: game.apply(rng.choice(ACTIONS))
+
+def test_pack_row_round_trip():
+    for width in (1, 2, 9, 10, 200):
+        indexes = [random.Random(width).randrange(16) for x in range(width)]
+        packed = wire.pack_row(indexes)
+        assert len(packed) == wire.row_bytes(width)
+        assert wire.unpack_row(packed, width) == indexes
+
+def test_mirror_follows_the_deltas():
+    game = Tetris("wire", render_mode='null', seed=5)
+    encoder = wire.StateEncoder(game.board)
+    mirror = wire.MirrorBoard()
+    mirror.apply(wire.HELLO, wire.hello(game.board))
+    rng = random.Random(5)
+    for tick in range(300):
+        play(game, rng, rng.randrange(1, 4))
+        for kind, payload in encoder.encode():
+            assert mirror.apply(kind, payload)
+        assert mirror_cells(mirror) == board_cells(game.board)
+        if game.board.game_over: break
+    encoder.close()
+
+def test_keyframe_brings_a_late_receiver_up_to_date():
+    game = Tetris("wire", render_mode='null', seed=9)
+    encoder = wire.StateEncoder(game.board)
+    rng = random.Random(9)
+    for tick in range(100):
+        play(game, rng, 3)
+        encoder.encode()
+    late = wire.MirrorBoard()
+    late.apply(wire.HELLO, wire.hello(game.board))
+    for kind, payload in encoder.keyframe():
+        late.apply(kind, payload)
+    assert mirror_cells(late) == board_cells(game.board)
+    encoder.close()
+
+async def exchange(messages):
+    ''' Sends messages over a socket pair
+        Return value: type: tuple - (sender, receiver, what receive() returned per message)
+    '''
+    left, right = socket.socketpair()
+    reader_a, writer_a = await asyncio.open_connection(sock=left)
+    reader_b, writer_b = await asyncio.open_connection(sock=right)
+    sender, receiver = wire.Channel(reader_a, writer_a), wire.Channel(reader_b, writer_b)
+    for kind, payload in messages:
+        sender.send(kind, payload)
+    await sender.drain()
+    received = [await receiver.receive() for message in messages]
+    sender.close()
+    assert await receiver.receive() is None # the other side closed
+    receiver.close()
+    return sender, receiver, received
+
+def test_channel_round_trip():
+    messages = [(wire.HELLO, wire.SIZE.pack(10, 20)), (wire.RESYNC, b''),
+                (wire.PING, wire.TIME.pack(1.5)), (wire.BYE, b'')]
+    sender, receiver, received = asyncio.run(exchange(messages))
+    assert [(kind, payload) for kind, payload, gap in received] == messages
+    assert all(gap == 0 for kind, payload, gap in received)
+    assert receiver.bytes_received == sender.bytes_sent
+
+def test_keyframe_of_the_largest_board_round_trip():
+    game = Tetris("wire", render_mode='null', seed=2, width=200, height=1000)
+    rng = random.Random(2)
+    for i in range(5): # a stack to send
+        game.board.add_garbage(20, rng.randrange(200))
+        play(game, rng, 30)
+    encoder = wire.StateEncoder(game.board)
+    messages = [(wire.HELLO, wire.hello(game.board))] + encoder.encode()
+    assert max(len(payload) for kind, payload in messages) > 0xffff
+    sender, receiver, received = asyncio.run(exchange(messages))
+    mirror = wire.MirrorBoard()
+    for kind, payload, gap in received:
+        assert gap == 0
+        mirror.apply(kind, payload)
+    assert mirror_cells(mirror) == board_cells(game.board)
+    encoder.close()
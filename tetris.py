@@ -1,9 +1,25 @@
+import time
+_START_TIME = time.perf_counter() # Measures import-to-first-frame time, see --report-startup
 from graphics import *
+import argparse
+import sys
 import random
 from copy import copy
 from os import _exit
 import threading
+import asyncio
 from asyncio import Queue
+from render import BACKENDS, NullBackend, BLOCK_TAG, color_tag
+from capture import FrameCapture
+from profiling import profiler, profiled, PerfOverlay, Tracer
+from diagnostics import Diagnostics
+from stats import GameStats
+from gravity import Gravity
+from kicks import TURN, kicks
+from agent import GreedyAgent
+from aio import AsyncGame, HistoryWriter
+from spectate import Publisher
+from scores import ScoreStore, DEFAULT_DIR, format_top
 
 
 def synchronized(method):
@@ -24,24 +40,67 @@ class Block(Rectangle):
                     y - type: int
         specify the position on the tetris board
         in terms of the square grid
+
+        All blocks of one color share a single style record as their config,
+        which also carries the canvas tags used to restyle them together
+
+        Blocks that leave the board go back to a pool (release) and new
+        shapes take theirs from it (acquire), so a long game does not keep
+        allocating blocks for the garbage collector to sweep
     '''
 
-    BLOCK_SIZE = 25 
     SIDE_LENGTH = 2
 
+    free = [] # released blocks, at most MAX_FREE
+    MAX_FREE = 4096
+
     lock = threading.Lock()
 
+    styles = {} # color -> the shared config dictionary of every block of that color
+
+    @classmethod
+    def style(cls, color):
+        ''' Parameter: color - type: string
+            Return value: type: dictionary - the style record for color
+        '''
+        style = cls.styles.get(color)
+        if style is None:
+            style = cls.styles[color] = {'outline': DEFAULT_CONFIG['outline'],
+                                         'width': DEFAULT_CONFIG['width'],
+                                         'fill': color,
+                                         'tags': (BLOCK_TAG, color_tag(color))}
+        return style
+
+    @classmethod
+    def acquire(cls, pos, color):
+        ''' Return value: type: Block - a released block reset to pos and
+            color, or a new one if the pool is empty
+        '''
+        try:
+            block = cls.free.pop()
+        except IndexError:
+            return cls(pos, color)
+        block.reset(pos, color)
+        return block
+
+    @classmethod
+    def release(cls, block):
+        ''' Parameter: block - type: Block - off every board and undrawn,
+            and no longer used by the caller
+        '''
+        if len(cls.free) < cls.MAX_FREE: cls.free.append(block)
+
     def __init__(self, pos, color):
         
         self.x = int(pos.x)
-        self.y = int(pos.y) # We take the top to be y=0 for calculation purposes
+        self.y = int(pos.y) # We take the top to be y=0, the backends flip their coordinates to match
         self.color = color
         
-        pos.y = Tetris.BOARD_HEIGHT- 2*pos.y
-        pos.x *= 2 
-        p2 = Point(pos.x+ self.SIDE_LENGTH, pos.y - self.SIDE_LENGTH ) 
-        Rectangle.__init__(self,pos,p2) # However in the Rectangle object, the lower left is (0,0)
-        self.setFill(color)
+        pos.x *= self.SIDE_LENGTH
+        pos.y *= self.SIDE_LENGTH
+        p2 = Point(pos.x + self.SIDE_LENGTH, pos.y + self.SIDE_LENGTH)
+        Rectangle.__init__(self,pos,p2)
+        self.config = Block.style(color)
    
     @synchronized 
     def move(self, dx=0, dy=1):
@@ -55,7 +114,17 @@ class Block(Rectangle):
         self.x += int(dx)
         self.y += int(dy)
         #print("Moving block to x: {}, y: {}".format(self.x, self.y))
-        Rectangle.move(self, dx*self.SIDE_LENGTH ,-dy*self.SIDE_LENGTH)
+        Rectangle.move(self, dx*self.SIDE_LENGTH, dy*self.SIDE_LENGTH)
+
+    def reset(self, pos, color):
+        ''' Puts an undrawn block at pos with color, as a new Block(pos, color) '''
+        self.x = int(pos.x)
+        self.y = int(pos.y)
+        self.color = color
+        side = self.SIDE_LENGTH
+        self.p1.x, self.p1.y = pos.x*side, pos.y*side
+        self.p2.x, self.p2.y = pos.x*side + side, pos.y*side + side
+        self.config = Block.style(color)
 
 ############################################################
 # SHAPE CLASS
@@ -65,18 +134,45 @@ class Shape():
     ''' Shape class:
         Base class for all the tetris shapes
         Attributes: blocks - type: list - the list of blocks making up the shape
-                    rotation_dir - type: int - the current rotation direction of the shape
-                    shift_rotation_dir - type: Boolean - whether or not the shape rotates
+                    kind - type: string - the letter of the shape, which picks its wall kicks
+                    rotation - type: int - the rotation state, 0 at spawn, +1 per turn
+                    to the right, modulo 4
+
+        A shape that has landed can be released; acquire() then resets it
+        in place for a later spawn of the same class instead of making a new one
     '''
 
+    kind = None
+    free = {} # shape class -> released shapes of that class, at most MAX_FREE each
+    MAX_FREE = 64
+
     def __init__(self, coords=None, color='blue'):
         self.blocks = []
+        self.rotation = 0
         ### A boolean to indicate if a shape shifts rotation direction or not.
         ### Defaults to false since only 3 shapes shift rotation directions (I, S and Z)
         
         if(coords!=None): 
             for pos in coords:
-                self.blocks.append(Block(pos, color))
+                self.blocks.append(Block.acquire(pos, color))
+
+    @classmethod
+    def acquire(cls, center):
+        ''' Return value: a released shape of this class reset to center, or a new one '''
+        free = Shape.free.get(cls)
+        if not free: return cls(center)
+        shape = free.pop()
+        shape.__init__(center)
+        return shape
+
+    def release(self):
+        ''' Returns a shape that has landed to the pool. Its blocks stay on
+            the board, the shape lets go of them.
+        '''
+        self.blocks = []
+        self.center_block = None
+        free = Shape.free.setdefault(type(self), [])
+        if len(free) < self.MAX_FREE: free.append(self)
 
 
     def get_blocks(self):
@@ -95,6 +191,8 @@ class Shape():
     def deepcopy(self):
         ''' Returns a deep copy of self with new blocks and such '''
         new = Shape()
+        new.kind = self.kind
+        new.rotation = self.rotation
         for block in self.get_blocks():
             
             newBlock = Block(Point(block.x,block.y),block.color)
@@ -160,6 +258,7 @@ class Shape():
             # The results are then transformed back to the original grid.
 
             block.move( (sign*(y_diff) + c_x - block.x) , (-sign*(x_diff) + c_y - block.y))
+        self.rotation = (self.rotation + TURN[direction]) % 4
         
         
 
@@ -169,6 +268,8 @@ class Shape():
 
  
 class I_shape(Shape):
+    kind = 'I'
+
     def __init__(self, center):
         coords = [Point(center.x - 2, center.y),
                   Point(center.x - 1, center.y),
@@ -178,6 +279,8 @@ class I_shape(Shape):
         self.center_block = self.blocks[2]
 
 class J_shape(Shape):
+    kind = 'J'
+
     def __init__(self, center):
         coords = [Point(center.x - 1, center.y),
                   Point(center.x    , center.y),
@@ -190,6 +293,8 @@ class L_shape(Shape):
     '''
     A four-piece L 
     '''
+    kind = 'L'
+
     def __init__(self, center):
         coords = [Point(center.x - 1, center.y),
                   Point(center.x    , center.y),
@@ -203,6 +308,8 @@ class O_shape(Shape):
     '''
     A four-piece square
     '''
+    kind = 'O'
+
     def __init__(self, center):
         coords = [Point(center.x    , center.y),
                   Point(center.x - 1, center.y),
@@ -216,7 +323,8 @@ class O_shape(Shape):
         return 
 
 class S_shape(Shape):
- 
+   kind = 'S'
+
    def __init__(self, center):
         coords = [Point(center.x    , center.y),
                   Point(center.x    , center.y + 1),
@@ -227,6 +335,8 @@ class S_shape(Shape):
 
 
 class T_shape(Shape):
+    kind = 'T'
+
     def __init__(self, center):
         coords = [Point(center.x - 1, center.y),
                   Point(center.x    , center.y),
@@ -237,6 +347,8 @@ class T_shape(Shape):
 
 
 class Z_shape(Shape):
+    kind = 'Z'
+
     def __init__(self, center):
         coords = [Point(center.x - 1, center.y),
                   Point(center.x    , center.y), 
@@ -251,37 +363,71 @@ class Z_shape(Shape):
 # BOARD CLASS
 ############################################################
 
-class Board(GraphWin):
+class Board():
     ''' Board class: it represents the Tetris board
-        GraphWin is a sub-class of tk.Canvas, so Board is also a Canvas.
+        The board only keeps the game state; what it shows goes through
+        its render backend (see render.py).
 
         Attributes: width - type:int - width of the board in squares
                     height - type:int - height of the board in squares
-                    canvas - type:CanvasFrame - where the pieces will be drawn
-                    grid - type:Dictionary - keeps track of the current state of
-                    the board; stores the blocks for a given position
+                    backend - type:RenderBackend - where the pieces will be drawn
+                    grid - type:list - grid[x][y] is the Block at x, y or blank_block
+                    row_counts - type:list - the number of blocks in every row
+                    touched_rows - type:set - rows a block was put into since
+                    the last clean_rows, the only rows that can have become complete
+                    row_trackers - type:list - sets that collect every row that
+                    changes, see track_rows
+                    on_clear - type:list - functions called with the number of
+                    rows every time complete rows are removed
+                    stats - type:GameStats - score, lines, level and the other counters
+
+        Keeping the row counts up to date costs one addition per block that
+        is put in or taken out, so moving a piece costs the same on any board
+        size, and no row is ever scanned block by block.
     '''
 
     lock = threading.Lock()
+
+    GARBAGE_COLOR = 'dim gray' # rows sent by an opponent, see add_garbage
  
-    def __init__(self, title, width=200, height=200):
-        super().__init__(title, width, height)
-        # create a canvas to draw the tetris shapes on
-        super().setBackground('light gray')
-        #super().setCoords(0,0,width/Block.BLOCK_SIZE,height/Block.BLOCK_SIZE)
-        super().setCoords(0,0,Tetris.BOARD_WIDTH,Tetris.BOARD_HEIGHT)
+    def __init__(self, backend=None, width=None, height=None):
+        self.width = width or Tetris.BB_WIDTH
+        self.height = height or Tetris.BB_HEIGHT
+        # The size of the board in the coordinates of the Block rectangles
+        self.world_width = self.width*Block.SIDE_LENGTH
+        self.world_height = self.height*Block.SIDE_LENGTH
         # The grid is a two dimensional list which holds a Block at every location a Block can be.
         self.blank_block = Block(Point(0,0), 'blue')
-        self.grid = [[self.blank_block for y in range(Tetris.BB_HEIGHT)] for x in range(Tetris.BB_WIDTH)]
+        self.grid = [[self.blank_block]*self.height for x in range(self.width)]
+        self.row_counts = [0]*self.height
+        self.touched_rows = set()
+        self.row_trackers = []
+        self.on_clear = []
         self.game_over = False
         self.cant_move = False
+        self.stats = GameStats()
+
+        self.backend = backend if backend is not None else NullBackend()
+        self.backend.attach(self)
 
-        self.text_score = Text(Point(2,Tetris.BOARD_HEIGHT-1), "Score: 0")
-        self.text_score.draw(self)
+    @profiled('render.flush')
+    def flush_display(self):
+        ''' Lets the backend draw the changes since the last flush '''
+        self.backend.flush()
+
+    @property
+    def score(self):
+        return self.stats.score
 
     def add_score(self, val):
-        new_score = val + int(self.text_score.getText()[7:])
-        self.text_score.setText("Score: " + str(new_score))
+        ''' Adds to the score; the display shows it with the next refresh_stats '''
+        self.stats.add_score(val)
+
+    def refresh_stats(self):
+        ''' Shows the statistics if they changed, call it at most once per frame '''
+        if self.stats.changed:
+            self.stats.changed = False
+            self.backend.show_stats(self.stats)
 
 
     @synchronized    
@@ -293,49 +439,75 @@ class Board(GraphWin):
             if there is already a block at that postion, can't move there
             return False
 
-            otherwise return True
+            otherwise return True. The blocks of the shape are moved in
+            place, no copy of the shape is made.
         '''
         if(point==None): return
-        
-        moved_shape = self.active_shape.test_move(point)
-        
-        for block in moved_shape.get_blocks():
-            # Check if the translated block is valid, and either open or a part of the original shape
-            if not(self.valid_block(block)):
-                if(block.y>=Tetris.BB_HEIGHT): self.cant_move = True
-                return False    
-            if not(self.open_block(block)) and not(self.grid[block.x][block.y] in self.active_shape.get_blocks()):
+        blocks = self.active_shape.get_blocks()
+        dx, dy = int(point.x), int(point.y)
+        grid, blank = self.grid, self.blank_block
+        for block in blocks:
+            x, y = block.x + dx, block.y + dy
+            # The moved block must be on the board, and either open or a part of the original shape
+            if x < 0 or y < 0 or x >= self.width or y >= self.height:
+                if y >= self.height: self.cant_move = True
+                return False
+            if grid[x][y] is not blank and grid[x][y] not in blocks:
                 self.cant_move = True
                 return False
-        
-        self.remove_shape(self.active_shape)
-        #self.active_shape.move(point)
-        self._add_shape(moved_shape)
+
+        self._move_blocks(blocks, [(b.x + dx, b.y + dy) for b in blocks])
+        self.flush_display()
         
         return True
     @synchronized
     def rotate(self, direction):
         '''Parameters: direction string - 'Left' for CCW  or 'Right' for CW
-           Determines if the current shape can move in the given direction
+           Turns the current shape about its center block. If the turned
+           blocks do not fit, the wall kicks of kicks.py are tried in order
+           and the shape moves by the first one that fits. The blocks are
+           moved in place, no copy of the shape is made.
+           Return value: type: bool - whether the shape turned
         '''
         if self.cant_move == True: return False
-        rotated_shape = self.active_shape.test_rotate(direction)
-
-        for block in rotated_shape.get_blocks():
-            if(
-                not self.valid_block(block) or
-                not(self.open_block(block) or 
-                   self.grid[block.x][block.y] in self.active_shape.get_blocks())
-              ):
-                return False
-        self.remove_shape(self.active_shape) # Removes from grid
-        #self.active_shape.rotate(direction) #Transforms shape's internals
-        self._add_shape(rotated_shape) # Adds back transformed shape to the grid
-        return True      
+        shape = self.active_shape
+        blocks = shape.get_blocks()
+        sign = 1  if direction=='Right' else -1
+        c_x, c_y = shape.center_block.x, shape.center_block.y
+        turned = [(sign*(c_y - b.y) + c_x, -sign*(c_x - b.x) + c_y) for b in blocks]
+        grid, blank, width, height = self.grid, self.blank_block, self.width, self.height
+        for dx, dy in kicks(shape.kind, shape.rotation, direction):
+            for x, y in turned:
+                x += dx
+                y += dy
+                if x < 0 or y < 0 or x >= width or y >= height: break
+                if grid[x][y] is not blank and grid[x][y] not in blocks: break
+            else:
+                break
+        else:
+            return False
+        self._move_blocks(blocks, [(x + dx, y + dy) for x, y in turned])
+        shape.rotation = (shape.rotation + TURN[direction]) % 4
+        self.flush_display()
+        return True
+
+    def _move_blocks(self, blocks, targets):
+        ''' Parameters: blocks - type: list - blocks in the grid
+                        targets - type: list - the (x, y) each block moves to
+
+            moves blocks on the grid and tells the backend, without checking
+        '''
+        for block in blocks:
+            self.take_block(block)
+        for block, (x, y) in zip(blocks, targets):
+            old_x, old_y = block.x, block.y
+            block.move(x - old_x, y - old_y)
+            self.backend.moved_block(block, old_x, old_y)
+            self.put_block(block)
 
     def valid_block(self, block):
         #print("Testing valid: x: {}, y: {} ".format(block.x, block.y)) 
-        if(block.x<0 or block.y<0 or block.x>=Tetris.BB_WIDTH or block.y>=Tetris.BB_HEIGHT):
+        if(block.x<0 or block.y<0 or block.x>=self.width or block.y>=self.height):
             return False
         return True
 
@@ -346,6 +518,39 @@ class Board(GraphWin):
            return False
        return True
 
+    def put_block(self, block):
+        ''' Parameter: block - type: Block
+
+            puts block into the grid at its position, without drawing it
+        '''
+        self.grid[block.x][block.y] = block
+        self.row_counts[block.y] += 1
+        self.touched_rows.add(block.y)
+        for tracker in self.row_trackers:
+            tracker.add(block.y)
+
+    def take_block(self, block):
+        ''' Parameter: block - type: Block
+
+            takes block out of the grid, without undrawing it
+        '''
+        self.grid[block.x][block.y] = self.blank_block
+        self.row_counts[block.y] -= 1
+        for tracker in self.row_trackers:
+            tracker.add(block.y)
+
+    def track_rows(self):
+        ''' Return value: type: set - filled with the index of every row that
+            changes from now on; the caller empties it after reading it
+        '''
+        tracker = set()
+        self.row_trackers.append(tracker)
+        return tracker
+
+    def untrack_rows(self, tracker):
+        self.row_trackers.remove(tracker)
+
+    @profiled('Board.add_shape')
     def add_shape(self, shape):
         ''' Parameter: shape - type:Shape
             
@@ -359,19 +564,22 @@ class Board(GraphWin):
                raise RuntimeError("The block with coordinates x: {}, y: {} was out of bounds.".format(block.x, block.y)) 
            if not self.open_block(block):
                self.game_over = True 
+               self.flush_display()
                return False              # A shape could not be added so the game is over
   
-           self.grid[block.x][block.y] = block
+           self.put_block(block)
    
         self.active_shape = shape
-        shape.draw(self)
+        for block in shape.get_blocks():
+            self.backend.draw_block(block)
+        self.flush_display()
         return True       
 
     def _add_shape(self, shape):
         '''Does not check for validity'''
         for block in shape.get_blocks():
-            self.grid[block.x][block.y] = block
-            block.draw(self)
+            self.put_block(block)
+            self.backend.draw_block(block)
         self.active_shape = shape
         
 
@@ -379,27 +587,38 @@ class Board(GraphWin):
         ''' Removes the shape from the board's grid
         '''
         for block in self.active_shape.get_blocks():
-            self.grid[block.x][block.y] = self.blank_block
-            block.undraw()
+            self.take_block(block)
+            self.backend.undraw_block(block)
 
+    @profiled('Board.clean_rows')
     def clean_rows(self):
         ''' removes all the complete rows and shifts down after deletions
         '''
-        delete_ct = 0
-        row = Tetris.BB_HEIGHT-1 # Start cleaning from the bottom
-        while row>self.find_empty_row():
-            if self.row_is_complete(row): 
-                self.delete_row(row)
-                delete_ct += 1
-            else:  row -= 1
-        
-        if delete_ct>0: self.add_score(10*(delete_ct**3))
+        width, counts = self.width, self.row_counts
+        complete = sorted((y for y in self.touched_rows if counts[y] == width), reverse=True)
+        self.touched_rows.clear()
+        self.stats.landed(len(complete))
+        if not complete: return
+        self.backend.flash_rows(complete)
+        self.delete_complete_rows(complete)
+
+    @profiled('Board.line_clear', lambda self, complete: {'rows': len(complete)})
+    def delete_complete_rows(self, complete):
+        ''' Parameter: complete - type: list - the complete rows, bottom first
+            deletes the complete rows and moves the rest down
+        '''
+        self.delete_rows(complete)
+        self.add_score(10*(len(complete)**3))
+        for listener in self.on_clear:
+            listener(len(complete))
 
     def find_empty_row(self, num=1):
-        
+        ''' Return value: type: int - the num-th empty row counting up from
+            the bottom, -1 if there is none
+        '''
         if(num<=0): raise RuntimeError("Cannot find '{}'th empty row!".format(num))
-        for row in range(Tetris.BB_HEIGHT-1, -1, -1):
-            if self.row_is_empty(row):
+        for row in range(self.height-1, -1, -1):
+            if self.row_counts[row] == 0:
                 if(num==1): return row
                 else: num-=1
         return -1 # No empty rows!
@@ -409,66 +628,114 @@ class Board(GraphWin):
 
             remove all the blocks in row y
         '''
-         
-        for i in range(Tetris.BB_WIDTH):
-            self.grid[i][y].undraw()
-            self.grid[i][y] = self.blank_block
-        
-        self.move_down_rows(y-1)
- 
+        self.delete_rows([y])
+
+    def delete_rows(self, rows):
+        ''' Parameter: rows - type: list - row indexes, bottom first
+
+            removes the blocks in rows and moves every row above them down,
+            shifting the lists of the grid instead of moving rows one by one
+        '''
+        blank = self.blank_block
+        top = self.find_empty_row()
+        for column in self.grid:
+            for y in rows:
+                block = column[y]
+                if block is not blank:
+                    self.backend.undraw_block(block)
+                    Block.release(block)
+                del column[y]
+            column[0:0] = [blank]*len(rows)
+        for y in rows:
+            del self.row_counts[y]
+        self.row_counts[0:0] = [0]*len(rows)
+
+        # Every block above a deleted row drops by the number of deleted rows below it
+        lowest = rows[0]
+        for x, column in enumerate(self.grid):
+            for y in range(max(top, 0), lowest+1):
+                block = column[y]
+                if block is not blank and block.y != y:
+                    old_y = block.y
+                    block.move(0, y - old_y)
+                    self.backend.moved_block(block, x, old_y)
+        for tracker in self.row_trackers:
+            tracker.update(range(max(top, 0), lowest+1))
+
+    def add_garbage(self, lines, hole):
+        ''' Parameters: lines - type: int - rows to add
+                        hole - type: int - the column left open in each of them
+
+            pushes everything up by lines rows and fills the bottom with
+            GARBAGE_COLOR rows that have one hole, as sent by an opponent in
+            versus play. Blocks pushed off the top end the game.
+            Return value: type: bool - False if the board topped out
+        '''
+        if lines <= 0: return True
+        lines = min(lines, self.height)
+        blank = self.blank_block
+        topped_out = False
+        for x, column in enumerate(self.grid):
+            for block in column[:lines]:
+                if block is not blank:
+                    topped_out = True
+                    self.backend.undraw_block(block)
+            del column[:lines]
+            for y, block in enumerate(column):
+                if block is not blank:
+                    block.move(0, -lines)
+                    self.backend.moved_block(block, x, y+lines)
+            for y in range(self.height-lines, self.height):
+                if x == hole:
+                    column.append(blank)
+                else:
+                    block = Block.acquire(Point(x, y), self.GARBAGE_COLOR)
+                    column.append(block)
+                    self.backend.draw_block(block)
+        del self.row_counts[:lines]
+        self.row_counts.extend([self.width - (0 <= hole < self.width)]*lines)
+        self.touched_rows = {y-lines for y in self.touched_rows if y >= lines}
+        for tracker in self.row_trackers:
+            tracker.update(range(self.height))
+        if topped_out:
+            self.game_over = True
+            self.row_counts = [sum(1 for column in self.grid if column[y] is not blank)
+                               for y in range(self.height)]
+        self.flush_display()
+        return not topped_out
+
     def row_is_empty(self, y):
         '''Returns True if the row is empty'''
-        for col in range(Tetris.BB_WIDTH):
-            block = self.grid[col][y] 
-            if block != self.blank_block: 
-                return False
-        return True 
+        return self.row_counts[y] == 0
 
     def row_is_complete(self, y):        
         ''' Parameter: y - the row index - type: int
             Return value: type: bool
         '''
-       
-        for i in range(Tetris.BB_WIDTH):
-        #   print("x:",i,"y:",y)
-            if(self.grid[i][y]==self.blank_block):     
-                return False
-
-        return True
-
-    def move_down_rows(self, y_start):
-        ''' Parameters: y_start - type:int                        
-            Move down rows from y_start to the last non-empty row
-        '''
-        top = self.find_empty_row(2)
-        if y_start<=top: return # No rows to move
-
-        for row in range(y_start, top, -1):
-            self.move_down_row(row)
-   
-    def move_down_row(self, y):
-        '''Just moves down a given row''' 
-        if y>=Tetris.BB_HEIGHT-1: raise RuntimeError("Cannot move down the bottom row!")
-        for col in range(Tetris.BB_WIDTH):
-            block = self.grid[col][y]
-            self.grid[col][y] = self.blank_block
-            block.move(0,1) #down
-            self.grid[col][y+1] = block
+        return self.row_counts[y] == self.width
 
     def show_game_over(self):
         ''' Call when the game has ended
         '''
-        self.board.game_over = True
+        self.game_over = True
         
         #Display GAME OVER
-        text = Text(Point(Tetris.BOARD_WIDTH/2,Tetris.BOARD_HEIGHT/2), "Game over")
-        text.setFill('black')
-        text.setSize(36)
-        text.draw(self.board)
+        self.backend.dim()
+        self.backend.show_game_over()
+        self.flush_display()
 
+    def set_theme(self, theme):
+        ''' Parameter: theme - type: dictionary - the fill color to use for each
+            shape color; colors missing from theme keep their own color
+
+            Recolors every block, with one style change per color
+        '''
+        fills = {}
+        for color in list(Block.styles) + list(theme):
+            fills[color] = Block.style(color)['fill'] = theme.get(color, color)
+        self.backend.set_theme(fills)
+        self.flush_display()
 
-    
-             
 
 ############################################################
 # TETRIS CLASS
@@ -479,63 +746,143 @@ class Tetris():
         Attributes:
             SHAPES - type: list (list of Shape classes)
             DIRECTION - type: dictionary - converts string direction to (dx, dy)
-            BOARD_WIDTH - type:int - the width of the board
-            BOARD_HEIGHT - type:int - the height of the board
+            BOARD_WIDTH - type:int - the default width of the board
+            BOARD_HEIGHT - type:int - the default height of the board
             board - type:Board - the tetris board
-            delay - type:int - the speed in milliseconds for moving the shapes
+            render_mode - type:string - how the board is drawn, one of render.BACKENDS
+            width, height - type:int - the board size in blocks, BB_WIDTH x BB_HEIGHT if None
+            backend - type:RenderBackend - draws the board instead of a new render_mode backend
+            seed - the seed of the shape sequence, None for a random one
+            history - type: list - actions applied so far when recording, else None
+            THEMES - type: dictionary - named color themes, see Board.set_theme
+            delay - type:int - the milliseconds a shape takes to fall one row at level 1
+            level - type:int - the level the game starts at, see gravity.py
+            gravity - type:Gravity - turns the time since the last fall() into rows
             current_shape - type: Shape - the current moving shape on the board
     '''
    
  
     SHAPES = [I_shape, J_shape, L_shape, O_shape, S_shape, T_shape, Z_shape]
+    THEMES = {'classic': {},
+              'pastel': {'blue': '#a0c4ff', 'orange': '#ffd6a5', 'cyan': '#9bf6ff', 'red': '#ffadad',
+                         'green': '#caffbf', 'yellow': '#fdffb6', 'magenta': '#ffc6ff'},
+              'mono': {'blue': 'gray20', 'orange': 'gray30', 'cyan': 'gray40', 'red': 'gray50',
+                       'green': 'gray60', 'yellow': 'gray70', 'magenta': 'gray80'}}
     DIRECTION = {'Left': Point(-1, 0), 'Right': Point(1, 0), 'Down': Point(0,1)}
-    # The true coordinates
+    # The true coordinates of the default board, a game can pick its own size
     BOARD_WIDTH = 20 
     BOARD_HEIGHT = 40
-    # Used for Block calculations
+    # The default board size in blocks
     BB_WIDTH =  BOARD_WIDTH//Block.SIDE_LENGTH 
     BB_HEIGHT = BOARD_HEIGHT//Block.SIDE_LENGTH 
     
-    def __init__(self, title, delay=800):
+    def __init__(self, title, delay=800, render_mode='canvas', seed=None, record=False,
+                 width=None, height=None, backend=None, level=1):
         self.queue = Queue(3000)
-        self.board = Board(title, Block.BLOCK_SIZE*self.BOARD_WIDTH, Block.BLOCK_SIZE*self.BOARD_HEIGHT)
+        self.seed = seed
+        self.rng = random.Random(seed) # picks the shapes, so a seed fixes the piece sequence
+        # Every applied action and 'Spawn' in order, see replay()
+        self.history = [] if record else None
+        if backend is None:
+            if render_mode not in BACKENDS:
+                raise ValueError("Unknown render mode '{}'".format(render_mode))
+            backend = BACKENDS[render_mode](title)
+        self.board = Board(backend, width, height)
+        self.board.stats = GameStats(level)
         self.delay = delay #ms
+        self.gravity = Gravity(delay)
+        self.landed_at = None # when fall() first saw the shape landed
+        self.theme = 'classic'
+        self.closers = [] # functions called by close(), e.g. to finish a recording
+        self.overlay = None # a PerfOverlay once it has been switched on
+        self.diagnostics = None # a Diagnostics sampled after every update, see --diagnostics
+        self.publisher = None # a spectate.Publisher ticked after every update, see --spectate
+        self.runner = None # the aio.AsyncGame running the game, which quit() stops instead
+        self.on_spawn = [] # functions called with the game whenever a new shape appears
+        self.on_land = [] # functions called with the game between a shape landing and the next one
+        self.current_shape = None
         # set the current shape to a random new shape
         if not self.create_new_shape(): raise RuntimeError("The initial shape could not be created.")
         
         # Bind key-presses
-        self.board.bind_all('<Key>', self.key_eval)
+        self.board.backend.bind_keys(self.key_eval)
           
 
+    @profiled('Tetris.animate')
     def animate(self):
        
         #print("auto_move")
         if self.board.cant_move:
-            self.board.cant_move = False
-            self.create_new_shape()
-            
-            if(self.board.game_over):
-                self.board.show_game_over()
+            self.spawn()
         else:
            #pass
            self.queue.put_nowait('Down')
 
+    @profiled('Tetris.fall')
+    def fall(self, now=None):
+        ''' Applies gravity for the time since the last call: queues a 'Down'
+            for every row that is due, or 'All Down' at the instant levels,
+            and replaces a landed shape once its lock delay has passed.
+            Call it every frame, the rate does not depend on how often.
+            Return value: type: float - seconds until something is due
+        '''
+        board, gravity = self.board, self.gravity
+        if board.game_over: return None
+        now = gravity.clock() if now is None else now
+        level = board.stats.level
+        if board.cant_move:
+            if self.landed_at is None: self.landed_at = now
+            wait = self.landed_at + gravity.lock_delay(level) - now
+            if wait > 0: return wait
+            self.landed_at = None
+            self.spawn(now)
+            if board.game_over: return None
+        rows = gravity.rows_due(level, board.height, now)
+        if gravity.seconds_per_row(level) == 0.0:
+            if rows: self.queue.put_nowait('All Down')
+            return gravity.lock_delay(level)
+        for i in range(rows):
+            self.queue.put_nowait('Down')
+        return gravity.until_next_row(level)
+
+    @profiled('Tetris.spawn')
+    def spawn(self, now=None):
+        ''' Replaces the shape that can no longer move with a new one
+            Parameter: now - type: float - the gravity clock's time, read if None
+        '''
+        for listener in self.on_land:
+            listener(self)
+        self.board.cant_move = False
+        if self.history is not None: self.history.append('Spawn')
+        self.create_new_shape(now)
+        
+        if(self.board.game_over):
+            self.board.show_game_over()
+
  
-    def create_new_shape(self):
+    def create_new_shape(self, now=None):
         ''' Return value: type: Shape
             Create a random new shape that is centered
-             at y = 0 and x = int(self.BOARD_WIDTH/2)
+             at y = 0 and the middle of the board
             set the current_shape with this shape
+            and restart gravity for it, from now
         '''
-        shape = Tetris.SHAPES[random.randrange(0,len(Tetris.SHAPES))]
-        center = Point(self.BB_WIDTH//2,0)
-        self.current_shape = shape(center) # Creates new instance of whichever shape, passing in the center
+        shape = Tetris.SHAPES[self.rng.randrange(0,len(Tetris.SHAPES))]
+        center = Point(self.board.width//2,0)
+        landed = self.current_shape
+        self.current_shape = shape.acquire(center) # A released instance of whichever shape, or a new one
 
         if not self.board.add_shape(self.current_shape): return False
+        if landed is not None: landed.release() # its blocks are part of the stack now
+        self.gravity.restart(now) # whoever spawns it, the new shape starts its own fall
+        self.board.stats.piece()
+        for listener in self.on_spawn:
+            listener(self)
         return True
 
-    def key_eval(self, evnt):
-        '''
+    def key_eval(self, key):
+        ''' Parameter: key - type: string - the Tk keysym of the pressed key
+
             if the user presses the space bar 'space', the shape will move
             down until it can no longer move and is added to the board
 
@@ -543,58 +890,282 @@ class Tetris():
                 the shape should rotate ['Left','Right'].
 
         '''
-        key = evnt.keysym   # self.board.checkKey()    
-      
-        if(self.board.game_over or key=='e' or key=='c'): os._exit(0)
+        if(self.board.game_over or key=='e' or key=='c'): self.quit()
 
         if(key==""): return # If there was no key pressed, do nothing
         elif(key=='Control_R'):
-            self.queue.put_nowait('Rotate Left')
+            self.input('Rotate Left')
         elif key=='KP_0':
-            self.queue.put_nowait('Rotate Right')
+            self.input('Rotate Right')
         elif key=='space':
-            self.queue.put_nowait('All Down')
+            self.input('All Down')
+        elif key=='t':
+            self.input('Next Theme')
+        elif key=='p':
+            profiler.toggle()
+        elif key=='F3':
+            self.toggle_overlay()
         elif len(key)>1:
-            self.queue.put_nowait(key)
+            self.input(key)
              
       #  print(key)
 
+    def next_theme(self):
+        ''' Switches the board to the next theme in THEMES '''
+        names = list(self.THEMES)
+        self.theme = names[(names.index(self.theme)+1) % len(names)]
+        self.board.set_theme(self.THEMES[self.theme])
+
+    def close(self):
+        ''' Runs the registered closers and closes the display. A closer
+            that fails does not stop the others; the first failure is
+            raised once they have all run.
+        '''
+        failures = []
+        while self.closers:
+            try:
+                self.closers.pop()()
+            except Exception as e:
+                failures.append(e)
+        self.board.backend.close()
+        if failures: raise failures[0]
+
+    def quit(self):
+        ''' Closes the game and ends the process, with status 1 if a closer failed.
+            A game run by an AsyncGame only stops it: ending the process
+            here would skip what its tasks still have to finish.
+        '''
+        if self.runner is not None:
+            self.runner.stop()
+            return
+        try:
+            self.close()
+        except Exception as e:
+            print("error: {}".format(e), file=sys.stderr)
+            os._exit(1)
+        os._exit(0)
+
+    def input(self, item):
+        ''' Queues an action from the player, with the time it was queued
+            so the overlay can show how long it waited
+        '''
+        self.queue.put_nowait((item, time.perf_counter()))
+
+    def toggle_overlay(self):
+        ''' Shows or hides the performance overlay '''
+        if self.overlay is None: self.overlay = PerfOverlay(self)
+        self.overlay.toggle()
+
+    def end_frame(self, start):
+        ''' Parameter: start - type: float - time.perf_counter when the frame began
+            Counts a frame for the overlay; whatever drives the display calls
+            it once per frame, however many updates the frame took
+        '''
+        if self.overlay: self.overlay.frame(start, time.perf_counter())
+
+    @profiled('Tetris.update')
     def update(self):
         ''' Processes updates from self.queue '''
         while not self.queue.empty():
-            if self.board.isClosed(): os._exit(0) 
-            item = self.queue.get_nowait()
-            if item == None: continue
-            elif item=='Rotate Right':
-                self.board.rotate('Right')
-            elif item=='Rotate Left':
-                self.board.rotate('Left')
-            elif item=='All Down':
-                while not self.board.cant_move:
-                    self.board.move_on_board()
-            else:
-                direction = self.DIRECTION.get(item, None)
-                if(direction != None): self.board.move_on_board(direction)
+            if self.board.backend.is_closed(): self.quit()
+            self.handle(self.queue.get_nowait())
+        self.board.refresh_stats()
+        if self.diagnostics: self.diagnostics.tick()
+        if self.publisher: self.publisher.tick()
+
+    def handle(self, item):
+        ''' Parameter: item - an action string, or (action, time queued) from input()
+            Applies one item taken from self.queue
+        '''
+        if item == None: return
+        if type(item) is tuple: # (action, time queued) from input()
+            item, queued = item
+            self.board.stats.action()
+            if self.overlay: self.overlay.input_applied(queued, time.perf_counter())
+        self.apply(item)
+
+    @profiled('Tetris.apply', lambda self, item: {'action': item})
+    def apply(self, item):
+        ''' Parameter: item - type: string - an action from self.queue
+            Applies one action to the board
+        '''
+        if self.history is not None: self.history.append(item)
+        if item=='Rotate Right':
+            self.board.rotate('Right')
+        elif item=='Rotate Left':
+            self.board.rotate('Left')
+        elif item=='All Down':
+            while not self.board.cant_move:
+                self.board.move_on_board()
+        elif item=='Next Theme':
+            self.next_theme()
+        else:
+            direction = self.DIRECTION.get(item, None)
+            if(direction != None): self.board.move_on_board(direction)
+
+    def replay(self, history):
+        ''' Parameter: history - type: list - the history of a game started
+            with the same seed
+
+            Plays the recorded actions again, ending in the same state
+        '''
+        for item in history:
+            if self.board.game_over: return
+            if item == 'Spawn': self.spawn()
+            else: self.apply(item)
 
     
 ################################################################
 # Start the game
 ################################################################
 
-game = Tetris("Tetris")
+game = None
 
-def auto_move():
-    ''' Moves the current_shape every self.delay ms
-    '''
-    if not(game.board.game_over):
-        game.animate() 
-        game.board.getRoot().after(game.delay, auto_move)
+VERSION = '1.1' # stored with every finished game, see scores.py
+FRAME_MS = 16 # how often auto_tick runs; gravity keeps its rate whatever this is
 
-def auto_update():
+def auto_tick():
+    ''' Applies gravity and the queued input once per frame '''
     if not(game.board.game_over):
-       game.update()
-       game.board.getRoot().after(100, auto_update)
+        start = time.perf_counter()
+        game.fall()
+        game.update()
+        game.end_frame(start)
+        game.board.backend.after(FRAME_MS, auto_tick)
 
-game.board.getRoot().after(0, auto_move)
-game.board.getRoot().after(0, auto_update)
-game.board.getRoot().mainloop()
+def auto_capture(capture):
+    if not(game.board.game_over):
+        capture.tick()
+        game.board.backend.after(max(1, int(500/capture.fps)), auto_capture, capture)
+
+def main():
+    global game
+    parser = argparse.ArgumentParser(description="A simple Tetris with Python Tkinter")
+    parser.add_argument('--render', choices=sorted(BACKENDS), default='canvas',
+                        help="canvas: a canvas item per block, raster: the board as one image, "
+                             "ansi: a terminal, null: nothing")
+    parser.add_argument('--report-startup', action='store_true',
+                        help="print the time from import to the first drawn frame")
+    parser.add_argument('--record', metavar='TARGET',
+                        help="record frames to an image sequence such as 'frames/%%06d.png', "
+                             "or '|command' to pipe raw RGB into an encoder")
+    parser.add_argument('--record-fps', type=float, default=30)
+    parser.add_argument('--profile', action='store_true',
+                        help="time the phases of every tick and print them on exit, p toggles")
+    parser.add_argument('--profile-json', metavar='FILE', help="also write the timings to FILE")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace_event timeline (chrome://tracing, Perfetto) to FILE")
+    parser.add_argument('--overlay', action='store_true',
+                        help="show FPS, frame time, queue depth, input latency and canvas items, F3 toggles")
+    parser.add_argument('--diagnostics', action='store_true',
+                        help="count live and allocated graphics objects and canvas items every tick, "
+                             "print the rates on exit")
+    parser.add_argument('--size', metavar='COLSxROWS', default='{}x{}'.format(Tetris.BB_WIDTH, Tetris.BB_HEIGHT),
+                        help="the board size in blocks, e.g. 200x1000 for a stress board")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="run on an asyncio event loop instead of Tk's mainloop (see aio.py)")
+    parser.add_argument('--agent', action='store_true', help="let the greedy bot play")
+    parser.add_argument('--history', metavar='FILE',
+                        help="write the seed and every action to FILE, see aio.read_history")
+    parser.add_argument('--telemetry', metavar='FILE',
+                        help="with --async, append a line of game statistics to FILE every second")
+    parser.add_argument('--spectate', metavar='ADDRESS',
+                        help="stream the board to viewers at unix:PATH or pipe:PATH, see spectate.py")
+    parser.add_argument('--level', type=int, default=1,
+                        help="the level to start at, gravity gets faster every 10 lines "
+                             "and is instant from level {}".format(Gravity.INSTANT_LEVEL))
+    parser.add_argument('--seed', type=int, help="seed of the shape sequence")
+    parser.add_argument('--scores', metavar='DIR', default=DEFAULT_DIR,
+                        help="keep finished games and high scores in DIR, see scores.py")
+    parser.add_argument('--no-scores', action='store_true', help="do not load or save high scores")
+    parser.add_argument('--theme', choices=Tetris.THEMES, default='classic',
+                        help="block colors, press t to switch while playing")
+    args = parser.parse_args()
+
+    try:
+        width, height = map(int, args.size.split('x'))
+    except ValueError:
+        parser.error("--size must look like 10x20")
+    if width < 4 or height < 4:
+        parser.error("the board must be at least 4x4")
+    if args.telemetry and not args.use_async:
+        parser.error("--telemetry needs --async")
+    if args.level < 1:
+        parser.error("--level starts at 1")
+
+    imported = time.perf_counter()
+    game = Tetris("Tetris", render_mode=args.render, width=width, height=height,
+                  seed=args.seed, record=bool(args.history), level=args.level)
+    if args.theme != game.theme:
+        game.theme = args.theme
+        game.board.set_theme(Tetris.THEMES[args.theme])
+    if args.report_startup:
+        game.board.backend.flush()
+        now = time.perf_counter()
+        print("Startup: imports {:.1f} ms, window and first frame {:.1f} ms, total {:.1f} ms".format(
+              1000*(imported-_START_TIME), 1000*(now-imported), 1000*(now-_START_TIME)),
+              file=sys.stderr)
+    if args.trace:
+        profiler.trace(Tracer(args.trace))
+        game.closers.append(profiler.stop_trace)
+    if args.overlay:
+        game.toggle_overlay()
+    if args.diagnostics:
+        game.diagnostics = Diagnostics(game.board.backend)
+        game.diagnostics.enable()
+        def report_diagnostics():
+            game.diagnostics.disable()
+            print(game.diagnostics.format(), file=sys.stderr)
+        game.closers.append(report_diagnostics)
+    if args.spectate:
+        game.publisher = Publisher(game.board, args.spectate)
+        def stop_publishing():
+            game.publisher.close()
+            print(game.publisher.report(), file=sys.stderr)
+        game.closers.append(stop_publishing)
+    if args.profile or args.profile_json:
+        profiler.enable()
+        def report_profile():
+            print(profiler.format(), file=sys.stderr)
+            if args.profile_json: profiler.save(args.profile_json)
+        game.closers.append(report_profile)
+    if args.record:
+        capture = FrameCapture(game.board, FrameCapture.sink_for(args.record), args.record_fps)
+        def finish_recording():
+            capture.close()
+            print(capture.report(), file=sys.stderr)
+            if capture.captured and not capture.written:
+                raise RuntimeError("no frame of the recording could be written to {}".format(args.record))
+        game.closers.append(finish_recording)
+        game.board.backend.after(0, auto_capture, capture)
+    agent = GreedyAgent() if args.agent else None
+    if not args.no_scores:
+        store = ScoreStore(args.scores)
+        best = store.top(10)
+        if best and args.render != 'ansi': # the terminal is the board
+            print("High scores\n" + format_top(best), file=sys.stderr)
+        def save_score():
+            if game.board.game_over:
+                number = store.add_game(game, 'greedy' if agent else 'human', VERSION)
+                if args.render != 'ansi': # it would land on the board
+                    print(format_top(store.top(10), highlight=number), file=sys.stderr)
+            store.close()
+        game.closers.append(save_score)
+    if args.use_async:
+        runner = AsyncGame(game, agent=agent, history=args.history, telemetry=args.telemetry)
+        asyncio.run(runner.run())
+        game.close()
+        return
+    if agent:
+        def play(game):
+            for action in agent.plan(game.board): game.input(action)
+        game.on_spawn.append(play)
+        play(game)
+    if args.history:
+        game.closers.append(HistoryWriter(game, args.history).close)
+    game.board.backend.after(0, auto_tick)
+    game.board.backend.mainloop()
+    game.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+# tuner.py
+"""Tunes the weights of GreedyAgent by self-play on a pool of processes.
+
+The tuner is the noisy cross-entropy method: every generation samples a
+population of weight vectors from a normal distribution per feature,
+plays each one on the same seeded games, and moves the distribution to
+the mean and spread of the best (elite) candidates. Extra noise, which
+fades over the generations, keeps the spread from collapsing too early.
+
+The games are played on bit mask boards with the agent's own placement
+search (agent.py), one shape after another as Tetris(seed=SEED) deals
+them, until the stack tops out or a piece limit is reached. A candidate's
+fitness is the mean number of rows it clears.
+
+Nothing large goes through the pool's pipes. The seeds, the shape
+sequences, the candidates' weights and the results live in blocks of
+multiprocessing.shared_memory that the workers attach to once; a task is
+just the number of a (candidate, game) pair, and a worker writes its
+result into the shared results. After every generation the state (the
+distribution, the best candidate so far and the history) is written to
+a checkpoint, replaced atomically, and --resume carries on from it.
+
+Usage: python tuner.py [--generations 10] [--population 16] [--games 8]
+                       [--pieces 300] [--elite 0.25] [--seed 0] [--size 10x20]
+                       [--processes N] [--checkpoint tuner.json] [--resume]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+from multiprocessing import shared_memory
+
+from agent import GreedyAgent, fits, land, placements
+from features import FEATURES, BoardFeatures
+from perft import shape_sequence, spawn
+from tetris import Tetris
+
+
+DEFAULT_CHECKPOINT = 'tuner.json'
+CHECKPOINT_VERSION = 1
+NAMES = FEATURES # the weights tuned, one per feature
+
+
+############################################################
+# SHARED ARRAYS
+############################################################
+
+class SharedArray():
+    ''' SharedArray class:
+        A flat array in a block of shared memory, made by the tuner and
+        attached to by name in the workers
+        Attributes: shm - type: SharedMemory
+                    array - type: memoryview - the block cast to typecode
+    '''
+
+    def __init__(self, typecode, length=None, name=None):
+        ''' Makes a new block for length items, or attaches to the block name '''
+        if name is None:
+            size = max(1, length*memoryview(bytes(8)).cast(typecode).itemsize)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.typecode = typecode
+        self.array = self.shm.buf.cast(typecode)
+        if length is not None: self.array = self.array[:length]
+
+    def spec(self):
+        ''' Return value: type: tuple - what a worker needs to attach '''
+        return self.typecode, len(self.array), self.shm.name
+
+    @classmethod
+    def attach(cls, spec):
+        typecode, length, name = spec
+        return cls(typecode, length, name)
+
+    def close(self, unlink=False):
+        self.array.release() # the block cannot close while a view is out
+        self.shm.close()
+        if unlink: self.shm.unlink()
+
+
+############################################################
+# GAMES
+############################################################
+
+def play(weights, shapes, width, height):
+    ''' Plays shapes in order with the agent's placement search
+        Parameters: weights - type: dictionary - feature name -> weight
+                    shapes - indices into Tetris.SHAPES
+        Return value: type: tuple - (rows cleared, shapes placed)
+    '''
+    agent = GreedyAgent(weights)
+    names = agent.weights
+    rows = [0]*height
+    lines = 0
+    spawns = [spawn(shape, width) for shape in range(len(Tetris.SHAPES))]
+    for placed, shape in enumerate(shapes):
+        cells, center, kind = spawns[shape]
+        if not fits(rows, width, cells): return lines, placed # topped out
+        after = BoardFeatures(rows, width, names).after
+        best, best_score = None, None
+        for actions, landed in placements(rows, width, cells, center, kind):
+            score = agent.score(after(landed))
+            if best_score is None or score > best_score:
+                best, best_score = landed, score
+        if best is None: return lines, placed
+        rows, cleared = land(rows, width, best)
+        lines += cleared
+    return lines, len(shapes)
+
+_shared = {} # a worker's attached arrays, by name
+
+def _attach(specs, settings):
+    for name, spec in specs.items():
+        _shared[name] = SharedArray.attach(spec)
+    _shared['settings'] = settings
+
+def _play_task(task):
+    ''' Plays game task % games with candidate task // games, into the results '''
+    width, height, games, pieces = _shared['settings']
+    candidate, game = divmod(task, games)
+    weights = _shared['weights'].array
+    values = dict(zip(NAMES, weights[candidate*len(NAMES):(candidate+1)*len(NAMES)]))
+    shapes = _shared['shapes'].array[game*pieces:(game+1)*pieces]
+    lines, placed = play(values, shapes, width, height)
+    _shared['lines'].array[task] = lines
+    _shared['placed'].array[task] = placed
+    return task
+
+
+############################################################
+# TUNER
+############################################################
+
+class Tuner():
+    ''' Tuner class:
+        Attributes: settings - type: dictionary - population, games, pieces,
+                    elite, seed, width and height; kept in the checkpoint,
+                    a resumed run goes on with them
+                    mean, std - type: list - the distribution, per name in NAMES
+                    generation - type: int - generations done
+                    best - type: dictionary - 'weights' and 'lines' of the
+                    best candidate so far, or None
+                    history - type: list - a summary per generation
+    '''
+
+    INITIAL_STD = 0.5
+    NOISE = 0.1 # added to the variance, less every generation
+    NOISE_DECAY = 0.8
+
+    def __init__(self, population=16, games=8, pieces=300, elite=0.25, seed=0,
+                 width=Tetris.BB_WIDTH, height=Tetris.BB_HEIGHT):
+        if population < 2: raise ValueError("population must be at least 2")
+        self.settings = {'population': population, 'games': games, 'pieces': pieces,
+                         'elite': elite, 'seed': seed, 'width': width, 'height': height}
+        self.mean = [GreedyAgent.WEIGHTS.get(name, 0.0) for name in NAMES]
+        self.std = [self.INITIAL_STD]*len(NAMES)
+        self.generation = 0
+        self.best = None
+        self.history = []
+
+    ############################################################
+    # CHECKPOINTS
+
+    def state(self):
+        return {'version': CHECKPOINT_VERSION, 'names': list(NAMES), 'settings': self.settings,
+                'generation': self.generation, 'mean': self.mean, 'std': self.std,
+                'best': self.best, 'history': self.history}
+
+    def save(self, path):
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self.state(), f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path) # a crash leaves the old checkpoint or the new one
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') != CHECKPOINT_VERSION or state.get('names') != list(NAMES):
+            raise ValueError("{} is not a checkpoint of this tuner".format(path))
+        tuner = cls(**state['settings'])
+        tuner.generation = state['generation']
+        tuner.mean, tuner.std = state['mean'], state['std']
+        tuner.best, tuner.history = state['best'], state['history']
+        return tuner
+
+    ############################################################
+    # GENERATIONS
+
+    def sample(self):
+        ''' Return value: type: list - the weight vectors of the next
+            generation, the same ones whenever it is resumed
+        '''
+        rng = random.Random('{} {}'.format(self.settings['seed'], self.generation))
+        return [[rng.gauss(m, s) for m, s in zip(self.mean, self.std)]
+                for i in range(self.settings['population'])]
+
+    def update(self, candidates, fitness):
+        ''' Moves the distribution to the elite of candidates
+            Parameter: fitness - type: list - the mean rows cleared per candidate
+        '''
+        ranked = sorted(range(len(candidates)), key=lambda i: fitness[i], reverse=True)
+        count = max(2, round(self.settings['elite']*len(candidates)))
+        elite = [candidates[i] for i in ranked[:count]]
+        noise = self.NOISE*self.NOISE_DECAY**self.generation
+        self.mean = [statistics.fmean(values) for values in zip(*elite)]
+        self.std = [(statistics.pvariance(values) + noise)**0.5 for values in zip(*elite)]
+        top = ranked[0]
+        if self.best is None or fitness[top] > self.best['lines']:
+            self.best = {'weights': dict(zip(NAMES, candidates[top])), 'lines': fitness[top],
+                         'generation': self.generation}
+        self.history.append({'generation': self.generation, 'best': fitness[top],
+                             'elite': statistics.fmean(fitness[i] for i in ranked[:count]),
+                             'mean': statistics.fmean(fitness)})
+        self.generation += 1
+
+    def run(self, generations, processes=1, checkpoint=None, log=sys.stderr):
+        ''' Runs generations until self.generation reaches generations '''
+        settings = self.settings
+        population, games, pieces = settings['population'], settings['games'], settings['pieces']
+        tasks = population*games
+        shared = {'seeds': SharedArray('q', games),
+                  'shapes': SharedArray('B', games*pieces),
+                  'weights': SharedArray('d', population*len(NAMES)),
+                  'lines': SharedArray('q', tasks),
+                  'placed': SharedArray('q', tasks)}
+        pool = None
+        try:
+            seeds, shapes = shared['seeds'].array, shared['shapes'].array
+            for game in range(games):
+                seeds[game] = settings['seed'] + game
+                shapes[game*pieces:(game+1)*pieces] = bytes(shape_sequence(pieces, seeds[game]))
+            specs = {name: array.spec() for name, array in shared.items()}
+            dimensions = (settings['width'], settings['height'], games, pieces)
+            if processes > 1:
+                pool = multiprocessing.Pool(processes, _attach, (specs, dimensions))
+            else:
+                _attach(specs, dimensions)
+
+            while self.generation < generations:
+                start = time.perf_counter()
+                candidates = self.sample()
+                weights = shared['weights'].array
+                for i, value in enumerate(value for candidate in candidates for value in candidate):
+                    weights[i] = value
+                if pool:
+                    for task in pool.imap_unordered(_play_task, range(tasks), chunksize=1): pass
+                else:
+                    for task in range(tasks): _play_task(task)
+                lines, placed = shared['lines'].array, shared['placed'].array
+                fitness = [sum(lines[i*games:(i+1)*games])/games for i in range(population)]
+                pieces_played = sum(placed)
+                self.update(candidates, fitness)
+                if checkpoint: self.save(checkpoint)
+                elapsed = time.perf_counter() - start
+                summary = self.history[-1]
+                print("generation {}: best {:.1f}, elite {:.1f}, mean {:.1f} rows; "
+                      "{} pieces in {:.1f} s ({:.0f}/s)".format(summary['generation']+1,
+                      summary['best'], summary['elite'], summary['mean'], pieces_played,
+                      elapsed, pieces_played/elapsed if elapsed else 0), file=log)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            for name in shared:
+                attached = _shared.pop(name, None)
+                if attached is not None and attached is not shared[name]: attached.close()
+                shared[name].close(unlink=True)
+            _shared.pop('settings', None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the greedy agent's weights by self-play")
+    parser.add_argument('--generations', type=int, default=10, help="stop after this many in all")
+    parser.add_argument('--population', type=int, default=16, help="candidates per generation")
+    parser.add_argument('--games', type=int, default=8, help="seeded games per candidate")
+    parser.add_argument('--pieces', type=int, default=300, help="shapes per game at most")
+    parser.add_argument('--elite', type=float, default=0.25, help="the part of the candidates kept")
+    parser.add_argument('--seed', type=int, default=0, help="the games use seeds SEED, SEED+1, ...")
+    parser.add_argument('--size', metavar='COLSxROWS', default='{}x{}'.format(Tetris.BB_WIDTH, Tetris.BB_HEIGHT))
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="written after every generation")
+    parser.add_argument('--resume', action='store_true', help="carry on from the checkpoint")
+    args = parser.parse_args()
+
+    try:
+        width, height = map(int, args.size.split('x'))
+    except ValueError:
+        parser.error("--size must look like 10x20")
+    if args.resume:
+        try:
+            tuner = Tuner.load(args.checkpoint)
+        except (OSError, ValueError) as e:
+            parser.error("cannot resume: {}".format(e))
+        print("resuming {} after generation {}".format(args.checkpoint, tuner.generation), file=sys.stderr)
+    else:
+        tuner = Tuner(args.population, args.games, args.pieces, args.elite, args.seed, width, height)
+    try:
+        tuner.run(args.generations, args.processes, args.checkpoint)
+    except KeyboardInterrupt:
+        print("stopped, {} has generation {}".format(args.checkpoint, tuner.generation), file=sys.stderr)
+    if tuner.best:
+        print(json.dumps(tuner.best['weights'], indent=1))
+        print("best: {:.1f} rows per game, generation {}".format(
+              tuner.best['lines'], tuner.best['generation']+1), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+# versus.py
+"""Two player versus over a local socket.
+
+Each side runs its own game (see aio.AsyncGame) and streams its board to
+the other in the compact format of wire.py: a KEYFRAME once, then only
+the rows that changed and the moves of the falling piece, checked 120
+times a second. Clearing 2, 3 or 4 rows at once sends 1, 2 or 4 garbage
+rows to the opponent, which rise from the bottom of their board when
+their current shape lands; rows cleared while garbage is pending cancel
+it first. The opponent's board is shown in a small view next to your own.
+
+Addresses are tcp:HOST:PORT or unix:PATH. With --loopback the opponent
+is a bot playing in the same process over a real local connection,
+which is enough to test a match alone.
+
+Usage: python versus.py --listen tcp:127.0.0.1:7000 [--render canvas|ansi|null] [--agent]
+       python versus.py --connect tcp:127.0.0.1:7000
+       python versus.py --loopback [--render null --agent]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+import wire
+from agent import GreedyAgent
+from aio import AsyncGame
+from graphics import GraphWin, Image, Point
+from profiling import Histogram
+from render import AnsiBackend, CanvasBackend
+from tetris import Tetris
+
+
+############################################################
+# OPPONENT VIEWS
+############################################################
+
+class MirrorView():
+    ''' MirrorView class:
+        Shows a MirrorBoard; the base class shows nothing
+        Attributes: mirror - type: MirrorBoard - the board shown
+    '''
+
+    def __init__(self, mirror):
+        self.mirror = mirror
+
+    def draw(self):
+        ''' Redraws the rows that changed since the last draw '''
+        self.mirror.dirty.clear()
+
+    def close(self):
+        pass
+
+class AnsiMirrorView(MirrorView):
+    ''' AnsiMirrorView class:
+        Draws a mirrored board at one character per cell on a terminal,
+        e.g. to the right of the AnsiBackend board of the local game
+        Attributes: stream - the file the board is written to
+                    column - type: int - the terminal column of its left edge
+    '''
+
+    def __init__(self, mirror, stream, column=1, title="Opponent"):
+        super().__init__(mirror)
+        self.stream = stream
+        self.column = column
+        self.title = title
+        self.status = None
+
+    def draw(self):
+        mirror = self.mirror
+        out = []
+        status = (mirror.score, mirror.over)
+        if status != self.status:
+            self.status = status
+            out.append("\x1b[1;{}H\x1b[0m{} {}{}\x1b[K".format(
+                       self.column, self.title, mirror.score, " - out" if mirror.over else ""))
+        for y in sorted(mirror.dirty):
+            out.append("\x1b[{};{}H".format(y+2, self.column))
+            out.extend("\x1b[48;5;{}m ".format(self.color(i)) for i in mirror.row(y))
+        mirror.dirty.clear()
+        if out:
+            out.append("\x1b[0m")
+            self.stream.write("".join(out))
+            self.stream.flush()
+
+    def color(self, index):
+        if index == 0: return AnsiBackend.BACKGROUND
+        if index < len(wire.PALETTE): return AnsiBackend.palette_index(wire.PALETTE[index])
+        return 15
+
+class CanvasMirrorView(MirrorView):
+    ''' CanvasMirrorView class:
+        The opponent in a small window of its own, one Image the changed
+        cells are painted into
+    '''
+
+    CELL = 8
+    BACKGROUND = 'light gray'
+
+    def __init__(self, mirror, title="Opponent"):
+        super().__init__(mirror)
+        self.title = title
+        self.win = None
+        self.size = None
+
+    def open(self):
+        mirror, cell = self.mirror, self.CELL
+        if self.win: self.win.close()
+        width, height = mirror.width*cell, mirror.height*cell
+        self.win = GraphWin(self.title, width, height, autoflush=False)
+        self.image = Image(Point(width/2, height/2), width, height)
+        self.image.fillRect(0, 0, width, height, self.BACKGROUND)
+        self.image.draw(self.win)
+        self.size = (mirror.width, mirror.height)
+
+    def draw(self):
+        mirror, cell = self.mirror, self.CELL
+        if self.size != (mirror.width, mirror.height): self.open()
+        if self.win.isClosed():
+            mirror.dirty.clear()
+            return
+        for y in mirror.dirty:
+            for x, index in enumerate(mirror.row(y)):
+                color = self.BACKGROUND if index == 0 else (
+                        wire.PALETTE[index] if index < len(wire.PALETTE) else 'white')
+                self.image.fillRect(x*cell, y*cell, (x+1)*cell, (y+1)*cell, color)
+        mirror.dirty.clear()
+        title = "{} - {}{}".format(self.title, mirror.score, " - out" if mirror.over else "")
+        if self.win.master.title() != title: self.win.master.title(title)
+
+    def close(self):
+        if self.win: self.win.close()
+
+def mirror_view(mirror, backend):
+    ''' Return value: type: MirrorView - the view that fits the local backend '''
+    if isinstance(backend, AnsiBackend): # clear of the performance overlay
+        return AnsiMirrorView(mirror, backend.stream, 2*backend.board.width + 20)
+    if isinstance(backend, CanvasBackend): return CanvasMirrorView(mirror)
+    return MirrorView(mirror)
+
+
+############################################################
+# MATCH
+############################################################
+
+class Versus():
+    ''' Versus class:
+        One side of a match: the local game, the connection to the other
+        side and the mirror of the other side's board
+        Attributes: game - type: Tetris - the local game
+                    channel - type: wire.Channel - the connection
+                    mirror - type: wire.MirrorBoard - the opponent's board
+                    pending - type: int - garbage rows waiting for the next landing
+                    lines - type: int - rows cleared by the local game
+                    rtt - type: Histogram - PING round trip times
+    '''
+
+    ATTACK = {2: 1, 3: 2, 4: 4} # rows cleared at once -> garbage rows sent
+    RATE = 120 # state updates per second, at most
+    PING_PERIOD = 0.25
+
+    def __init__(self, game, channel, agent=None, view=True, seed=None):
+        self.game = game
+        self.channel = channel
+        self.agent = agent
+        self.encoder = wire.StateEncoder(game.board)
+        self.mirror = wire.MirrorBoard()
+        self.view = mirror_view(self.mirror, game.board.backend) if view else MirrorView(self.mirror)
+        self.rng = random.Random(seed) # picks the hole of the garbage rows sent
+        self.pending = []
+        self.lines = 0
+        self.sent_garbage = 0
+        self.received_garbage = 0
+        self.resyncs = 0
+        self.rtt = Histogram()
+        self.opponent_left = False
+        game.board.on_clear.append(self._on_clear)
+        game.on_land.append(self._on_land)
+
+    def _on_clear(self, rows):
+        self.lines += rows
+        attack = self.ATTACK.get(rows, 0)
+        while attack and self.pending: # cancel incoming garbage first
+            lines, hole = self.pending[0]
+            used = min(attack, lines)
+            attack -= used
+            if used == lines: self.pending.pop(0)
+            else: self.pending[0] = (lines - used, hole)
+        if attack:
+            self.sent_garbage += attack
+            hole = self.rng.randrange(self.game.board.width)
+            self.channel.send(wire.GARBAGE, wire.GARBAGE_LINES.pack(attack, hole))
+
+    def _on_land(self, game):
+        while self.pending and not game.board.game_over:
+            lines, hole = self.pending.pop(0)
+            game.board.add_garbage(lines, hole)
+
+    def pending_rows(self):
+        return sum(lines for lines, hole in self.pending)
+
+    async def run(self):
+        ''' Plays until either game is over or the other side leaves
+            Return value: type: bool - whether the local side won
+        '''
+        self.done = asyncio.Event()
+        self.channel.send(wire.HELLO, wire.hello(self.game.board))
+        tasks = [asyncio.ensure_future(task) for task in (self.send(), self.receive(), self.ping())]
+        runner = asyncio.ensure_future(AsyncGame(self.game, self.agent, linger=False).run())
+        ended = asyncio.ensure_future(self.done.wait())
+        try:
+            await asyncio.wait([runner, ended], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in [runner, ended] + tasks: task.cancel()
+            results = await asyncio.gather(runner, ended, *tasks, return_exceptions=True)
+            self.flush(final=True)
+            self.channel.send(wire.BYE)
+            try:
+                await asyncio.wait_for(self.channel.drain(), 1.0)
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+            self.channel.close()
+            self.encoder.close()
+            self.view.close()
+        for result in results: # a task that failed ends the match, say why
+            if isinstance(result, Exception): raise result
+        return self.won()
+
+    def won(self):
+        if self.game.board.game_over: return False
+        return self.mirror.over or self.opponent_left
+
+    def flush(self, final=False):
+        ''' Sends what changed on the local board since the last flush '''
+        for kind, payload in self.encoder.encode():
+            self.channel.send(kind, payload)
+        status = self.encoder.status_message(self.lines, force=final)
+        if status: self.channel.send(*status)
+
+    async def send(self):
+        period = 1/self.RATE
+        while True:
+            self.flush()
+            if self.game.board.game_over: self.done.set()
+            await self.channel.drain()
+            await asyncio.sleep(period)
+
+    async def receive(self):
+        channel, mirror = self.channel, self.mirror
+        while True:
+            message = await channel.receive()
+            if message is None:
+                self.opponent_left = True
+                break
+            kind, payload, gap = message
+            if gap: # ask for every row again rather than guess what was lost
+                self.resyncs += 1
+                channel.send(wire.RESYNC)
+            if mirror.apply(kind, payload):
+                self.view.draw()
+                if mirror.over: break
+            elif kind == wire.GARBAGE:
+                lines, hole = wire.GARBAGE_LINES.unpack(payload)
+                self.received_garbage += lines
+                self.pending.append((lines, hole))
+            elif kind == wire.RESYNC:
+                self.encoder.keyframe_due = True
+            elif kind == wire.PING:
+                channel.send(wire.PONG, payload)
+            elif kind == wire.PONG:
+                sent, = wire.TIME.unpack(payload)
+                self.rtt.record(time.perf_counter() - sent)
+            elif kind == wire.BYE:
+                self.opponent_left = True
+                break
+        self.done.set()
+
+    async def ping(self):
+        while True:
+            self.channel.send(wire.PING, wire.TIME.pack(time.perf_counter()))
+            await asyncio.sleep(self.PING_PERIOD)
+
+    def report(self):
+        ms = 1e3
+        lines = ["{}: score {} ({} rows), opponent {} ({} rows)".format(
+                 "You win" if self.won() else "You lose", self.game.board.score, self.lines,
+                 self.mirror.score, self.mirror.lines),
+                 "garbage: {} rows sent, {} received".format(self.sent_garbage, self.received_garbage),
+                 "messages: {} sent ({} bytes), {} received ({} bytes), {} lost, {} resyncs".format(
+                 self.channel.sent, self.channel.bytes_sent, self.channel.received,
+                 self.channel.bytes_received, self.channel.lost, self.resyncs)]
+        if self.rtt.count:
+            lines.append("round trip: p50 {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms; "
+                         "state is sent every {:.1f} ms".format(
+                         self.rtt.percentile(50)*ms, self.rtt.percentile(95)*ms,
+                         self.rtt.max*ms, ms/self.RATE))
+        return "\n".join(lines)
+
+
+############################################################
+# CONNECTIONS
+############################################################
+
+def parse_address(address):
+    ''' Parameter: address - type: string - tcp:HOST:PORT, HOST:PORT or unix:PATH
+        Return value: type: tuple - ('tcp', host, port) or ('unix', path)
+    '''
+    if address.startswith('unix:'):
+        return ('unix', address[5:])
+    if address.startswith('tcp:'):
+        address = address[4:]
+    host, _, port = address.rpartition(':')
+    return ('tcp', host or '127.0.0.1', int(port))
+
+async def listen(address):
+    ''' Waits for one opponent to connect
+        Return value: type: tuple - (server, a future of the Channel)
+    '''
+    connected = asyncio.get_running_loop().create_future()
+    def accept(reader, writer):
+        if not connected.done(): connected.set_result(wire.Channel(reader, writer))
+        else: writer.close() # one opponent at a time
+    kind, *where = parse_address(address)
+    if kind == 'unix':
+        server = await asyncio.start_unix_server(accept, where[0])
+    else:
+        server = await asyncio.start_server(accept, *where)
+    return server, connected
+
+async def connect(address):
+    kind, *where = parse_address(address)
+    if kind == 'unix':
+        reader, writer = await asyncio.open_unix_connection(where[0])
+    else: # asyncio turns Nagle's algorithm off, so small messages leave at once
+        reader, writer = await asyncio.open_connection(*where)
+    return wire.Channel(reader, writer)
+
+def server_address(server, address):
+    ''' The address a client connects to, with the port the server got for port 0 '''
+    kind, *where = parse_address(address)
+    if kind == 'unix': return address
+    host, port = server.sockets[0].getsockname()[:2]
+    return "tcp:{}:{}".format(host, port)
+
+
+def make_game(args, title, render_mode, seed):
+    return Tetris(title, delay=args.delay, render_mode=render_mode, seed=seed,
+                  width=args.width, height=args.height)
+
+async def play(args):
+    agent = GreedyAgent() if args.agent else None
+    if args.connect:
+        channel = await connect(args.connect)
+        local = Versus(make_game(args, "Tetris versus", args.render, args.seed),
+                       channel, agent, seed=args.seed)
+        won = await local.run()
+        print(local.report(), file=sys.stderr)
+        local.game.close()
+        return won
+
+    server, connected = await listen(args.listen or 'tcp:127.0.0.1:0')
+    opponent = None
+    if args.loopback:
+        # The stand-in opponent: a bot on the same loop, over a real connection
+        bot_channel = await connect(server_address(server, args.listen or 'tcp:127.0.0.1:0'))
+        bot_seed = None if args.seed is None else args.seed + 1
+        opponent = Versus(make_game(args, "bot", 'null', bot_seed), bot_channel, GreedyAgent(),
+                          view=False, seed=bot_seed)
+    else:
+        print("Waiting for an opponent on {}".format(server_address(server, args.listen)),
+              file=sys.stderr)
+    channel = await connected
+    server.close()
+    local = Versus(make_game(args, "Tetris versus", args.render, args.seed), channel, agent,
+                   seed=args.seed)
+    matches = [local.run()] + ([opponent.run()] if opponent else [])
+    won = (await asyncio.gather(*matches))[0]
+    print(local.report(), file=sys.stderr)
+    local.game.close()
+    if opponent: opponent.game.close()
+    return won
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Two player Tetris over a local socket")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--listen', metavar='ADDRESS', help="wait for an opponent, tcp:HOST:PORT or unix:PATH")
+    where.add_argument('--connect', metavar='ADDRESS', help="join an opponent that is listening")
+    where.add_argument('--loopback', action='store_true', help="play a bot in this process")
+    parser.add_argument('--render', choices=['canvas', 'raster', 'ansi', 'null'], default='canvas')
+    parser.add_argument('--agent', action='store_true', help="let the bot play your side too")
+    parser.add_argument('--delay', type=int, default=800, help="gravity delay in ms")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--size', metavar='COLSxROWS', default='{}x{}'.format(Tetris.BB_WIDTH, Tetris.BB_HEIGHT),
+                        help="the board size in blocks, both sides should use the same")
+    args = parser.parse_args()
+
+    try:
+        args.width, args.height = map(int, args.size.split('x'))
+    except ValueError:
+        parser.error("--size must look like 10x20")
+    if args.width < 4 or args.height < 4:
+        parser.error("the board must be at least 4x4")
+    if args.render == 'null' and not args.agent:
+        parser.error("--render null needs --agent, there is no keyboard")
+
+    try:
+        asyncio.run(play(args))
+    except KeyboardInterrupt:
+        pass
+    except (ConnectionError, FileNotFoundError) as error:
+        sys.exit("Connection failed: {}".format(error))
+
+
+if __name__ == "__main__":
+    main()
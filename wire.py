@@ -0,0 +1,325 @@
+# wire.py
+"""A compact binary format for sending board state between processes.
+
+Every message is a 9 byte header followed by its payload:
+
+    type     u8  - one of the message types below
+    seq      u32 - counts the messages of one direction, so a gap shows
+                   that messages were lost and the receiver asks for a
+                   KEYFRAME (RESYNC)
+    length   u32 - bytes of payload; a KEYFRAME of a 200x1000 board is
+                   over 100 kB
+
+Cells are sent as 4 bit indexes into PALETTE, two per byte, so a row of
+a 10 wide board is 5 bytes. After the first KEYFRAME a sender only sends
+the ROWS that changed since the last message and the falling PIECE when
+it moved, so a tick where nothing happened costs nothing.
+
+Message types and payloads (all big endian):
+    HELLO     u16 width, u16 height
+    KEYFRAME  like ROWS, with every row of the board
+    ROWS      u16 count, then count times u16 y and the packed row
+    PIECE     u8 palette index, u8 n, then n times u16 x, u16 y
+    GARBAGE   u8 lines, u16 hole column
+    STATUS    u32 score, u32 lines cleared, u8 game over
+    RESYNC    -
+    PING      f64 sender time
+    PONG      f64 the time of the PING it answers
+    BYE       -
+
+Example:
+    encoder = StateEncoder(game.board)
+    channel = Channel(reader, writer)
+    channel.send(HELLO, hello(board))
+    for kind, payload in encoder.encode():
+        channel.send(kind, payload)
+"""
+
+import struct
+
+
+HELLO, KEYFRAME, ROWS, PIECE, GARBAGE, STATUS, RESYNC, PING, PONG, BYE = range(1, 11)
+NAMES = {HELLO: 'HELLO', KEYFRAME: 'KEYFRAME', ROWS: 'ROWS', PIECE: 'PIECE',
+         GARBAGE: 'GARBAGE', STATUS: 'STATUS', RESYNC: 'RESYNC', PING: 'PING',
+         PONG: 'PONG', BYE: 'BYE'}
+
+HEADER = struct.Struct('!BII')
+SIZE = struct.Struct('!HH')
+COUNT = struct.Struct('!H')
+CELL = struct.Struct('!HH')
+PIECE_HEADER = struct.Struct('!BB')
+GARBAGE_LINES = struct.Struct('!BH')
+STATUS_FIELDS = struct.Struct('!IIB')
+TIME = struct.Struct('!d')
+
+# Index 0 is an empty cell; a color missing here is sent as index 15
+PALETTE = [None, 'blue', 'orange', 'cyan', 'red', 'green', 'yellow', 'magenta', 'dim gray']
+UNKNOWN = 15
+INDEX = {color: i for i, color in enumerate(PALETTE) if color}
+
+
+############################################################
+# PACKING
+############################################################
+
+def pack_row(indexes):
+    ''' Parameter: indexes - type: list - a palette index per cell
+        Return value: type: bytes - two cells per byte, the first in the high nibble
+    '''
+    if len(indexes) % 2: indexes = indexes + [0]
+    return bytes(a << 4 | b for a, b in zip(indexes[::2], indexes[1::2]))
+
+def unpack_row(data, width):
+    ''' Return value: type: list - the palette index of every cell of a packed row '''
+    indexes = []
+    for byte in data:
+        indexes.append(byte >> 4)
+        indexes.append(byte & 15)
+    return indexes[:width]
+
+def row_bytes(width):
+    return (width+1)//2
+
+def keyframe_size(width, height):
+    ''' Return value: type: int - bytes of the KEYFRAME of a width x height
+        board, header included
+    '''
+    return HEADER.size + COUNT.size + height*(COUNT.size + row_bytes(width))
+
+def hello(board):
+    return SIZE.pack(board.width, board.height)
+
+def rows_payload(rows):
+    ''' Parameter: rows - type: list - (y, packed row) pairs '''
+    return COUNT.pack(len(rows)) + b''.join(COUNT.pack(y) + data for y, data in rows)
+
+def read_rows(payload, width):
+    ''' Return value: type: list - (y, packed row) pairs of a ROWS or KEYFRAME payload '''
+    count, = COUNT.unpack_from(payload)
+    size = row_bytes(width)
+    rows, offset = [], COUNT.size
+    for i in range(count):
+        y, = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        rows.append((y, payload[offset:offset+size]))
+        offset += size
+    return rows
+
+def piece_payload(color, cells):
+    return (PIECE_HEADER.pack(INDEX.get(color, UNKNOWN), len(cells)) +
+            b''.join(CELL.pack(x, y) for x, y in cells))
+
+def read_piece(payload):
+    ''' Return value: type: tuple - (palette index, list of (x, y)) '''
+    index, n = PIECE_HEADER.unpack_from(payload)
+    cells = [CELL.unpack_from(payload, PIECE_HEADER.size + i*CELL.size) for i in range(n)]
+    return index, cells
+
+
+############################################################
+# ENCODER
+############################################################
+
+class StateEncoder():
+    ''' StateEncoder class:
+        Turns the changes of a Board into ROWS and PIECE messages. It
+        watches the board through a row tracker (Board.track_rows), so it
+        only ever packs rows that changed, and it leaves the falling shape
+        out of the rows: the shape moves every tick and goes out as a small
+        PIECE message instead.
+        Attributes: board - type: Board - the board being sent
+                    sent - type: list - the packed rows the receiver has, by y
+                    keyframe_due - type: bool - the next encode sends every row
+    '''
+
+    def __init__(self, board):
+        self.board = board
+        self.tracker = board.track_rows()
+        self.sent = [None]*board.height
+        self.piece = None     # (color, cells) last sent
+        self.piece_rows = ()  # rows the last sent piece covered
+        self.status = None
+        self.keyframe_due = True
+
+    def close(self):
+        self.board.untrack_rows(self.tracker)
+
+    def pack(self, y, skip):
+        board = self.board
+        blank = board.blank_block
+        indexes = []
+        for column in board.grid:
+            block = column[y]
+            if block is blank or block in skip: indexes.append(0)
+            else: indexes.append(INDEX.get(block.color, UNKNOWN))
+        return pack_row(indexes)
+
+    def encode(self):
+        ''' Return value: type: list - (type, payload) messages that bring the
+            receiver up to date, empty if nothing changed
+        '''
+        board = self.board
+        falling = [] if board.cant_move or board.game_over else board.active_shape.get_blocks()
+        skip = set(falling)
+        messages = []
+
+        if self.keyframe_due:
+            dirty = range(board.height)
+        else:
+            # The rows of the last piece change too when it lands or
+            #   disappears, without a block being put in or taken out
+            dirty = self.tracker | set(self.piece_rows)
+        self.tracker.clear()
+        changed = []
+        for y in sorted(dirty):
+            data = self.pack(y, skip)
+            if self.keyframe_due or data != self.sent[y]:
+                self.sent[y] = data
+                changed.append((y, data))
+        if self.keyframe_due:
+            messages.append((KEYFRAME, rows_payload(changed)))
+        elif changed:
+            messages.append((ROWS, rows_payload(changed)))
+
+        piece = (falling[0].color if falling else None, [(b.x, b.y) for b in falling])
+        if piece != self.piece or self.keyframe_due:
+            self.piece = piece
+            self.piece_rows = [y for x, y in piece[1]]
+            messages.append((PIECE, piece_payload(*piece)))
+        self.keyframe_due = False
+        return messages
+
+    def keyframe(self):
+        ''' Return value: type: list - messages with the whole state as of the
+            last encode, for a receiver that joins or falls behind while the
+            others keep getting the deltas that follow it
+        '''
+        messages = [(KEYFRAME, rows_payload(list(enumerate(self.sent)))),
+                    (PIECE, piece_payload(*self.piece))]
+        if self.status is not None:
+            messages.append((STATUS, STATUS_FIELDS.pack(*self.status)))
+        return messages
+
+    def status_message(self, lines, force=False):
+        ''' Return value: type: tuple - a STATUS message, or None if the
+            score, lines and game over are what was sent last
+        '''
+        status = (self.board.score, lines, self.board.game_over)
+        if status == self.status and not force: return None
+        self.status = status
+        return STATUS, STATUS_FIELDS.pack(*status)
+
+
+############################################################
+# DECODER
+############################################################
+
+class MirrorBoard():
+    ''' MirrorBoard class:
+        The receiving side's copy of a remote board, kept up to date by
+        applying its messages
+        Attributes: width, height - type: int - set by HELLO
+                    cells - type: list - cells[y][x] is a palette index
+                    piece - type: tuple - (palette index, cells) of the falling shape
+                    dirty - type: set - rows changed since a view last drew them
+                    score, lines - type: int - from STATUS
+                    over - type: bool - the remote game has ended
+    '''
+
+    def __init__(self, width=0, height=0):
+        self.resize(width, height)
+        self.score = 0
+        self.lines = 0
+        self.over = False
+
+    def resize(self, width, height):
+        self.width, self.height = width, height
+        self.cells = [[0]*width for y in range(height)]
+        self.piece = (0, [])
+        self.dirty = set(range(height))
+
+    def apply(self, kind, payload):
+        ''' Applies one message, returns False for types it does not handle '''
+        if kind == HELLO:
+            self.resize(*SIZE.unpack(payload))
+        elif kind in (ROWS, KEYFRAME):
+            for y, data in read_rows(payload, self.width):
+                if y < self.height:
+                    self.cells[y] = unpack_row(data, self.width)
+                    self.dirty.add(y)
+        elif kind == PIECE:
+            self.dirty.update(y for x, y in self.piece[1])
+            self.piece = read_piece(payload)
+            self.dirty.update(y for x, y in self.piece[1] if y < self.height)
+        elif kind == STATUS:
+            self.score, self.lines, over = STATUS_FIELDS.unpack(payload)
+            self.over = bool(over)
+        else:
+            return False
+        return True
+
+    def row(self, y):
+        ''' Return value: type: list - the palette index of every cell of
+            row y, with the falling piece in it
+        '''
+        row = list(self.cells[y])
+        index, cells = self.piece
+        for x, py in cells:
+            if py == y and x < self.width: row[x] = index
+        return row
+
+
+############################################################
+# CHANNEL
+############################################################
+
+class Channel():
+    ''' Channel class:
+        Messages over an asyncio stream pair (TCP or Unix socket)
+        Attributes: sent - type: int - messages sent, the next sequence number
+                    received - type: int - messages received
+                    lost - type: int - messages missing from the sequence
+                    bytes_sent, bytes_received - type: int - including headers
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.sent = 0
+        self.expected = 0
+        self.received = 0
+        self.lost = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, kind, payload=b''):
+        ''' Buffers one message; the stream writes it without waiting '''
+        data = HEADER.pack(kind, self.sent & 0xffffffff, len(payload)) + payload
+        self.sent += 1
+        self.bytes_sent += len(data)
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def receive(self):
+        ''' Return value: type: tuple - (type, payload, gap) where gap is the
+            number of messages lost just before this one, or None when the
+            other side closed the connection
+        '''
+        try:
+            header = await self.reader.readexactly(HEADER.size)
+            kind, seq, length = HEADER.unpack(header)
+            payload = await self.reader.readexactly(length) if length else b''
+        except (EOFError, ConnectionError, OSError):
+            return None
+        gap = (seq - self.expected) & 0xffffffff
+        self.expected = (seq + 1) & 0xffffffff
+        self.lost += gap
+        self.received += 1
+        self.bytes_received += HEADER.size + length
+        return kind, payload, gap
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()